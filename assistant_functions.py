@@ -1,12 +1,13 @@
-import json
 import os
 import subprocess
 from socket import inet_aton, inet_pton, AF_INET, error
-from queue import Queue, Empty
-from threading import Thread
+from collections import deque
+from threading import Thread, Lock
+
+from config_store import ConfigStore, DEFAULT_SERVER
 
 ROOT_DIR: str = os.path.abspath(os.path.dirname(__file__))
-_stdout_read_queue: Queue = Queue()
+config_store: ConfigStore = ConfigStore(os.path.join(ROOT_DIR, "config.json"))
 
 
 def is_valid_ipv4_address(address: str) -> bool:
@@ -31,98 +32,237 @@ def is_valid_ipv4_address(address: str) -> bool:
     return True
 
 
-def get_ip() -> str:
+def get_ip(server: str = DEFAULT_SERVER) -> str:
     """
     Returns the IP address bound by the user. Throws exception if unbound.
-    >>> get_ip()
-    127.0.0.1
+    :param server: Name of the server, the top level config being the default server.
+    >>> get_ip("unknown")
+    Traceback (most recent call last):
+    ...
+    KeyError: 'Unknown server unknown. See mc!servers'
     """
-    cfg_path: str = os.path.join(ROOT_DIR, "config.json")
-    with open(cfg_path, 'r') as cfg:
-        try:
-            cfg_json: dict = json.load(cfg)
-            return cfg_json["ip_address"]
-        except (json.decoder.JSONDecodeError, KeyError):
-            raise KeyError("IP Address not bound. See mc!help")
+    ip_address: (str, None) = config_store.config.server(server).ip_address
+    if ip_address is None:
+        raise KeyError("IP Address not bound. See mc!help")
+    return ip_address
 
 
-def get_path() -> str:
+def get_path(server: str = DEFAULT_SERVER) -> str:
     """
     Returns the jar path bound by the user. Throws exception if unbound.
-    >>> get_path()
-    C:\\Users\\user\\server\\minecraft_server.jar
+    :param server: Name of the server, the top level config being the default server.
+    >>> get_path("unknown")
+    Traceback (most recent call last):
+    ...
+    KeyError: 'Unknown server unknown. See mc!servers'
     """
-    cfg_path: str = os.path.join(ROOT_DIR, "config.json")
-    with open(cfg_path, 'r') as cfg:
-        try:
-            cfg_json: dict = json.load(cfg)
-            return cfg_json["jar_path"]
-        except (json.decoder.JSONDecodeError, KeyError):
-            raise KeyError("Jar path not bound. See mc!help")
+    jar_path: (str, None) = config_store.config.server(server).jar_path
+    if jar_path is None:
+        raise KeyError("Jar path not bound. See mc!help")
+    return jar_path
 
 
-def get_mem() -> int:
+def get_mem(server: str = DEFAULT_SERVER) -> int:
     """
     Returns default memory from config. If absent, returns 1024.
+    :param server: Name of the server, the top level config being the default server.
     :return:
     """
-    cfg_path: str = os.path.join(ROOT_DIR, "config.json")
-    with open(cfg_path, 'r') as cfg:
-        try:
-            cfg_json: dict = json.load(cfg)
-            return int(cfg_json["mem_alloc"])
-        except (json.decoder.JSONDecodeError, KeyError):
-            return 1024
+    return config_store.config.server(server).mem_alloc
+
+
+def read_meminfo() -> dict[str, int]:
+    """
+    Parses /proc/meminfo. Returns an empty dictionary where it does not exist.
+    :return: Dictionary of field to value in kB.
+    >>> all(isinstance(value, int) for value in read_meminfo().values())
+    True
+    """
+    meminfo: dict[str, int] = {}
+    try:
+        with open("/proc/meminfo", 'r') as info:
+            for line in info:
+                key, _, value = line.partition(":")
+                meminfo[key] = int(value.split()[0])
+    except (OSError, ValueError, IndexError):
+        pass
+    return meminfo
+
+
+def host_memory_mb() -> (int, None):
+    """
+    Returns the host's total RAM in MB, None if it can not be determined.
+    """
+    meminfo: dict[str, int] = read_meminfo()
+    if "MemTotal" in meminfo:
+        return meminfo["MemTotal"] // 1024
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def get_relay_latency() -> float:
+    """
+    Returns the console relay's latency deadline in seconds from config. If absent, returns 2.0.
+    """
+    return config_store.config.relay_latency
+
+
+def get_live_console() -> bool:
+    """
+    Returns whether the console relay edits one rolling message instead of posting new ones. If absent, returns False.
+    """
+    return config_store.config.live_console
+
+
+def get_idle_grace() -> float:
+    """
+    Returns, in seconds, how long an empty server may stay up after it is ready. Configured in minutes.
+    If absent, returns twenty minutes.
+    """
+    return config_store.config.idle_grace * 60
 
 
-def write_to_config(key: str, value: str) -> None:
+def get_query_enabled() -> bool:
     """
-    Opens config.json and writes new data
+    Returns whether status queries also use the query protocol for player names. If absent, returns False.
+    """
+    return config_store.config.query_enabled
+
+
+def format_duration(seconds: float) -> str:
+    """
+    Formats a duration in days, hours and minutes.
+    >>> format_duration(3 * 3600 + 12 * 60 + 5)
+    '3h 12m'
+    >>> format_duration(20)
+    '0m'
+    """
+    minutes, _ = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    parts: list[str] = [f"{days}d"] if days else []
+    parts += [f"{hours}h"] if hours or days else []
+    return " ".join(parts + [f"{minutes}m"])
+
+
+def format_bytes(size: float) -> str:
+    """
+    Formats a size in bytes with a binary unit.
+    >>> format_bytes(8 * 1024 ** 2)
+    '8.0 MiB'
+    >>> format_bytes(512)
+    '512 B'
+    """
+    if size < 1024:
+        return f"{size:.0f} B"
+    for unit in ("KiB", "MiB", "GiB"):
+        size /= 1024
+        if size < 1024:
+            break
+    else:
+        size /= 1024
+        unit = "TiB"
+    return f"{size:.1f} {unit}"
+
+
+def write_to_config(key: str, value: str, server: str = DEFAULT_SERVER) -> None:
+    """
+    Validates and writes new data to config.json, atomically and one writer at a time.
+    Raises ValueError if the value does not fit the key.
     :param key:  Any string key
     :param value: Any string Value
-    >>> write_to_config("ip_address", "127.0.0.1")
-    Will attempt to open config.json in local dir and write new key and value.
+    :param server: Name of the server whose section is written. The default server writes top level keys.
+    >>> write_to_config("mem_alloc", "lots")  # nothing is written
+    Traceback (most recent call last):
+    ...
+    ValueError: invalid literal for int() with base 10: 'lots'
     """
-    cfg_path: str = os.path.join(ROOT_DIR, "config.json")
-    with open(cfg_path, 'r') as cfg:
-        try:
-            cfg_json: dict = json.load(cfg)
-        except json.decoder.JSONDecodeError:
-            cfg_json: dict = {}
-        cfg_json[key] = value
-    with open(cfg_path, 'w') as cfg:
-        json.dump(cfg_json, cfg, indent=6)
+    config_store.set_server(server, key, value)
 
 
-def proc_read(proc: subprocess.Popen) -> str:
+class StdoutPump:
     """
-     a non-blocking stdout.readline()
-    :param proc: Any subprocess Popen with a stdout attribute.
-    :return: None. Sends message to context channel.
-    >>> proc_read(proc)
-    "Seed: 214890214080412 \n"
+    A single long-lived reader of a server process' stdout.
+    One daemon thread reads every line into a bounded buffer, which the event loop drains each tick.
+    When the buffer is full, the oldest lines are dropped and counted.
+    >>> import sys, time
+    >>> proc = subprocess.Popen([sys.executable, "-c", "print('Starting minecraft server version 1.20.1')"],
+    ...                         stdout=subprocess.PIPE)
+    >>> pump = StdoutPump(proc)
+    >>> pump.start()
+    >>> while pump.alive:
+    ...     time.sleep(.01)
+    >>> pump.drain(), proc.wait()
+    (['Starting minecraft server version 1.20.1'], 0)
     """
 
-    def enqueue_output(out, queue):
-        try:
-            for line in iter(out.readline, b''):
-                queue.put(line)
-            out.close()
-        # ValueError indicates there is nothing to read from, ie server closed
-        except ValueError:
+    def __init__(self, proc: subprocess.Popen, max_pending: int = 5000):
+        """
+        :param proc: Any subprocess Popen with a stdout attribute.
+        :param max_pending: Maximum amount of lines kept before the oldest ones are dropped.
+        """
+        self._proc: subprocess.Popen = proc
+        self._max_pending: int = max_pending
+        self._buffer: deque[str] = deque()
+        self._lock: Lock = Lock()
+        self._thread: (Thread, None) = None
+        self._running: bool = False
+
+        self.lines_read: int = 0
+        self.lines_dropped: int = 0
+
+    @property
+    def pending(self) -> int:
+        """Amount of lines read but not yet drained."""
+        return len(self._buffer)
+
+    @property
+    def alive(self) -> bool:
+        """True while the reader thread is still reading from stdout."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Starts the reader thread. Calling it more than once does nothing."""
+        if self._thread is not None:
             return
+        self._running = True
+        self._thread = Thread(target=self._pump, daemon=True)  # thread dies with the program
+        self._thread.start()
 
-    stdout_read_thread = Thread(target=enqueue_output, args=(proc.stdout, _stdout_read_queue))
-    stdout_read_thread.daemon = True  # thread dies with the program
-    stdout_read_thread.start()
+    def stop(self, timeout: float = 1.0) -> None:
+        """
+        Stops accepting new lines. The thread itself finishes once the process closes its stdout.
+        :param timeout: Seconds to wait for the reader thread to finish.
+        """
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout)
 
-    # read line without blocking
-    try:
-        output = _stdout_read_queue.get_nowait()  # q.get(timeout=.1) also works
-    except Empty:
-        return ""
-    else:
+    def drain(self, limit: (int, None) = None) -> list[str]:
+        """
+        Pops pending lines without blocking.
+        :param limit: Maximum amount of lines to pop. None pops everything.
+        :return: List of lines, oldest first, without trailing newlines.
+        """
+        with self._lock:
+            count: int = len(self._buffer) if limit is None else min(limit, len(self._buffer))
+            return [self._buffer.popleft() for _ in range(count)]
+
+    def _pump(self) -> None:
+        out = self._proc.stdout
         try:
-            return output.decode().strip() + "\n"
-        except UnicodeDecodeError:
-            return ""
+            for raw in iter(out.readline, b''):
+                if not self._running:
+                    break
+                line: str = raw.decode(errors="replace").rstrip()
+                with self._lock:
+                    self._buffer.append(line)
+                    self.lines_read += 1
+                    if len(self._buffer) > self._max_pending:
+                        self._buffer.popleft()
+                        self.lines_dropped += 1
+        # ValueError indicates there is nothing to read from, ie server closed
+        except ValueError:
+            return
@@ -0,0 +1,231 @@
+import gzip
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, asdict
+from time import monotonic, strftime
+
+# Logged once save-all flush has written every chunk: "Saved the game" since 1.17, "Saved the world" before
+SAVED_PATTERN: re.Pattern = re.compile(r"\]: Saved the (game|world)\s*$")
+# Files the server keeps open and rewrites on every launch, restoring them would be meaningless
+SKIPPED_FILES: set[str] = {"session.lock"}
+READ_CHUNK: int = 1024 * 1024
+
+
+def hash_file(path: str) -> str:
+    """SHA-256 of a file's content, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        while chunk := file.read(READ_CHUNK):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def store_file(path: str, objects_dir: str, compress_level: int = 6) -> tuple[str, int]:
+    """
+    Stores a file in the object store under the hash of its content, compressed with gzip.
+    Runs in a worker process of the backup's pool.
+    :return: (hash of the content, compressed bytes written, 0 if the store already had the content)
+    """
+    digest: str = hash_file(path)
+    object_path: str = os.path.join(objects_dir, digest[:2], digest[2:])
+    if os.path.exists(object_path):
+        return digest, 0
+    os.makedirs(os.path.dirname(object_path), exist_ok=True)
+    # compress next to the object, then rename it in place, so an interrupted backup leaves no half object
+    temp_path: str = f"{object_path}.{os.getpid()}.tmp"
+    with open(path, 'rb') as source, gzip.open(temp_path, 'wb', compresslevel=compress_level) as target:
+        shutil.copyfileobj(source, target, READ_CHUNK)
+    os.replace(temp_path, object_path)
+    return digest, os.path.getsize(object_path)
+
+
+def restore_file(object_path: str, target_path: str, mtime_ns: int) -> None:
+    """
+    Decompresses an object to its place in the world, with the mtime it had when it was backed up,
+    so the next backup recognizes it as unchanged.
+    """
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    with gzip.open(object_path, 'rb') as source, open(target_path, 'wb') as target:
+        shutil.copyfileobj(source, target, READ_CHUNK)
+    os.utime(target_path, ns=(mtime_ns, mtime_ns))
+
+
+@dataclass
+class BackupReport:
+    """What a snapshot cost."""
+    snapshot: str
+    files: int
+    changed: int  # files read again because their size or mtime changed since the previous snapshot
+    world_bytes: int
+    written_bytes: int  # compressed bytes of content the store did not have yet
+    duration: float  # seconds spent on the snapshot
+    paused: float = 0.0  # seconds the server had saving turned off
+
+
+class BackupStore:
+    """
+    Incremental, deduplicating snapshots of a world directory.
+    Every file's content is stored once, compressed, under its SHA-256 in objects/.
+    A snapshot is a manifest in snapshots/ mapping every path of the world to its content,
+    so an unchanged region file costs one manifest entry instead of a copy.
+    Files with the size and mtime they had in the previous snapshot are not even read again.
+    >>> import tempfile
+    >>> directory = tempfile.TemporaryDirectory()
+    >>> world = os.path.join(directory.name, "world")
+    >>> os.makedirs(os.path.join(world, "region"))
+    >>> for name in ("level.dat", "region/r.0.0.mca"):
+    ...     with open(os.path.join(world, name), 'wb') as world_file:
+    ...         _ = world_file.write(b"chunk" * 1000)
+    >>> store = BackupStore(os.path.join(directory.name, "backups"), workers=1)
+    >>> report = store.snapshot(world)
+    >>> report.files, report.changed, report.world_bytes
+    (2, 2, 10000)
+    >>> report = store.snapshot(world)  # nothing changed: no file is read again, no content is stored again
+    >>> report.files, report.changed, report.written_bytes, len(store.snapshots())
+    (2, 0, 0, 2)
+    >>> directory.cleanup()
+    """
+
+    def __init__(self, root: str, compress_level: int = 6, workers: (int, None) = None):
+        """
+        :param root: Directory of the store, created on the first snapshot
+        :param compress_level: gzip level of new objects
+        :param workers: Processes compressing changed files, None for one per CPU
+        """
+        self.root: str = root
+        self.objects_dir: str = os.path.join(root, "objects")
+        self.snapshots_dir: str = os.path.join(root, "snapshots")
+        self.compress_level: int = compress_level
+        self.workers: (int, None) = workers
+
+    def snapshots(self) -> list[str]:
+        """Names of every snapshot, oldest first. Names are timestamps, ie 20240501-180311."""
+        try:
+            return sorted(name[:-len(".json")] for name in os.listdir(self.snapshots_dir) if name.endswith(".json"))
+        except FileNotFoundError:
+            return []
+
+    def manifest(self, name: str) -> dict:
+        """Reads a snapshot's manifest. Raises FileNotFoundError for unknown snapshots."""
+        if os.path.basename(name) != name:
+            raise FileNotFoundError(name)
+        with open(os.path.join(self.snapshots_dir, name + ".json"), 'r') as manifest:
+            return json.load(manifest)
+
+    def _new_name(self) -> str:
+        name: str = strftime("%Y%m%d-%H%M%S")
+        existing: set[str] = set(self.snapshots())
+        suffix: int = 1
+        while name in existing:
+            suffix += 1
+            name = f"{strftime('%Y%m%d-%H%M%S')}-{suffix}"
+        return name
+
+    def snapshot(self, world: str) -> BackupReport:
+        """
+        Takes a snapshot of a world. Blocks until every changed file is stored, so call it off the event loop,
+        while the server has saving turned off.
+        :param world: Path of the world directory
+        """
+        start: float = monotonic()
+        if not os.path.isdir(world):
+            raise FileNotFoundError(world)
+        existing: list[str] = self.snapshots()
+        previous: dict = self.manifest(existing[-1])["files"] if existing else {}
+
+        files: dict[str, list] = {}
+        changed: dict[str, str] = {}  # relative path: absolute path, of files which need to be read
+        world_bytes: int = 0
+        for directory, _, names in os.walk(world):
+            for file_name in names:
+                path: str = os.path.join(directory, file_name)
+                relative: str = os.path.relpath(path, world).replace(os.sep, "/")
+                if file_name in SKIPPED_FILES:
+                    continue
+                stat: os.stat_result = os.stat(path)
+                world_bytes += stat.st_size
+                known: (list, None) = previous.get(relative)
+                if known is not None and known[1:] == [stat.st_size, stat.st_mtime_ns]:
+                    files[relative] = known
+                else:
+                    files[relative] = [None, stat.st_size, stat.st_mtime_ns]
+                    changed[relative] = path
+
+        written_bytes: int = 0
+        if changed:
+            os.makedirs(self.objects_dir, exist_ok=True)
+            # spawn, so the workers do not inherit the bot's threads and sockets
+            with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")) \
+                    as pool:
+                futures: dict = {relative: pool.submit(store_file, path, self.objects_dir, self.compress_level)
+                                 for relative, path in changed.items()}
+                for relative, future in futures.items():
+                    digest, written = future.result()
+                    files[relative][0] = digest
+                    written_bytes += written
+
+        name: str = self._new_name()
+        report: BackupReport = BackupReport(snapshot=name, files=len(files), changed=len(changed),
+                                            world_bytes=world_bytes, written_bytes=written_bytes,
+                                            duration=monotonic() - start)
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+        manifest_path: str = os.path.join(self.snapshots_dir, name + ".json")
+        with open(manifest_path + ".tmp", 'w') as manifest:
+            json.dump({"world": os.path.basename(world), "files": files, "report": asdict(report)}, manifest)
+        os.replace(manifest_path + ".tmp", manifest_path)
+        return report
+
+    def restore(self, name: str, world: str) -> (str, None):
+        """
+        Replaces a world with a snapshot. The server must not be running.
+        The snapshot is written next to the world first, then swapped in, and the current world is kept aside.
+        :return: Where the replaced world was moved, None if there was no world.
+        """
+        files: dict = self.manifest(name)["files"]
+        staging: str = world + ".restoring"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures: list = [pool.submit(restore_file, os.path.join(self.objects_dir, digest[:2], digest[2:]),
+                                         os.path.join(staging, *relative.split("/")), mtime_ns)
+                             for relative, (digest, _, mtime_ns) in files.items()]
+            for future in futures:
+                future.result()
+
+        replaced: (str, None) = None
+        if os.path.exists(world):
+            replaced = f"{world}.before-{name}"
+            shutil.rmtree(replaced, ignore_errors=True)
+            os.rename(world, replaced)
+        os.rename(staging, world)
+        return replaced
+
+    def prune(self, keep: int) -> tuple[int, int]:
+        """
+        Deletes all but the newest snapshots, then every object no remaining snapshot refers to.
+        :param keep: Amount of snapshots kept
+        :return: (snapshots deleted, bytes freed)
+        """
+        existing: list[str] = self.snapshots()
+        removed: list[str] = existing[:-keep] if keep > 0 else existing
+        if not removed:
+            return 0, 0
+        for name in removed:
+            os.remove(os.path.join(self.snapshots_dir, name + ".json"))
+
+        referenced: set[str] = set()
+        for name in existing[len(removed):]:
+            referenced.update(digest for digest, _, _ in self.manifest(name)["files"].values())
+        freed: int = 0
+        for directory, _, names in os.walk(self.objects_dir):
+            for object_name in names:
+                if os.path.basename(directory) + object_name not in referenced:
+                    path: str = os.path.join(directory, object_name)
+                    freed += os.path.getsize(path)
+                    os.remove(path)
+        return len(removed), freed
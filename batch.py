@@ -0,0 +1,123 @@
+import asyncio
+import re
+from time import monotonic
+
+TICK: float = 0.05  # seconds of one game tick at 20 TPS
+_PARAMETER_PATTERN: re.Pattern = re.compile(r"\{(?P<name>\w+)\}")
+
+
+def parse_script(text: str) -> list[str]:
+    """
+    Turns a script into commands: one per line, blank lines and # comments skipped, leading slashes removed.
+    >>> parse_script("# spawn platform\\n/fill 0 64 0 10 64 10 stone\\n\\nsay done")
+    ['fill 0 64 0 10 64 10 stone', 'say done']
+    """
+    commands: list[str] = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line and not line.startswith("#"):
+            commands.append(line.removeprefix("/"))
+    return commands
+
+
+def parse_parameters(args: tuple) -> dict[str, str]:
+    """
+    Parameters of a script: name=value arguments by name, the others by position from 1.
+    >>> parse_parameters(("Steve", "y=64"))
+    {'1': 'Steve', 'y': '64'}
+    """
+    parameters: dict[str, str] = {}
+    position: int = 0
+    for arg in args:
+        name, separator, value = arg.partition("=")
+        if separator and name.isidentifier():
+            parameters[name] = value
+        else:
+            position += 1
+            parameters[str(position)] = arg
+    return parameters
+
+
+def substitute(commands: list[str], parameters: dict[str, str]) -> list[str]:
+    """
+    Replaces {name} and {1}, {2}... in every command. Raises KeyError naming the first missing parameter.
+    >>> substitute(["tp {1} 0 {y} 0"], {"1": "Steve", "y": "64"})
+    ['tp Steve 0 64 0']
+    """
+    def replace(match: re.Match) -> str:
+        return parameters[match.group("name")]
+    return [_PARAMETER_PATTERN.sub(replace, command) for command in commands]
+
+
+class BatchJob:
+    """
+    Streams commands into a server at a fixed amount per tick, so a long script does not lag it.
+    Every tick's commands go out in a single write and flush.
+    >>> writes = []
+    >>> job = BatchJob(["say 1", "say 2", "say 3"], per_tick=2)
+    >>> asyncio.run(job.run(writes.append))
+    >>> writes, job.sent, job.done
+    ([['say 1', 'say 2'], ['say 3']], 3, True)
+    """
+
+    def __init__(self, commands: list[str], per_tick: int = 10, tick: float = TICK):
+        """
+        :param commands: Commands without leading slash
+        :param per_tick: Commands written every tick
+        :param tick: Seconds between writes
+        """
+        self.commands: list[str] = commands
+        self.per_tick: int = per_tick
+        self.tick: float = tick
+        self.sent: int = 0
+        self.started_at: (float, None) = None
+        self.finished_at: (float, None) = None
+        self.cancelled: bool = False
+
+    @property
+    def total(self) -> int:
+        return len(self.commands)
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or monotonic()) - self.started_at
+
+    @property
+    def rate(self) -> float:
+        """Commands per second so far."""
+        return self.sent / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def eta(self) -> (float, None):
+        """Seconds until the last command is written, at the configured pace."""
+        if self.done:
+            return 0.0
+        return -(-(self.total - self.sent) // self.per_tick) * self.tick
+
+    def cancel(self) -> None:
+        """Stops before the next tick. Commands already written still run."""
+        self.cancelled = True
+
+    async def run(self, write) -> None:
+        """
+        Writes every command, or until cancelled. Errors of write end the job and are raised.
+        :param write: Callable taking a list of commands, ie ServerInstance.send_commands
+        """
+        self.started_at = monotonic()
+        next_tick: float = self.started_at
+        try:
+            while self.sent < self.total and not self.cancelled:
+                chunk: list[str] = self.commands[self.sent:self.sent + self.per_tick]
+                write(chunk)
+                self.sent += len(chunk)
+                # sleeping until the next tick's start, not for a whole tick, keeps the pace from drifting
+                next_tick += self.tick
+                await asyncio.sleep(max(0.0, next_tick - monotonic()))
+        finally:
+            self.finished_at = monotonic()
@@ -0,0 +1,442 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from time import monotonic, perf_counter, strftime
+
+from console_relay import ConsoleRelay
+from discord_stub import StubBot, StubMessage
+from output_filters import OutputFilter
+from rcon import RconClient
+from reattach import AttachedProcess, PidRecord, find_running, LOG_FILE
+from server_manager import ServerInstance
+from telemetry import percentile, read_proc_stats
+
+FAKE_SERVER: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_server.py")
+CHANNEL_ID: int = 1
+FEEDBACK_TICK: float = 0.5  # seconds, as server_feedback
+RCON_PASSWORD: str = "benchmark"
+# chat lines of fake_server end with their sequence number and emission time
+_STAMP_PATTERN: re.Pattern = re.compile(r"#(?P<sequence>\d+) @(?P<emitted>[\d.]+)$", re.MULTILINE)
+# python -X importtime: "import time: self [us] | cumulative | imported package", nested imports indented
+_IMPORT_TIME_PATTERN: re.Pattern = re.compile(r"^import time:\s+(?P<self>\d+) \|\s+(?P<cumulative>\d+) \| "
+                                              r"(?P<name>.*)$")
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def distribution(values: list[float], scale: float = 1.0, digits: int = 2) -> dict:
+    """
+    Summary of measurements, multiplied by scale.
+    >>> distribution([1, 2, 3, 4], scale=1000)
+    {'count': 4, 'p50': 2000, 'p95': 4000, 'max': 4000}
+    """
+    if not values:
+        return {"count": 0}
+    return {"count": len(values), "p50": round(percentile(values, 50) * scale, digits),
+            "p95": round(percentile(values, 95) * scale, digits), "max": round(max(values) * scale, digits)}
+
+
+def server_property(directory: str, key: str) -> str:
+    with open(os.path.join(directory, "server.properties"), 'r') as properties_file:
+        return next(line.partition("=")[2].strip() for line in properties_file if line.startswith(key + "="))
+
+
+async def start_fake_server(directory: str, *options: str, rcon: bool = False) -> ServerInstance:
+    """
+    Starts fake_server.py in directory through ServerInstance, like mc!launch does, and waits until it is ready.
+    :param options: Options of fake_server.py, ie --chat-rate 200
+    :param rcon: Enable RCON in server.properties
+    """
+    properties: dict[str, str] = {"server-port": str(free_port()), "enable-rcon": str(rcon).lower(),
+                                  "rcon.port": str(free_port()), "rcon.password": RCON_PASSWORD}
+    with open(os.path.join(directory, "server.properties"), 'w') as properties_file:
+        properties_file.writelines(f"{key}={value}\n" for key, value in properties.items())
+
+    instance: ServerInstance = ServerInstance("benchmark")
+    instance.start([sys.executable, FAKE_SERVER, "--startup-seconds", "0.5", *options], directory, 0, CHANNEL_ID)
+    deadline: float = monotonic() + 30
+    while not instance.tracker.ready:
+        if monotonic() > deadline or instance.proc.poll() is not None:
+            raise RuntimeError("fake_server.py did not get ready")
+        for line in instance.pump.drain():
+            instance.tracker.feed(line)
+            instance.presence.feed(line)
+        await asyncio.sleep(.05)
+    return instance
+
+
+async def stop_fake_server(instance: ServerInstance) -> None:
+    await instance.shutdown(10, 5)
+    instance.detach()
+
+
+async def relay_loop(instance: ServerInstance, relay: ConsoleRelay, bot: StubBot, output_filter: OutputFilter,
+                     duration: float, on_tick=None) -> list[float]:
+    """
+    Relays the server's stdout for duration seconds, tick by tick like server_feedback and relay_output.
+    :param on_tick: Callable run after every tick
+    :return: Seconds spent on every tick
+    """
+    tick_seconds: list[float] = []
+    next_tick: float = monotonic()
+    end: float = next_tick + duration
+    while monotonic() < end:
+        start: float = perf_counter()
+        relayed: list[str] = []
+        lines: list[str] = instance.pump.drain()
+        instance.scrollback.extend(lines)
+        for line in lines:
+            if instance.telemetry.feed(line):
+                continue
+            instance.presence.feed(line)
+            instance.tracker.feed(line)
+            destination: (tuple[int, str], None) = output_filter.apply(line, CHANNEL_ID, instance.label)
+            if destination is not None:
+                relayed.append(destination[1])
+        relay.push(CHANNEL_ID, relayed)
+        await relay.flush(bot.get_channel)
+        tick_seconds.append(perf_counter() - start)
+        if on_tick is not None:
+            on_tick()
+        next_tick += FEEDBACK_TICK
+        await asyncio.sleep(max(0.0, next_tick - monotonic()))
+    return tick_seconds
+
+
+async def bench_relay(options: argparse.Namespace) -> dict:
+    """Throughput of the console relay and the lag of every chat line, from emission to the Discord request."""
+    lags: list[float] = []
+
+    def measure(message: StubMessage) -> None:
+        for stamp in _STAMP_PATTERN.finditer(message.content.removesuffix("\n```")):
+            lags.append(message.sent_at - float(stamp.group("emitted")))
+
+    bot: StubBot = StubBot(latency=options.discord_latency, on_send=measure)
+    relay: ConsoleRelay = ConsoleRelay(max_latency=2.0)
+    with tempfile.TemporaryDirectory() as directory:
+        instance: ServerInstance = await start_fake_server(directory, "--chat-rate", str(options.chat_rate),
+                                                           "--players", "4", "--no-log")
+        ticks: list[float] = await relay_loop(instance, relay, bot, OutputFilter([]), options.duration)
+        dropped: int = instance.pump.lines_dropped
+        read: int = instance.pump.lines_read
+        await stop_fake_server(instance)
+    await relay.flush(bot.get_channel, force=True)
+
+    channel = bot.get_channel(CHANNEL_ID)
+    return {
+        "chat_rate": options.chat_rate,
+        "lines_read": read,
+        "lines_dropped": dropped,
+        "chat_lines_relayed": len(lags),
+        "relayed_per_second": round(len(lags) / options.duration, 1),
+        "lines_per_message": round(relay.lines_merged / max(relay.messages_sent, 1), 1),
+        "messages_sent": relay.messages_sent,
+        "rate_limited": channel.rate_limited,
+        "lag_ms": distribution(lags, 1000),
+        "tick_ms": distribution(ticks, 1000),
+        "pending_at_end": relay.pending,
+        "lines_skipped": relay.lines_skipped,
+    }
+
+
+async def bench_status(options: argparse.Namespace) -> dict:
+    """Latency of Server List Ping through StatusService, while commands are streamed into the server's stdin."""
+    from status_service import StatusService  # needs mcstatus, the other benchmarks do not
+
+    service: StatusService = StatusService(ttl=0.0)
+    latencies: list[float] = []
+    errors: list[str] = []
+    with tempfile.TemporaryDirectory() as directory:
+        instance: ServerInstance = await start_fake_server(directory, "--chat-rate", "0", "--no-log")
+        address: str = "127.0.0.1:" + server_property(directory, "server-port")
+        end: float = monotonic() + options.duration
+
+        async def query() -> None:
+            while monotonic() < end:
+                start: float = perf_counter()
+                try:
+                    await service.get(address, max_age=0)
+                    latencies.append(perf_counter() - start)
+                except Exception as e:
+                    errors.append(repr(e))
+
+        async def flood() -> None:
+            per_tick: int = max(1, int(options.command_rate * .05))
+            while monotonic() < end:
+                instance.send_commands([f"say status benchmark {monotonic():.3f}"] * per_tick)
+                instance.pump.drain()
+                await asyncio.sleep(.05)
+
+        await asyncio.gather(flood(), *(query() for _ in range(options.concurrency)))
+        await stop_fake_server(instance)
+    return {
+        "concurrency": options.concurrency,
+        "command_rate": options.command_rate,
+        "queries": service.queries,
+        "coalesced": service.coalesced,
+        "latency_ms": distribution(latencies, 1000),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+    }
+
+
+async def wait_for_line(instance: ServerInstance, text: str, timeout: float = 60) -> None:
+    """Drains the pump until a line ends with text."""
+    deadline: float = monotonic() + timeout
+    while monotonic() < deadline:
+        if any(line.endswith(text) for line in instance.pump.drain()):
+            return
+        await asyncio.sleep(.001)
+    raise TimeoutError(f"No line ending with {text!r} within {timeout} s")
+
+
+async def bench_commands(options: argparse.Namespace) -> dict:
+    """Commands per second into the server: one stdin write each, batched stdin writes, and pipelined RCON."""
+    count: int = options.commands
+    results: dict = {"commands": count}
+    with tempfile.TemporaryDirectory() as directory:
+        instance: ServerInstance = await start_fake_server(directory, "--chat-rate", "0", "--players", "0",
+                                                           "--no-log", rcon=True)
+        start: float = perf_counter()
+        for index in range(count):
+            instance.send_command(f"say single {index}")
+        await wait_for_line(instance, f"[Server] single {count - 1}")
+        results["stdin_per_second"] = round(count / (perf_counter() - start))
+
+        start = perf_counter()
+        for first in range(0, count, 100):
+            instance.send_commands([f"say batch {index}" for index in range(first, min(first + 100, count))])
+        await wait_for_line(instance, f"[Server] batch {count - 1}")
+        results["stdin_batched_per_second"] = round(count / (perf_counter() - start))
+
+        rcon: RconClient = RconClient("127.0.0.1", int(server_property(directory, "rcon.port")), RCON_PASSWORD)
+        latencies: list[float] = []
+        start = perf_counter()
+        for index in range(min(count, 1000)):
+            await rcon.command(f"say sequential {index}")
+            latencies.append(rcon.last_latency)
+        results["rcon_sequential_per_second"] = round(min(count, 1000) / (perf_counter() - start))
+        results["rcon_latency_ms"] = distribution(latencies, 1000)
+        start = perf_counter()
+        await asyncio.gather(*(rcon.command(f"say pipelined {index}") for index in range(count)))
+        results["rcon_pipelined_per_second"] = round(count / (perf_counter() - start))
+        rcon.close()
+        await asyncio.sleep(.1)  # lets the server see the connection close before it stops
+        await stop_fake_server(instance)
+    return results
+
+
+async def bench_memory(options: argparse.Namespace) -> dict:
+    """
+    Memory of the bot while it relays a busy server for a long time.
+    Growth is the slope over the second half of the run, after caches and buffers filled up.
+    """
+    samples: list[tuple[float, int, int]] = []  # (seconds, traced bytes, rss bytes)
+    start: float = monotonic()
+
+    def sample() -> None:
+        if not samples or monotonic() - start - samples[-1][0] >= options.sample_interval:
+            stats: (dict, None) = read_proc_stats(os.getpid())
+            samples.append((monotonic() - start, tracemalloc.get_traced_memory()[0], stats["rss"] if stats else 0))
+
+    tracemalloc.start()
+    try:
+        bot: StubBot = StubBot(latency=options.discord_latency)
+        relay: ConsoleRelay = ConsoleRelay(max_latency=2.0)
+        with tempfile.TemporaryDirectory() as directory:
+            instance: ServerInstance = await start_fake_server(directory, "--chat-rate", str(options.chat_rate),
+                                                               "--players", "20", "--churn", "1", "--no-log")
+            await relay_loop(instance, relay, bot, OutputFilter([]), options.memory_duration, on_tick=sample)
+            await stop_fake_server(instance)
+    finally:
+        tracemalloc.stop()
+
+    second_half: list[tuple] = [entry for entry in samples if entry[0] >= samples[-1][0] / 2]
+
+    def slope(column: int) -> float:
+        """Least squares bytes per minute."""
+        if len(second_half) < 2:
+            return 0.0
+        times: list[float] = [entry[0] for entry in second_half]
+        values: list[int] = [entry[column] for entry in second_half]
+        mean_time, mean_value = sum(times) / len(times), sum(values) / len(values)
+        variance: float = sum((time - mean_time) ** 2 for time in times)
+        covariance: float = sum((time - mean_time) * (value - mean_value) for time, value in zip(times, values))
+        return covariance / variance * 60 if variance else 0.0
+
+    return {
+        "duration": options.memory_duration,
+        "chat_rate": options.chat_rate,
+        "traced_start_bytes": samples[0][1] if samples else None,
+        "traced_end_bytes": samples[-1][1] if samples else None,
+        "traced_growth_bytes_per_minute": round(slope(1)),
+        "rss_start_bytes": samples[0][2] if samples else None,
+        "rss_end_bytes": samples[-1][2] if samples else None,
+        "rss_growth_bytes_per_minute": round(slope(2)),
+        "samples": [[round(seconds, 1), traced, rss] for seconds, traced, rss in samples],
+    }
+
+
+async def bench_startup(options: argparse.Namespace) -> dict:
+    """
+    Cold start of the bot: import time of main.py in fresh interpreters, its slowest imports and the heavy modules
+    it leaves for later, then how long taking back a running server through its PID file and log takes.
+    Time to the first command needs Discord, see python main.py --startup-report.
+    """
+    probe: str = "import sys, main; print(' '.join(name for name in main.LAZY_MODULES if name in sys.modules))"
+    import_times: list[float] = []
+    imports: dict[str, int] = {}
+    loaded: list[str] = []
+    results: dict = {}
+    for _ in range(options.startup_runs):
+        result: subprocess.CompletedProcess = await asyncio.to_thread(
+            subprocess.run, [sys.executable, "-X", "importtime", "-c", probe], cwd=os.path.dirname(FAKE_SERVER),
+            capture_output=True, text=True)
+        if result.returncode != 0:
+            # ie a dependency is not installed, the reattach is still measured
+            results["import_error"] = result.stderr.strip().splitlines()[-1]
+            break
+        imports = {}
+        for line in result.stderr.splitlines():
+            match: (re.Match, None) = _IMPORT_TIME_PATTERN.match(line)
+            # only what main.py and the interpreter import directly, nested imports are in their cumulative time
+            if match is not None and not match.group("name").startswith(" "):
+                imports[match.group("name")] = int(match.group("cumulative"))
+        import_times.append(imports.get("main", 0) / 1e6)
+        loaded = result.stdout.split()
+    if import_times:
+        slowest: list[tuple[str, int]] = sorted(imports.items(), key=lambda item: item[1], reverse=True)[:10]
+        results["import_ms"] = distribution(import_times, 1000)
+        results["slowest_imports_ms"] = {name: round(cumulative / 1000, 2) for name, cumulative in slowest
+                                         if name != "main"}
+        results["lazy_modules_loaded_at_import"] = loaded
+
+    with tempfile.TemporaryDirectory() as directory:
+        # a previous run of the bot launches the server and exits, its end of the pipes goes away with it
+        previous_run: str = (f"import asyncio, benchmarks; "
+                             f"asyncio.run(benchmarks.start_fake_server({directory!r}, '--chat-rate', '0', rcon=True))")
+        await asyncio.to_thread(subprocess.run, [sys.executable, "-c", previous_run], cwd=os.path.dirname(FAKE_SERVER),
+                                check=True, timeout=60)
+
+        start: float = perf_counter()
+        record: PidRecord = find_running(directory)
+        rcon: RconClient = RconClient("127.0.0.1", int(server_property(directory, "rcon.port")), RCON_PASSWORD)
+        proc: AttachedProcess = AttachedProcess(record.pid, record.started, os.path.join(directory, LOG_FILE),
+                                                lambda: rcon)
+        attached: ServerInstance = ServerInstance("benchmark")
+        attached.attach(proc, record, directory, await asyncio.to_thread(proc.stdout.history))
+        results["reattach_ms"] = round((perf_counter() - start) * 1000, 2)
+        results["reattached_state"] = attached.tracker.state.value
+
+        # through RCON, its reply injected into the log tail
+        start = perf_counter()
+        attached.send_command("say reattached")
+        await wait_for_line(attached, "[Rcon] reattached")
+        results["reattached_command_ms"] = round((perf_counter() - start) * 1000, 2)
+        rcon.close()
+        await asyncio.sleep(.1)  # lets the server see the connection close before it stops
+        proc.terminate()
+        await asyncio.to_thread(proc.wait, 10)
+        attached.detach()
+    return results
+
+
+BENCHMARKS: dict = {
+    "relay": bench_relay,
+    "status": bench_status,
+    "commands": bench_commands,
+    "memory": bench_memory,
+    "startup": bench_startup,
+}
+
+
+def compare(previous: dict, current: dict, path: str = "") -> list[str]:
+    """
+    Lines listing every number that changed between two result files.
+    >>> compare({"relay": {"lag_ms": {"p95": 400}}}, {"relay": {"lag_ms": {"p95": 500}}})
+    ['relay.lag_ms.p95: 400 -> 500 (+25.0%)']
+    """
+    lines: list[str] = []
+    for key, value in current.items():
+        old = previous.get(key) if isinstance(previous, dict) else None
+        name: str = f"{path}.{key}" if path else key
+        if isinstance(value, dict):
+            lines.extend(compare(old or {}, value, name))
+        elif isinstance(value, (int, float)) and isinstance(old, (int, float)) and old != value:
+            change: str = f" ({(value - old) / old:+.1%})" if old else ""
+            lines.append(f"{name}: {old} -> {value}{change}")
+    return lines
+
+
+async def run(options: argparse.Namespace) -> dict:
+    results: dict = {}
+    for name in options.benchmarks:
+        print(f"Running {name}...", file=sys.stderr)
+        try:
+            results[name] = await BENCHMARKS[name](options)
+        except Exception as e:
+            results[name] = {"error": repr(e)}
+        # memory samples are only written to the result file
+        print(json.dumps({key: value for key, value in results[name].items() if key != "samples"}, indent=2),
+              file=sys.stderr)
+    return results
+
+
+def main() -> None:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        description="End-to-end benchmarks of the bot against fake_server.py and a stub of Discord")
+    parser.add_argument("benchmarks", nargs="*", default=[name for name in BENCHMARKS if name != "memory"],
+                        choices=list(BENCHMARKS), help="benchmarks to run, all but memory by default")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of the relay and status runs")
+    parser.add_argument("--chat-rate", type=float, default=50.0, help="chat lines per second of the server")
+    parser.add_argument("--discord-latency", type=float, default=0.05, help="seconds per Discord request")
+    parser.add_argument("--concurrency", type=int, default=20, help="concurrent status queries")
+    parser.add_argument("--command-rate", type=float, default=1000.0, help="stdin commands per second during status")
+    parser.add_argument("--commands", type=int, default=5000, help="commands of the throughput run")
+    parser.add_argument("--memory-duration", type=float, default=600.0, help="seconds of the memory run")
+    parser.add_argument("--sample-interval", type=float, default=10.0, help="seconds between memory samples")
+    parser.add_argument("--startup-runs", type=int, default=5, help="fresh interpreters importing main.py")
+    parser.add_argument("--output", default=os.path.join(tempfile.gettempdir(),
+                                                         f"benchmark-{strftime('%Y%m%d-%H%M%S')}.json"),
+                        help="result file, in the temporary directory by default")
+    parser.add_argument("--compare", help="previous result file to compare with")
+    options: argparse.Namespace = parser.parse_args()
+
+    try:
+        commit: (str, None) = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                             cwd=os.path.dirname(FAKE_SERVER)).stdout.strip() or None
+    except OSError:
+        commit = None
+    report: dict = {
+        "started": strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "options": vars(options),
+        "results": asyncio.run(run(options)),
+    }
+    with open(options.output, 'w') as output:
+        json.dump(report, output, indent=2)
+    print(f"Results written to {options.output}", file=sys.stderr)
+
+    if options.compare:
+        with open(options.compare, 'r') as previous:
+            changes: list[str] = compare(json.load(previous)["results"], report["results"])
+        print("\n".join(changes) or "No numbers changed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,393 @@
+import json
+import os
+import tempfile
+from dataclasses import dataclass, field
+from threading import Lock
+from time import monotonic
+
+from output_filters import validate_rule
+from pregen import PregenJob, METHODS, VANILLA
+from resources import parse_cpus
+from supervisor import RESTART_MODES, NEVER
+
+
+def _parse_bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    if str(value).lower() in ("1", "true", "yes", "on"):
+        return True
+    if str(value).lower() in ("0", "false", "no", "off"):
+        return False
+    raise ValueError(f"Not a boolean: {value!r}")
+
+
+def _parse_positive(parser):
+    def parse(value):
+        parsed = parser(value)
+        if parsed <= 0:
+            raise ValueError(f"Must be positive: {value!r}")
+        return parsed
+    return parse
+
+
+def _parse_range(low: int, high: int):
+    def parse(value) -> int:
+        parsed: int = int(value)
+        if not low <= parsed <= high:
+            raise ValueError(f"Must be between {low} and {high}: {value!r}")
+        return parsed
+    return parse
+
+
+def _parse_cpus(value) -> str:
+    value = str(value)
+    if value != "auto":
+        parse_cpus(value, available=set())  # raises ValueError for malformed lists
+    return value
+
+
+def _parse_restart_mode(value) -> str:
+    if value not in RESTART_MODES:
+        raise ValueError(f"Restart policy must be one of {', '.join(RESTART_MODES)}: {value!r}")
+    return value
+
+
+DEFAULT_SERVER: str = "default"  # name of the server configured by the top level values
+# Keys a server section may override, the top level values being the defaults of every server.
+_SERVER_SCHEMA: dict = {
+    "ip_address": str,
+    "jar_path": str,
+    "mem_alloc": _parse_positive(int),
+    "profile": str,
+    "active_processors": _parse_positive(int),
+    "restart_policy": _parse_restart_mode,
+    "memory_limit": _parse_positive(int),
+    "cpu_limit": _parse_positive(float),
+    "cpu_affinity": _parse_cpus,
+    "nice": _parse_range(-20, 19),
+    "ionice": _parse_range(0, 7),
+    "java_path": str,
+}
+
+
+def _parse_servers(value) -> dict:
+    if not isinstance(value, dict):
+        raise ValueError(f"Not a section of servers: {value!r}")
+    servers: dict = {}
+    for name, section in value.items():
+        if name == DEFAULT_SERVER or not isinstance(section, dict):
+            raise ValueError(f"Invalid server section: {name!r}")
+        servers[name] = {key: _SERVER_SCHEMA[key](raw) for key, raw in section.items() if key in _SERVER_SCHEMA}
+    return servers
+
+
+def _parse_profiles(value) -> dict:
+    if not isinstance(value, dict) or not all(isinstance(flags, list) for flags in value.values()):
+        raise ValueError(f"Not a section of profiles, name: [flags]: {value!r}")
+    return {name: [str(flag) for flag in flags] for name, flags in value.items()}
+
+
+def _parse_macros(value) -> dict:
+    if not isinstance(value, dict) or not all(isinstance(script, (str, list)) for script in value.values()):
+        raise ValueError(f"Not a section of macros, name: script or [commands]: {value!r}")
+    return {name: script if isinstance(script, str) else "\n".join(map(str, script)) for name, script in value.items()}
+
+
+def _parse_pregen(value) -> dict:
+    if not isinstance(value, dict) or not all(isinstance(job, dict) for job in value.values()):
+        raise ValueError(f"Not a section of pre-generation jobs, server: job: {value!r}")
+    return {server: PregenJob.from_dict(job).to_dict() for server, job in value.items()}
+
+
+def _parse_pregen_method(value) -> str:
+    if value not in METHODS:
+        raise ValueError(f"Pre-generation method must be one of {', '.join(METHODS)}: {value!r}")
+    return value
+
+
+def _parse_filters(value) -> list:
+    if not isinstance(value, list):
+        raise ValueError(f"Not a list of filter rules: {value!r}")
+    return [validate_rule(rule) for rule in value]
+
+
+# How every known key of config.json is validated. Unknown keys are kept untouched.
+_SCHEMA: dict = {
+    **_SERVER_SCHEMA,
+    "relay_latency": _parse_positive(float),
+    "relay_max_pending": _parse_positive(int),
+    "live_console": _parse_bool,
+    "idle_grace": _parse_positive(float),
+    "query_enabled": _parse_bool,
+    "servers": _parse_servers,
+    "profiles": _parse_profiles,
+    "telemetry_interval": _parse_positive(float),
+    "telemetry_command": str,
+    "alert_mspt": _parse_positive(float),
+    "alert_rss": _parse_positive(float),
+    "alert_duration": _parse_positive(float),
+    "metrics_host": str,
+    "metrics_port": _parse_positive(int),
+    "presence_tracking": _parse_bool,
+    "history_db": str,
+    "scrollback_bytes": _parse_positive(int),
+    "logs_max_lines": _parse_positive(int),
+    "logs_scan_bytes": _parse_positive(int),
+    "logs_max_pattern": _parse_positive(int),
+    "filters": _parse_filters,
+    "backup_dir": str,
+    "backup_interval": _parse_positive(float),
+    "backup_keep": _parse_positive(int),
+    "backup_workers": _parse_positive(int),
+    "backup_save_timeout": _parse_positive(float),
+    "rcon_enabled": _parse_bool,
+    "rcon_host": str,
+    "rcon_timeout": _parse_positive(float),
+    "macros": _parse_macros,
+    "batch_per_tick": _parse_positive(int),
+    "batch_max_commands": _parse_positive(int),
+    "stop_timeout": _parse_positive(float),
+    "term_timeout": _parse_positive(float),
+    "restart_backoff": _parse_positive(float),
+    "restart_backoff_max": _parse_positive(float),
+    "restart_max_crashes": _parse_positive(int),
+    "restart_window": _parse_positive(float),
+    "cgroup_parent": str,
+    "pregen": _parse_pregen,
+    "pregen_method": _parse_pregen_method,
+    "pregen_interval": _parse_positive(float),
+    "pregen_max_mspt": _parse_positive(float),
+    "pregen_max_radius": _parse_positive(int),
+}
+
+
+@dataclass
+class ServerConfig:
+    """Settings of a single server, after applying its section over the top level values"""
+    name: str
+    ip_address: (str, None) = None
+    jar_path: (str, None) = None
+    mem_alloc: int = 1024
+    profile: str = "vanilla"
+    active_processors: (int, None) = None  # None lets the JVM count the CPUs it may run on
+    restart_policy: str = NEVER
+    memory_limit: (int, None) = None
+    cpu_limit: (float, None) = None
+    cpu_affinity: (str, None) = None
+    nice: (int, None) = None
+    ionice: (int, None) = None
+    java_path: str = "java"
+
+
+@dataclass
+class BotConfig:
+    """Validated content of config.json"""
+    ip_address: (str, None) = None
+    jar_path: (str, None) = None
+    mem_alloc: int = 1024
+    profile: str = "vanilla"
+    active_processors: (int, None) = None  # None lets the JVM count the CPUs it may run on
+    restart_policy: str = NEVER  # see supervisor.RESTART_MODES
+    memory_limit: (int, None) = None  # MB, memory.max of the server's cgroup, above -Xmx for the JVM's own memory
+    cpu_limit: (float, None) = None  # CPUs, cpu.max of the server's cgroup, ie 2.5
+    cpu_affinity: (str, None) = None  # CPU list like "1-3,6", "auto" leaves the first CPU to the bot
+    nice: (int, None) = None  # -20 to 19
+    ionice: (int, None) = None  # best-effort I/O priority, 0 to 7
+    java_path: str = "java"  # command starting the JVM, "python3 /abs/path/fake_server.py" runs the stand-in instead
+    relay_latency: float = 2.0
+    relay_max_pending: int = 500  # lines queued per channel, the oldest are skipped beyond
+    live_console: bool = False
+    idle_grace: float = 20.0  # minutes
+    query_enabled: bool = False
+    servers: dict = field(default_factory=dict)  # name: section, see _SERVER_SCHEMA
+    profiles: dict = field(default_factory=dict)  # name: [jvm flags], see constants.JvmProfiles
+    telemetry_interval: float = 10.0  # seconds between samples
+    telemetry_command: (str, None) = None  # ie "tps" or "mspt" on Paper, "forge tps" on Forge
+    alert_mspt: float = 50.0
+    alert_rss: (float, None) = None  # MB
+    alert_duration: float = 60.0  # seconds a metric must stay above its threshold
+    metrics_host: str = "127.0.0.1"
+    metrics_port: (int, None) = None  # serves /metrics when set
+    presence_tracking: bool = True  # follow joins and leaves in the console instead of polling the status
+    history_db: str = "history.db"  # relative to the bot's directory
+    scrollback_bytes: int = 1024 * 1024  # console kept in memory per server
+    logs_max_lines: int = 2000  # most lines mc!logs returns
+    logs_scan_bytes: int = 64 * 1024 * 1024  # most bytes of latest.log mc!logs reads
+    logs_max_pattern: int = 200  # most characters of the regular expression given to mc!logs
+    filters: list = field(default_factory=list)  # console relay rules, see output_filters.validate_rule
+    backup_dir: str = "backups"  # relative to the server's directory
+    backup_interval: (float, None) = None  # minutes between scheduled backups of running servers, None disables
+    backup_keep: int = 10  # snapshots kept by retention
+    backup_workers: (int, None) = None  # processes compressing changed files, None for one per CPU
+    backup_save_timeout: float = 60.0  # seconds to wait for save-all flush to complete
+    rcon_enabled: bool = True  # mc!command uses RCON when server.properties enables it, stdin otherwise
+    rcon_host: str = "127.0.0.1"
+    rcon_timeout: float = 5.0  # seconds to wait for an RCON reply before falling back to stdin
+    macros: dict = field(default_factory=dict)  # name: script for mc!run, {name} and {1} are parameters
+    batch_per_tick: int = 10  # commands mc!run writes every tick (50 ms)
+    batch_max_commands: int = 10000  # longest script mc!run accepts
+    stop_timeout: float = 60.0  # seconds the server gets to exit after stop, before SIGTERM
+    term_timeout: float = 15.0  # seconds the JVM gets to exit after SIGTERM, before SIGKILL
+    restart_backoff: float = 10.0  # seconds before the first automatic restart, doubled after each one
+    restart_backoff_max: float = 300.0
+    restart_max_crashes: int = 5  # crashes within restart_window which turn automatic restarts off
+    restart_window: float = 600.0  # seconds
+    cgroup_parent: str = "mcbot.slice"  # relative to /sys/fs/cgroup, must be delegated to the bot's user
+    pregen: dict = field(default_factory=dict)  # server: pre-generation job, saved by mc!pregen, see pregen.PregenJob
+    pregen_method: str = VANILLA  # chunky with the Chunky plugin installed, vanilla sweeps with forceload
+    pregen_interval: float = 5.0  # seconds every vanilla 8x8 chunk tile stays forceloaded
+    pregen_max_mspt: float = 40.0  # jobs pause above this MSPT, which needs telemetry_command
+    pregen_max_radius: int = 1875  # chunks, 30000 blocks, mc!pregen start refuses larger radiuses
+    extra: dict = field(default_factory=dict)  # keys outside the schema
+    errors: dict = field(default_factory=dict)  # key: reason, for values that failed validation
+
+    @classmethod
+    def from_dict(cls, raw: dict) -> "BotConfig":
+        """
+        Validates a raw config dictionary. Invalid values fall back to their default and are listed in errors.
+        >>> BotConfig.from_dict({"mem_alloc": "2048", "live_console": "maybe"})  # doctest: +ELLIPSIS
+        BotConfig(..., mem_alloc=2048, ..., live_console=False, ..., errors={'live_console': "Not a boolean: 'maybe'"})
+        """
+        config: BotConfig = cls()
+        for key, value in raw.items():
+            if key not in _SCHEMA:
+                config.extra[key] = value
+                continue
+            try:
+                setattr(config, key, _SCHEMA[key](value))
+            except (TypeError, ValueError) as e:
+                config.errors[key] = str(e)
+        return config
+
+    def server(self, name: str = DEFAULT_SERVER) -> ServerConfig:
+        """
+        Returns the settings of a server. Raises KeyError if no such server is configured.
+        >>> config = BotConfig.from_dict({"mem_alloc": 2048, "servers": {"creative": {"jar_path": "creative.jar"}}})
+        >>> config.server("creative").jar_path, config.server("creative").mem_alloc
+        ('creative.jar', 2048)
+        """
+        if name != DEFAULT_SERVER and name not in self.servers:
+            raise KeyError(f"Unknown server {name}. See mc!servers")
+        defaults: dict = {key: getattr(self, key) for key in _SERVER_SCHEMA}
+        return ServerConfig(name=name, **{**defaults, **self.servers.get(name, {})})
+
+
+class ConfigStore:
+    """
+    Keeps config.json in memory. The file is only parsed again when its mtime changes,
+    and the mtime itself is checked at most once every check_interval seconds.
+    Writes go through a single lock and replace the file atomically.
+    >>> directory = tempfile.TemporaryDirectory()
+    >>> store = ConfigStore(os.path.join(directory.name, "config.json"))
+    >>> store.config.mem_alloc
+    1024
+    >>> store.set("mem_alloc", "2048").mem_alloc
+    2048
+    >>> with open(store.path) as cfg:
+    ...     json.load(cfg)
+    {'mem_alloc': 2048}
+    >>> directory.cleanup()
+    """
+
+    def __init__(self, path: str, check_interval: float = 1.0):
+        """
+        :param path: Path of config.json. Read on first use, it is only written by create and the setters.
+        :param check_interval: Seconds between mtime checks.
+        """
+        self.path: str = path
+        self.check_interval: float = check_interval
+        self._lock: Lock = Lock()
+        self._raw: dict = {}
+        self._config: BotConfig = BotConfig()
+        self._mtime: int = -1
+        self._checked_at: float = -check_interval
+
+    def create(self) -> None:
+        """Creates config.json with an empty object if it is missing or empty, ie when the bot starts."""
+        with self._lock:
+            if not os.path.exists(self.path) or not os.stat(self.path).st_size:
+                self._write({})
+        self._reload()
+
+    @property
+    def config(self) -> BotConfig:
+        """The current config, reloaded first if the file changed on disk."""
+        if monotonic() - self._checked_at >= self.check_interval:
+            self._reload()
+        return self._config
+
+    def _reload(self) -> None:
+        self._checked_at = monotonic()
+        try:
+            mtime: int = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path, 'r') as cfg:
+                raw: dict = json.load(cfg)
+        except (json.decoder.JSONDecodeError, OSError):
+            return  # keep the last valid config while the file is being edited by hand
+        self._raw = raw if isinstance(raw, dict) else {}
+        self._config = BotConfig.from_dict(self._raw)
+        self._mtime = mtime
+
+    def _write(self, raw: dict) -> None:
+        # write a temporary file next to config.json, then rename it over, so readers never see half a file
+        directory: str = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".config.", suffix=".json", dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as tmp:
+                json.dump(raw, tmp, indent=6)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def update(self, **values) -> BotConfig:
+        """
+        Validates and writes several values at once.
+        Raises ValueError if a value does not match the schema; nothing is written in that case.
+        :return: The new config.
+        """
+        with self._lock:
+            self._reload()
+            raw: dict = dict(self._raw)
+            for key, value in values.items():
+                raw[key] = _SCHEMA[key](value) if key in _SCHEMA else value
+            return self._commit(raw)
+
+    def _commit(self, raw: dict) -> BotConfig:
+        # must be called with the lock held
+        self._write(raw)
+        self._raw = raw
+        self._config = BotConfig.from_dict(raw)
+        self._mtime = os.stat(self.path).st_mtime_ns
+        self._checked_at = monotonic()
+        return self._config
+
+    def set(self, key: str, value) -> BotConfig:
+        """Validates and writes a single value. See update."""
+        return self.update(**{key: value})
+
+    def set_server(self, name: str, key: str, value) -> BotConfig:
+        """
+        Validates and writes a single value of a server's section, creating the section if needed.
+        The default server's values are the top level ones.
+        """
+        if name == DEFAULT_SERVER:
+            return self.set(key, value)
+        if key not in _SERVER_SCHEMA:
+            raise ValueError(f"{key} can not be set per server")
+        with self._lock:
+            self._reload()
+            servers: dict = {server: dict(section) for server, section in self._raw.get("servers", {}).items()}
+            servers.setdefault(name, {})[key] = _SERVER_SCHEMA[key](value)
+            return self._commit({**self._raw, "servers": servers})
+
+    def as_dict(self) -> dict:
+        """The current config as stored on disk, without reading it."""
+        _ = self.config  # reloads if needed
+        return dict(self._raw)
@@ -0,0 +1,238 @@
+from collections import deque
+from dataclasses import dataclass, field
+from time import monotonic
+
+DISCORD_MESSAGE_LIMIT: int = 2000
+# diff highlighting leaves console lines as they are, but colors the lines highlighted by output_filters
+CODE_BLOCK_WRAP: str = "```diff\n{}\n```"
+CODE_BLOCK_OVERHEAD: int = len(CODE_BLOCK_WRAP.format(""))
+SKIPPED_LINE: str = "... {} line(s) skipped ..."
+RETRY_BACKOFF: float = 5.0  # seconds a channel waits after its first failed send, doubled by every next one
+RETRY_BACKOFF_MAX: float = 300.0
+
+
+class RateLimitBucket:
+    """
+    Sliding window mirroring Discord's per-channel message limit: at most rate messages within any per seconds.
+    >>> bucket = RateLimitBucket(5, 5.0)
+    >>> [bucket.try_acquire() for _ in range(6)]
+    [True, True, True, True, True, False]
+    >>> bucket.available
+    0
+    """
+
+    def __init__(self, rate: int = 5, per: float = 5.0):
+        self.rate: int = rate
+        self.per: float = per
+        self._sent: deque[float] = deque()  # monotonic times of the messages within the window
+
+    def _expire(self) -> None:
+        now: float = monotonic()
+        while self._sent and self._sent[0] <= now - self.per:
+            self._sent.popleft()
+
+    @property
+    def available(self) -> int:
+        """Amount of whole messages that may be sent right now."""
+        self._expire()
+        return self.rate - len(self._sent)
+
+    def try_acquire(self) -> bool:
+        """Counts a message if the window has room for it. Returns False when the channel would be rate limited."""
+        self._expire()
+        if len(self._sent) >= self.rate:
+            return False
+        self._sent.append(monotonic())
+        return True
+
+
+@dataclass
+class _ChannelState:
+    pending: deque = field(default_factory=deque)  # (monotonic timestamp, line)
+    pending_chars: int = 0
+    skipped: int = 0  # oldest lines dropped by the backlog cap since the last message, told in the next one
+    failures: int = 0  # sends failed in a row
+    retry_at: float = 0.0  # monotonic time before which a failing channel is not sent to
+    bucket: RateLimitBucket = field(default_factory=RateLimitBucket)
+    live_message: object = None
+    live_content: str = ""
+
+
+class ConsoleRelay:
+    """
+    Merges console lines into as few Discord messages as possible.
+    Lines are queued per channel and flushed once they fill a message or the oldest one is older than max_latency.
+    When a channel gets more lines than its rate limit lets through, the backlog is capped at max_pending lines:
+    the oldest ones are skipped, and their amount is told at the start of the next message.
+    With live_console, a single message per channel is edited in place instead of posting new ones.
+    >>> import asyncio
+    >>> from discord_stub import StubBot
+    >>> bot = StubBot(latency=0)
+    >>> relay = ConsoleRelay(max_latency=2.0)
+    >>> relay.push(42, ["[Server thread/INFO]: Preparing level", "[Server thread/INFO]: Done (12.3s)!"])
+    >>> asyncio.run(relay.flush(bot.get_channel, force=True))
+    >>> print(bot.get_channel(42).messages[0].content)
+    ```diff
+    [Server thread/INFO]: Preparing level
+    [Server thread/INFO]: Done (12.3s)!
+    ```
+    >>> relay.lines_merged, relay.messages_sent, relay.pending
+    (2, 1, 0)
+    """
+
+    def __init__(self, max_latency: float = 2.0, code_block: bool = True, live_console: bool = False,
+                 rate: int = 5, per: float = 5.0, max_pending: int = 500):
+        """
+        :param max_latency: Seconds a line may wait before it is flushed even if the message is not full.
+        :param code_block: Wrap every message in a code block.
+        :param live_console: Edit one rolling message instead of sending new ones.
+        :param rate: Messages allowed per channel every `per` seconds.
+        :param per: Length of the rate limit window in seconds.
+        :param max_pending: Lines queued per channel at most, the oldest ones are skipped beyond.
+        """
+        self.max_latency: float = max_latency
+        self.code_block: bool = code_block
+        self.live_console: bool = live_console
+        self._rate: int = rate
+        self._per: float = per
+        self.max_pending: int = max_pending
+        self._channels: dict[int, _ChannelState] = {}
+
+        self.lines_merged: int = 0
+        self.messages_sent: int = 0
+        self.messages_edited: int = 0
+        self.lines_skipped: int = 0
+        self.send_errors: int = 0
+
+    @property
+    def _body_limit(self) -> int:
+        return DISCORD_MESSAGE_LIMIT - (CODE_BLOCK_OVERHEAD if self.code_block else 0)
+
+    @property
+    def pending(self) -> int:
+        """Amount of lines waiting to be relayed, over all channels."""
+        return sum(len(state.pending) for state in self._channels.values())
+
+    @property
+    def lag(self) -> float:
+        """Age in seconds of the oldest line still waiting to be relayed."""
+        oldest: list[float] = [state.pending[0][0] for state in self._channels.values() if state.pending]
+        return monotonic() - min(oldest) if oldest else 0.0
+
+    def _state(self, channel_id: int) -> _ChannelState:
+        if channel_id not in self._channels:
+            self._channels[channel_id] = _ChannelState(bucket=RateLimitBucket(self._rate, self._per))
+        return self._channels[channel_id]
+
+    def push(self, channel_id: int, lines: list[str]) -> None:
+        """
+        Queues lines for a channel. Lines longer than a whole message are truncated.
+        :param channel_id: Discord channel id the lines are relayed to.
+        :param lines: Console lines without trailing newlines.
+        """
+        state: _ChannelState = self._state(channel_id)
+        now: float = monotonic()
+        for line in lines:
+            line = line[:self._body_limit]
+            state.pending.append((now, line))
+            state.pending_chars += len(line) + 1
+        while len(state.pending) > self.max_pending:
+            _, line = state.pending.popleft()
+            state.pending_chars -= len(line) + 1
+            state.skipped += 1
+            self.lines_skipped += 1
+
+    def _peek_message(self, state: _ChannelState, limit: int) -> tuple[str, int, int]:
+        """
+        Joins as many pending lines as fit in limit characters, leaving them queued until they were sent.
+        Returns the text, the amount of lines and the amount of skipped lines it tells, see _drop.
+        """
+        skipped: int = state.skipped
+        lines: list[str] = [SKIPPED_LINE.format(skipped)] if skipped else []
+        size: int = len(lines[0]) if lines else 0
+        for _, line in state.pending:
+            if size + len(line) + (1 if lines else 0) > limit:
+                break
+            size += len(line) + (1 if lines else 0)
+            lines.append(line)
+        return "\n".join(lines), len(lines) - (1 if skipped else 0), skipped
+
+    @staticmethod
+    def _drop(state: _ChannelState, count: int, skipped: int) -> None:
+        """Removes the first count pending lines and the skipped lines told, once the message holding them was sent."""
+        for _ in range(count):
+            _, line = state.pending.popleft()
+            state.pending_chars -= len(line) + 1
+        state.skipped -= skipped
+
+    def _due(self, state: _ChannelState, force: bool) -> bool:
+        if not state.pending:
+            return False
+        return force or state.pending_chars >= self._body_limit \
+            or monotonic() - state.pending[0][0] >= self.max_latency
+
+    def _wrap(self, text: str) -> str:
+        return CODE_BLOCK_WRAP.format(text) if self.code_block else text
+
+    async def flush(self, get_channel, force: bool = False) -> None:
+        """
+        Sends every channel's due messages, as far as its rate limit bucket allows.
+        Whatever does not fit stays queued and keeps merging until the next flush.
+        A channel whose send fails keeps its lines and is left out for a backoff, without raising.
+        :param get_channel: Callable returning a channel object from its id, ie bot.get_channel
+        :param force: Flush even if the latency deadline has not passed yet.
+        """
+        # channels may be added by push while a send is awaited
+        for channel_id, state in list(self._channels.items()):
+            if not self._due(state, force) or monotonic() < state.retry_at:
+                continue
+            channel = get_channel(channel_id)
+            if channel is None:
+                continue
+            try:
+                if self.live_console:
+                    await self._flush_live(channel, state)
+                else:
+                    await self._flush_messages(channel, state)
+            except Exception as e:
+                # ie missing permissions or a deleted channel: the lines stay queued and the channel backs off,
+                # the other channels keep flowing
+                state.failures += 1
+                backoff: float = min(RETRY_BACKOFF * 2 ** (state.failures - 1), RETRY_BACKOFF_MAX)
+                state.retry_at = monotonic() + backoff
+                self.send_errors += 1
+                print(f"Relaying to channel {channel_id} failed, retrying in {backoff:.0f} s: {e!r}")
+            else:
+                state.failures = 0
+
+    async def _flush_messages(self, channel, state: _ChannelState) -> None:
+        while state.pending and state.bucket.try_acquire():
+            text, count, skipped = self._peek_message(state, self._body_limit)
+            # a failed send raises with its lines still queued
+            await channel.send(self._wrap(text))
+            self._drop(state, count, skipped)
+            self.lines_merged += count
+            self.messages_sent += 1
+
+    async def _flush_live(self, channel, state: _ChannelState) -> None:
+        if not state.bucket.try_acquire():
+            return
+        text, count, skipped = self._peek_message(state, self._body_limit)
+        # keep the tail of the console which fits in a single message
+        content: str = "\n".join(filter(None, (state.live_content, text)))[-self._body_limit:]
+        content = content[content.find("\n") + 1:] if len(content) == self._body_limit else content
+        edited: bool = False
+        if state.live_message is not None:
+            try:
+                await state.live_message.edit(content=self._wrap(content))
+                edited = True
+                self.messages_edited += 1
+            except Exception:
+                pass  # the message was deleted, start a new one
+        if not edited:
+            content = text
+            state.live_message = await channel.send(self._wrap(content))
+            self.messages_sent += 1
+        self._drop(state, count, skipped)
+        state.live_content = content
+        self.lines_merged += count
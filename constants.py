@@ -1,3 +1,4 @@
+import re
 from enum import Enum
 
 
@@ -7,6 +8,31 @@ class JavaArgs(Enum):
     MinMem =                     "-Xms{}M"
     Jar =                        "-jar"
     Server =                     "-server"
+    ActiveProcessors =           "-XX:ActiveProcessorCount={}"
+
+
+# Built-in JVM launch profiles. Profiles in config.json with the same name take precedence.
+# A profile giving its own -Xms replaces the default -Xms equal to -Xmx.
+JvmProfiles: dict[str, list[str]] = {
+    "vanilla": [],
+    # G1 tuned for Minecraft's allocation pattern, https://docs.papermc.io/paper/aikars-flags
+    "aikar": ["-XX:+UseG1GC", "-XX:+ParallelRefProcEnabled", "-XX:MaxGCPauseMillis=200",
+              "-XX:+UnlockExperimentalVMOptions", "-XX:+DisableExplicitGC", "-XX:+AlwaysPreTouch",
+              "-XX:G1NewSizePercent=30", "-XX:G1MaxNewSizePercent=40", "-XX:G1HeapRegionSize=8M",
+              "-XX:G1ReservePercent=20", "-XX:G1HeapWastePercent=5", "-XX:G1MixedGCCountTarget=4",
+              "-XX:InitiatingHeapOccupancyPercent=15", "-XX:G1MixedGCLiveThresholdPercent=90",
+              "-XX:G1RSetUpdatingPauseTimePercent=5", "-XX:SurvivorRatio=32", "-XX:+PerfDisableSharedMem",
+              "-XX:MaxTenuringThreshold=1", "-Dusing.aikars.flags=https://mcflags.emc.gs",
+              "-Daikars.new.flags=true"],
+    # concurrent collectors, for heaps of 12 GB and more
+    "zgc": ["-XX:+UseZGC", "-XX:+AlwaysPreTouch", "-XX:+DisableExplicitGC", "-XX:+UseTransparentHugePages",
+            "-XX:+PerfDisableSharedMem"],
+    "shenandoah": ["-XX:+UseShenandoahGC", "-XX:+AlwaysPreTouch", "-XX:+DisableExplicitGC",
+                   "-XX:+UseTransparentHugePages", "-XX:+PerfDisableSharedMem"],
+    # smallest footprint for small hosts, memory is committed only when needed
+    "minimal": ["-Xms256M", "-XX:+UseSerialGC", "-Xss512k", "-XX:ReservedCodeCacheSize=64M",
+                "-XX:MaxMetaspaceSize=256M"],
+}
 
 
 class Messages(Enum):
@@ -33,6 +59,8 @@ class Messages(Enum):
 
     StatusConnectionError =      "Server is offline."
 
+    StatusAge =                  "Status is {:.0f} s old."
+
     IPNotBound =                 "IP Address not bound. See mc!help"
 
     PathNotBound =               "Jar path not bound. See mc!help"
@@ -45,7 +73,7 @@ class Messages(Enum):
 
     SetMemSuccess =              "Successfully updated default memory."
 
-    CloseSuccess =               "Successfully closed down server."
+    CloseSuccess =               "Stopping the server, its exit will be reported here."
 
     CloseAssertionError =        "Server is already closed. mc!help"
 
@@ -55,6 +83,174 @@ class Messages(Enum):
 
     InactivityTimeout =          "Due to lack of activity on the server, it will automatically close."
 
+    HostMemoryExceeded =         "Not enough memory on the host for this server next to the running ones. " \
+                                 "Close a server or lower the memory. mc!servers"
+
+    ServerListEntry =            "{}, {} MB"
+
+    ReservedMemory =             "{} MB reserved by running servers."
+
+    UnknownProfile =             "Unknown launch profile. Built-in profiles: vanilla, aikar, zgc, shenandoah, minimal."
+
+    LaunchCommandLine =          "```\n{}\n```"
+
+    PerfCurrent =                "CPU {:.0f}%, RSS {:.0f} MB, {} thread(s), read {:.1f} MB, written {:.1f} MB"
+
+    PerfWindow =                 "min {:.1f} / avg {:.1f} / p95 {:.1f}"
+
+    PerfNoSamples =              "No samples yet. mc!launch"
+
+    ResourcesScheduling =        "CPUs {}, nice {}, I/O priority {}"
+
+    ResourcesMemory =            "{} of {} used, peak {}. Throttled {} time(s), {} OOM kill(s)."
+
+    ResourcesCpu =               "{:.0f} s of CPU used, limit {}. Throttled in {}/{} period(s) ({:.1f}%), for {:.1f} s."
+
+    ResourcesRss =               "RSS {:.0f} MB"
+
+    ResourcesNotRunning =        "The server is not running. mc!launch"
+
+    NoCgroup =                   "No cgroup limits. Set memory_limit or cpu_limit in config.json."
+
+    IsolationFallback =          "Limits not enforced: {}."
+
+    OomKilled =                  "Its cgroup's memory limit was hit, {} process(es) killed by the OOM killer."
+
+    SeenOnline =                 "{} is online right now."
+
+    SeenAt =                     "{} was last seen <t:{:.0f}:R>."
+
+    SeenNever =                  "{} was never seen."
+
+    SeenSyntax =                 "Invalid syntax. Example: mc!seen Steve"
+
+    InvalidPeriod =              "Invalid period. Examples: mc!playtime 7d, mc!playtime 12h, mc!playtime all"
+
+    PlaytimeEntry =              "{}. {} - {}"
+
+    TopEntry =                   "{}. {} - {}, {} message(s), {} advancement(s)"
+
+    NoHistory =                  "No history yet."
+
+    BackfillDone =               "Imported {} line(s) from old logs."
+
+    LogsBlock =                  "```\n{}\n```"
+
+    LogsEmpty =                  "No matching lines."
+
+    LogsAttached =               "{} line(s), attached as a file."
+
+    LogsTruncated =              "Stopped scanning latest.log at the scan limit, older lines were not searched."
+
+    InvalidRegex =               "Invalid regular expression. Example: mc!logs 50 ERROR|WARN"
+
+    RegexTooLong =               "The regular expression is longer than logs_max_pattern allows."
+
+    RelayStats =                 "Merged {} line(s) into {} message(s) and {} edit(s). " \
+                                 "{} line(s) pending, lagging {:.1f} s behind, {} line(s) skipped."
+
+    FilterEntry =                "{}: {}{}, {} hit(s)"
+
+    FilterRoute =                " to <#{}>"
+
+    FiltersSummary =             "{} line(s) classified by {} rule(s), {} dropped."
+
+    BackupDone =                 "Snapshot {}: {} file(s), {} changed. Wrote {} for a {} world in {:.1f} s, " \
+                                 "saving was paused for {:.1f} s."
+
+    BackupPruned =               "Retention deleted {} old snapshot(s), freeing {}."
+
+    BackupListEntry =            "{}: {} file(s), {} world, {} written"
+
+    NoBackups =                  "No backups yet. mc!backup"
+
+    BackupSaveTimeout =          "The server did not confirm save-all flush. Saving is back on, no backup was taken."
+
+    RestoreDone =                "Restored snapshot {}."
+
+    RestoreKeptWorld =           "The replaced world was moved to {}."
+
+    RestoreSyntax =              "Name the snapshot to restore. See mc!backups"
+
+    RestoreStillRunning =        "Close the server before restoring a backup! mc!close"
+
+    CommandOutput =              "```\n{}\n```"
+
+    RconTimeout =                "No RCON reply in time, the command may still have run."
+
+    CommandNoOutput =            "Done, no output."
+
+    CommandLatency =             "RCON, {:.0f} ms"
+
+    ExitReport =                 "Exit code {}, ran for {}."
+
+    StopEscalated =              "The server did not stop in time, it was ended with {}."
+
+    RestartScheduled =           "Restarting in {:.0f} s (restart policy {})."
+
+    Restarted =                  "Restarted automatically."
+
+    RestartFailed =              "Automatic restart failed: {}"
+
+    CrashLoop =                  "Crashed {} times within {} min, automatic restarts are off until the next mc!launch."
+
+    RestartCancelled =           "Cancelled the pending automatic restart."
+
+    BatchProgress =              "{}/{} command(s) sent, {:.0f}/s, about {:.0f} s left."
+
+    BatchDone =                  "Sent {} command(s) in {:.1f} s, {:.0f}/s."
+
+    BatchCancelled =             "Cancelled after {}/{} command(s)."
+
+    BatchFailed =                "Stopped after {}/{} command(s): {}"
+
+    BatchRunning =               "A script is already running on this server. mc!run cancel"
+
+    NoBatch =                    "No script is running."
+
+    RunSyntax =                  "Attach a script or name a macro: mc!run [server] <macro> [value ...] [name=value ...]"
+
+    ScriptTooLong =              "The script has more commands than batch_max_commands allows."
+
+    MissingParameter =           "A parameter of the script has no value. Give {name} as name=value, {1} by position."
+
+    MacroSaved =                 "Saved macro {} with {} command(s)."
+
+    MacroList =                  "{}: {} command(s)"
+
+    UnknownMacro =               "No such macro. mc!macro lists them."
+
+    NoMacros =                   "No macros. Attach a script to mc!macro <name> to save one."
+
+    NoFilters =                  "No output filters. Add rules to the \"filters\" key of config.json."
+
+    PregenSyntax =               "mc!pregen [server] start <radius in chunks> [x z] [chunky|vanilla], " \
+                                 "mc!pregen [server] status or mc!pregen [server] cancel"
+
+    PregenStarted =              "Pre-generating {} chunks around {} {} ({}). It pauses while players are online."
+
+    PregenTooLarge =             "The radius is above pregen_max_radius of config.json."
+
+    PregenRunning =              "This server is already pre-generating. mc!pregen status, mc!pregen cancel"
+
+    PregenProgress =             "{}/{} chunks ({:.1f}%), {}"
+
+    PregenSpeed =                "{:.1f} chunks/s, about {} left"
+
+    PregenArea =                 "Radius {} chunks around {} {}, {}"
+
+    PregenCancelled =            "Cancelled after {}/{} chunks."
+
+    NoPregen =                   "No pre-generation job. mc!pregen start <radius>"
+
+    Reattached =                 "Reattached to the server left running by the bot's previous run, {} for {}."
+
+    ReattachedWithoutRcon =      "Its stdin went away with the previous run, enable RCON in server.properties " \
+                                 "to send it commands. mc!close still stops it."
+
+    NoStdin =                    "This server was reattached after the bot restarted and its stdin is gone. " \
+                                 "Enable RCON in server.properties to send it commands."
+
 
 ErrorMessages: dict[(type(BaseException), str), str] = {
     (IndexError, "setpath"): Messages.InvalidPathSyntax.value,
@@ -65,13 +261,48 @@ ErrorMessages: dict[(type(BaseException), str), str] = {
     (PermissionError, "setip"): Messages.ConfigPermissionError.value,
     (ConnectionRefusedError, "status"): Messages.StatusConnectionError.value,
     (TimeoutError, "status"): Messages.StatusConnectionError.value,
+    (OSError, "status"): Messages.StatusConnectionError.value,
     (KeyError, "status"): Messages.IPNotBound.value,
     (KeyError, "launch"): " OR ".join((Messages.PathNotBound.value, Messages.IPNotBound.value)),
     (AssertionError, "launch"): Messages.ProcessStillRunning.value,
+    (MemoryError, "launch"): Messages.HostMemoryExceeded.value,
+    (ValueError, "launch"): Messages.UnknownProfile.value,
     (AssertionError, "setmem"): Messages.SetMemDigitAssertion.value,
     (AssertionError, "close"):  Messages.CloseAssertionError.value,
     (AssertionError, "command"): Messages.CommandAssertionError.value,
-    (SyntaxError, "command"): Messages.CommandSyntaxError.value
+    (SyntaxError, "command"): Messages.CommandSyntaxError.value,
+    (TimeoutError, "command"): Messages.RconTimeout.value,
+    (BrokenPipeError, "command"): Messages.NoStdin.value,
+    (AssertionError, "run"): Messages.CommandAssertionError.value,
+    (IndexError, "run"): Messages.RunSyntax.value,
+    (LookupError, "run"): Messages.UnknownMacro.value,
+    (LookupError, "macro"): Messages.UnknownMacro.value,
+    (KeyError, "run"): Messages.MissingParameter.value,
+    (OverflowError, "run"): Messages.ScriptTooLong.value,
+    (RuntimeError, "run"): Messages.BatchRunning.value,
+    (IndexError, "macro"): Messages.RunSyntax.value,
+    (UnicodeDecodeError, "run"): Messages.RunSyntax.value,
+    (UnicodeDecodeError, "macro"): Messages.RunSyntax.value,
+    (AssertionError, "perf"): Messages.PerfNoSamples.value,
+    (AssertionError, "resources"): Messages.ResourcesNotRunning.value,
+    (IndexError, "pregen"): Messages.PregenSyntax.value,
+    (ValueError, "pregen"): Messages.PregenSyntax.value,
+    (RuntimeError, "pregen"): Messages.PregenRunning.value,
+    (OverflowError, "pregen"): Messages.PregenTooLarge.value,
+    (IndexError, "seen"): Messages.SeenSyntax.value,
+    (ValueError, "playtime"): Messages.InvalidPeriod.value,
+    (KeyError, "backfill"): Messages.PathNotBound.value,
+    (FileNotFoundError, "backfill"): Messages.NoHistory.value,
+    (re.error, "logs"): Messages.InvalidRegex.value,
+    (OverflowError, "logs"): Messages.RegexTooLong.value,
+    (KeyError, "backup"): Messages.PathNotBound.value,
+    (FileNotFoundError, "backup"): Messages.PathNotBound.value,
+    (TimeoutError, "backup"): Messages.BackupSaveTimeout.value,
+    (KeyError, "backups"): Messages.PathNotBound.value,
+    (KeyError, "restore"): Messages.PathNotBound.value,
+    (IndexError, "restore"): Messages.RestoreSyntax.value,
+    (FileNotFoundError, "restore"): Messages.RestoreSyntax.value,
+    (AssertionError, "restore"): Messages.RestoreStillRunning.value
 
 }
 
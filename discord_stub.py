@@ -0,0 +1,83 @@
+import asyncio
+from collections import deque
+from time import monotonic, time
+
+
+class StubMessage:
+    """A sent message, which may be edited like discord.Message."""
+
+    def __init__(self, channel: "StubChannel", content: (str, None), embed=None, file=None):
+        self.channel: StubChannel = channel
+        self.content: (str, None) = content
+        self.embed = embed
+        self.file = file
+        self.sent_at: float = time()
+        self.edits: int = 0
+
+    async def edit(self, content: (str, None) = None, embed=None) -> None:
+        await self.channel.round_trip(self)
+        self.content, self.embed = content if content is not None else self.content, embed or self.embed
+        self.edits += 1
+
+
+class StubChannel:
+    """
+    Stand-in for a Discord text channel: keeps what was sent and takes latency seconds per request.
+    Counts the requests Discord would have answered with a 429, from its limit of rate messages per per seconds.
+    >>> channel = StubChannel(1, latency=0)
+    >>> message = asyncio.run(channel.send("hello"))
+    >>> message.content, channel.requests, channel.rate_limited
+    ('hello', 1, 0)
+    """
+
+    def __init__(self, channel_id: int, latency: float = 0.05, rate: int = 5, per: float = 5.0, on_send=None):
+        """
+        :param channel_id: Id returned by StubBot.get_channel
+        :param latency: Seconds every send or edit takes, the round trip to Discord
+        :param rate: Requests Discord allows every per seconds
+        :param per: Seconds of the rate limit window
+        :param on_send: Callable receiving every message once it is sent or edited
+        """
+        self.id: int = channel_id
+        self.latency: float = latency
+        self.rate: int = rate
+        self.per: float = per
+        self.on_send = on_send
+        self.messages: list[StubMessage] = []
+        self.requests: int = 0
+        self.rate_limited: int = 0
+        self._window: deque = deque()  # monotonic times of the requests within the last per seconds
+
+    async def round_trip(self, message: StubMessage) -> None:
+        now: float = monotonic()
+        while self._window and self._window[0] <= now - self.per:
+            self._window.popleft()
+        if len(self._window) >= self.rate:
+            self.rate_limited += 1
+        self._window.append(now)
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        message.sent_at = time()
+        if self.on_send is not None:
+            self.on_send(message)
+
+    async def send(self, content: (str, None) = None, embed=None, file=None) -> StubMessage:
+        message: StubMessage = StubMessage(self, content, embed, file)
+        await self.round_trip(message)
+        self.messages.append(message)
+        return message
+
+
+class StubBot:
+    """Hands out stub channels by id, like bot.get_channel, creating them on first use."""
+
+    def __init__(self, latency: float = 0.05, on_send=None):
+        self.latency: float = latency
+        self.on_send = on_send
+        self.channels: dict[int, StubChannel] = {}
+
+    def get_channel(self, channel_id: int) -> StubChannel:
+        if channel_id not in self.channels:
+            self.channels[channel_id] = StubChannel(channel_id, self.latency, on_send=self.on_send)
+        return self.channels[channel_id]
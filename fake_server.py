@@ -0,0 +1,314 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+from threading import Thread
+from time import monotonic, strftime, time
+
+from launch_profiles import server_properties
+from rcon import serve_stand_in
+
+VERSION: str = "1.20.1"
+PROTOCOL: int = 763
+TICK: float = 0.05
+_NAMES: tuple = ("Steve", "Alex", "Notch", "Jeb_", "Dinnerbone", "Grumm", "Herobrine", "Marc")
+
+
+def player_name(index: int) -> str:
+    """
+    >>> player_name(9)
+    'Alex1'
+    """
+    return _NAMES[index % len(_NAMES)] + (str(index // len(_NAMES)) if index >= len(_NAMES) else "")
+
+
+def _write_varint(value: int) -> bytes:
+    out: bytearray = bytearray()
+    value &= 0xFFFFFFFF
+    while True:
+        byte: int = value & 0x7F
+        value >>= 7
+        out.append(byte | (0x80 if value else 0))
+        if not value:
+            return bytes(out)
+
+
+async def _read_varint(reader: asyncio.StreamReader) -> int:
+    value: int = 0
+    for shift in range(0, 35, 7):
+        byte: int = (await reader.readexactly(1))[0]
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value
+    raise ValueError("VarInt too long")
+
+
+def _packet(packet_id: int, payload: bytes) -> bytes:
+    body: bytes = _write_varint(packet_id) + payload
+    return _write_varint(len(body)) + body
+
+
+class FakeServer:
+    """
+    Stand-in for a Minecraft server, to run the bot and its benchmarks without a jar or a JVM.
+    Set java_path to "python3 /path/to/fake_server.py" and mc!launch starts it with the usual java flags, which it
+    ignores. The path must be absolute, as the server is started from the directory of its jar.
+    It writes a vanilla-like startup and chat to stdout and logs/latest.log, answers commands on stdin,
+    Server List Ping on server-port, and RCON when server.properties enables it.
+    Chat lines end with their sequence number and emission time, so a reader can measure the lag of every line.
+    """
+
+    def __init__(self, options: argparse.Namespace):
+        self.options: argparse.Namespace = options
+        self.players: list[str] = []
+        self.commands: int = 0
+        self.lines: int = 0
+        self.chat_sequence: int = 0
+        self.ready: bool = False
+        self.exit_code: (int, None) = None
+        self.stopped: asyncio.Event = asyncio.Event()
+        self.started_at: float = monotonic()
+        self.saving: bool = True
+        os.makedirs("logs", exist_ok=True)
+        self.log = open(os.path.join("logs", "latest.log"), 'w') if options.log else None
+
+    def emit(self, message: str, thread: str = "Server thread", level: str = "INFO") -> None:
+        """Writes a console line. Output is flushed once per tick, like the server's own async appender."""
+        line: str = f"[{strftime('%H:%M:%S')}] [{thread}/{level}]: {message}\n"
+        try:
+            sys.stdout.write(line)
+        except BrokenPipeError:
+            self.console_closed()
+        if self.log is not None:
+            self.log.write(line)
+        self.lines += 1
+
+    def flush(self) -> None:
+        try:
+            sys.stdout.flush()
+        except BrokenPipeError:
+            self.console_closed()
+        if self.log is not None:
+            self.log.flush()
+
+    @staticmethod
+    def console_closed() -> None:
+        """The bot which read the console is gone: like the JVM, keep running and writing the log."""
+        sys.stdout = open(os.devnull, 'w')
+
+    def status(self) -> dict:
+        """The Server List Ping answer."""
+        return {
+            "version": {"name": VERSION, "protocol": PROTOCOL},
+            "players": {"max": self.options.max_players, "online": len(self.players),
+                        "sample": [{"name": name, "id": f"00000000-0000-0000-0000-{index:012d}"}
+                                   for index, name in enumerate(self.players[:12])]},
+            "description": {"text": self.options.motd},
+        }
+
+    def run_command(self, text: str, source: str = "Server") -> list[str]:
+        """Runs a console command and returns its reply lines."""
+        self.commands += 1
+        name, _, argument = text.strip().removeprefix("/").partition(" ")
+        if name == "stop":
+            asyncio.get_running_loop().call_soon(self.stop, 0)
+            return []
+        if name == "list":
+            return [f"There are {len(self.players)} of a max of {self.options.max_players} players online: "
+                    + ", ".join(self.players)]
+        if name == "say":
+            return [f"[{source}] {argument}"]
+        if name == "save-all":
+            return ["Saving the game (this may take a moment!)", "Saved the game"]
+        if name in ("save-off", "save-on"):
+            self.saving = name == "save-on"
+            return [f"Automatic saving is now {'enabled' if self.saving else 'disabled'}"]
+        if name == "tps":
+            tps: float = min(20.0, 1000 / self.options.mspt)
+            return [f"TPS from last 1m, 5m, 15m: {tps:.1f}, {tps:.1f}, {tps:.1f}"]
+        if name == "mspt":
+            times: str = f"{self.options.mspt:.1f}/{self.options.mspt * .6:.1f}/{self.options.mspt * 2:.1f}"
+            return ["Server tick times (avg/min/max) from last 5s, 10s, 1m:", "◴ " + ", ".join([times] * 3)]
+        if name == "forceload" and argument.split()[0] in ("add", "remove") and len(argument.split()) == 5:
+            action, *corners = argument.split()
+            x1, z1, x2, z2 = (int(corner) // 16 for corner in corners)
+            chunks: int = (abs(x2 - x1) + 1) * (abs(z2 - z1) + 1)
+            if action == "add":
+                return [f"Marked {chunks} chunks in minecraft:overworld from [{x1}, {z1}] to [{x2}, {z2}] "
+                        "to be force loaded"]
+            return [f"Unmarked {chunks} chunks in minecraft:overworld from [{x1}, {z1}] to [{x2}, {z2}] "
+                    "for force loading"]
+        return ["Unknown or incomplete command, see below for error", f"{text.strip()}<--[HERE]"]
+
+    def handle_stdin(self, line: str) -> None:
+        if not line.strip():
+            return
+        for reply in self.run_command(line):
+            self.emit(reply)
+
+    def handle_rcon(self, command: str) -> str:
+        return "\n".join(self.run_command(command, source="Rcon"))
+
+    def join(self, name: str) -> None:
+        self.players.append(name)
+        self.emit(f"{name}[/127.0.0.1:{50000 + len(self.players)}] logged in with entity id {len(self.players)} "
+                  "at (0.5, 64.0, 0.5)")
+        self.emit(f"{name} joined the game")
+
+    def leave(self, name: str) -> None:
+        self.players.remove(name)
+        self.emit(f"{name} lost connection: Disconnected")
+        self.emit(f"{name} left the game")
+
+    def stop(self, exit_code: int) -> None:
+        if self.exit_code is not None:
+            return
+        self.exit_code = exit_code
+        if exit_code == 0 or exit_code == 128 + signal.SIGTERM:
+            for message in ("Stopping the server", "Stopping server", "Saving players", "Saving worlds",
+                            "Saving chunks for level 'ServerLevel[world]'/minecraft:overworld",
+                            "ThreadedAnvilChunkStorage (world): All chunks are saved"):
+                self.emit(message)
+        self.flush()
+        self.stopped.set()
+
+    def crash(self) -> None:
+        self.emit("Encountered an unexpected exception", level="ERROR")
+        self.emit("java.lang.IllegalStateException: fake_server --crash-after", level="ERROR")
+        self.emit("This crash report has been saved to: ./crash-reports/crash-fake-server.txt", level="ERROR")
+        self.stop(1)
+
+    async def startup(self) -> None:
+        steps: list[str] = [
+            f"Starting minecraft server version {VERSION}", "Loading properties", "Default game type: SURVIVAL",
+            "Generating keypair", f"Starting Minecraft server on *:{self.options.port}",
+            "Using epoll channel type", "Preparing level \"world\"",
+            *(f"Preparing spawn area: {percent}%" for percent in range(0, 100, 10)),
+        ]
+        pause: float = self.options.startup_seconds / len(steps)
+        for step in steps:
+            self.emit(step)
+            self.flush()
+            await asyncio.sleep(pause)
+        self.emit("Time elapsed: {:.0f} ms".format(1000 * (monotonic() - self.started_at)))
+        self.emit(f"Done ({monotonic() - self.started_at:.3f}s)! For help, type \"help\"")
+        self.ready = True
+        for index in range(self.options.players):
+            self.join(player_name(index))
+        self.flush()
+
+    async def chat(self) -> None:
+        """Writes chat at chat_rate lines per second, and lets a player join or leave every churn seconds."""
+        next_tick: float = monotonic()
+        due: float = 0.0
+        next_churn: float = next_tick + self.options.churn if self.options.churn else float("inf")
+        while True:
+            if self.options.chat_rate and self.players:
+                due += self.options.chat_rate * TICK
+                while due >= 1:
+                    due -= 1
+                    self.chat_sequence += 1
+                    speaker: str = self.players[self.chat_sequence % len(self.players)]
+                    self.emit(f"<{speaker}> {self.options.chat_text} #{self.chat_sequence} @{time():.6f}",
+                              thread="Async Chat Thread - #0")
+            if monotonic() >= next_churn:
+                next_churn += self.options.churn
+                if len(self.players) > self.options.players:
+                    self.leave(self.players[-1])
+                else:
+                    self.join(player_name(len(self.players)))
+            self.flush()
+            next_tick += TICK
+            await asyncio.sleep(max(0.0, next_tick - monotonic()))
+
+    async def handle_ping(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Answers Server List Ping: handshake, status request, then ping."""
+        handshaken: bool = False
+        try:
+            while True:
+                await _read_varint(reader)  # length
+                packet_id: int = await _read_varint(reader)
+                if packet_id == 0x00 and not handshaken:
+                    await _read_varint(reader)  # protocol
+                    address_length: int = await _read_varint(reader)
+                    await reader.readexactly(address_length + 2)  # address and port
+                    await _read_varint(reader)  # next state
+                    handshaken = True
+                elif packet_id == 0x00:
+                    payload: bytes = json.dumps(self.status()).encode()
+                    writer.write(_packet(0x00, _write_varint(len(payload)) + payload))
+                elif packet_id == 0x01:
+                    writer.write(_packet(0x01, await reader.readexactly(8)))
+                    await writer.drain()
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self) -> int:
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        if hasattr(signal, "SIGTERM"):
+            try:
+                loop.add_signal_handler(signal.SIGTERM, self.stop, 128 + signal.SIGTERM)
+            except NotImplementedError:
+                pass
+
+        def read_stdin() -> None:
+            for line in sys.stdin:
+                loop.call_soon_threadsafe(self.handle_stdin, line)
+
+        Thread(target=read_stdin, daemon=True).start()
+        servers: list = [await asyncio.start_server(self.handle_ping, self.options.host, self.options.port)]
+        if self.options.rcon_port:
+            servers.append(await serve_stand_in(self.options.host, self.options.rcon_port,
+                                                self.options.rcon_password, self.handle_rcon))
+
+        tasks: list[asyncio.Task] = [asyncio.create_task(self.startup())]
+        tasks[0].add_done_callback(lambda _: tasks.append(asyncio.create_task(self.chat())))
+        if self.options.crash_after:
+            loop.call_later(self.options.crash_after, self.crash)
+        await self.stopped.wait()
+        for task in tasks:
+            task.cancel()
+        for server in servers:
+            server.close()
+        if self.log is not None:
+            self.log.close()
+        return self.exit_code
+
+
+def parse_options(argv: list[str]) -> argparse.Namespace:
+    """
+    Options of the stand-in. Defaults come from the server.properties of the working directory,
+    and java flags such as -Xmx2048M or -jar server.jar are ignored.
+    """
+    properties: dict[str, str] = server_properties(".")
+    rcon_enabled: bool = properties.get("enable-rcon") == "true"
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description="Stand-in for a Minecraft server")
+    parser.add_argument("--host", default=properties.get("server-ip") or "127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(properties.get("server-port") or 25565))
+    parser.add_argument("--rcon-port", type=int, default=int(properties.get("rcon.port") or 25575)
+                        if rcon_enabled else 0, help="0 disables RCON")
+    parser.add_argument("--rcon-password", default=properties.get("rcon.password", ""))
+    parser.add_argument("--motd", default=properties.get("motd") or "A Minecraft Server")
+    parser.add_argument("--max-players", type=int, default=int(properties.get("max-players") or 20))
+    parser.add_argument("--players", type=int, default=2, help="players online once ready")
+    parser.add_argument("--startup-seconds", type=float, default=2.0)
+    parser.add_argument("--chat-rate", type=float, default=1.0, help="chat lines per second")
+    parser.add_argument("--chat-text", default="hello")
+    parser.add_argument("--churn", type=float, default=0.0, help="seconds between joins and leaves, 0 for none")
+    parser.add_argument("--mspt", type=float, default=12.0, help="reported by the tps and mspt commands")
+    parser.add_argument("--crash-after", type=float, default=0.0, help="seconds before crashing, 0 for never")
+    parser.add_argument("--no-log", dest="log", action="store_false", help="do not write logs/latest.log")
+    options, _ = parser.parse_known_args(argv)
+    return options
+
+
+if __name__ == "__main__":
+    # options may also come from the environment, as the bot builds the command line
+    options: argparse.Namespace = parse_options(os.environ.get("FAKE_SERVER_OPTIONS", "").split() + sys.argv[1:])
+    sys.exit(asyncio.run(FakeServer(options).serve()))
@@ -0,0 +1,316 @@
+import asyncio
+import gzip
+import os
+import re
+from datetime import datetime, date, timedelta
+from threading import Lock
+from time import time, monotonic
+
+from presence import parse_presence, JOIN, LEAVE
+
+_CHAT_PATTERN: re.Pattern = re.compile(r"\]: (\[Not Secure\] )?<(?P<name>[^>\s]{1,32})> (?P<message>.*)$")
+_ADVANCEMENT_PATTERN: re.Pattern = re.compile(r"\]: (?P<name>[^\s<\[]\S{0,31}) has "
+                                              r"(made the advancement|completed the challenge|reached the goal) "
+                                              r"\[(?P<advancement>[^\]]+)\]")
+_TIME_PATTERN: re.Pattern = re.compile(r"^\[(?:\d{2}\w{3}\d{4} )?(?P<hour>\d{2}):(?P<minute>\d{2}):(?P<second>\d{2})")
+_LOG_NAME_PATTERN: re.Pattern = re.compile(r"^(?P<date>\d{4}-\d{2}-\d{2})-\d+\.log(\.gz)?$")
+
+_SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS sessions (server TEXT NOT NULL, player TEXT NOT NULL,
+                                     joined_at REAL NOT NULL, left_at REAL NOT NULL);
+DROP INDEX IF EXISTS sessions_player;
+CREATE INDEX IF NOT EXISTS sessions_player_nocase ON sessions (player COLLATE NOCASE, left_at);
+CREATE INDEX IF NOT EXISTS sessions_left_at ON sessions (left_at);
+CREATE TABLE IF NOT EXISTS chat (server TEXT NOT NULL, player TEXT NOT NULL, at REAL NOT NULL, message TEXT NOT NULL);
+DROP INDEX IF EXISTS chat_player;
+CREATE INDEX IF NOT EXISTS chat_player_nocase ON chat (player COLLATE NOCASE, at);
+CREATE TABLE IF NOT EXISTS advancements (server TEXT NOT NULL, player TEXT NOT NULL, at REAL NOT NULL,
+                                         advancement TEXT NOT NULL);
+DROP INDEX IF EXISTS advancements_player;
+CREATE INDEX IF NOT EXISTS advancements_player_nocase ON advancements (player COLLATE NOCASE, at);
+CREATE TABLE IF NOT EXISTS imported_logs (server TEXT NOT NULL, name TEXT NOT NULL, PRIMARY KEY (server, name));
+"""
+
+
+def parse_period(period: str) -> (float, None):
+    """
+    Turns a period like 7d, 12h or 30m into seconds. "all" is None.
+    Raises ValueError for anything else.
+    >>> parse_period("7d")
+    604800.0
+    >>> parse_period("all")
+    """
+    if period == "all":
+        return None
+    match: (re.Match, None) = re.fullmatch(r"(\d+(?:\.\d+)?)([dhmw])", period)
+    if match is None:
+        raise ValueError(f"Invalid period {period}")
+    return float(match.group(1)) * {"m": 60, "h": 3600, "d": 86400, "w": 604800}[match.group(2)]
+
+
+def line_time(line: str, day: date) -> (float, None):
+    """
+    Epoch time of a log line, from its [HH:MM:SS] prefix and the day of its log file.
+    >>> line_time("[18:03:11] [Server thread/INFO]: Steve joined the game", date(2024, 1, 31)) > 0
+    True
+    """
+    match: (re.Match, None) = _TIME_PATTERN.search(line)
+    if match is None:
+        return None
+    return datetime(day.year, day.month, day.day,
+                    int(match.group("hour")), int(match.group("minute")), int(match.group("second"))).timestamp()
+
+
+class EventBuffer:
+    """
+    Session, chat and advancement rows parsed from console lines, waiting to be written.
+    >>> events = EventBuffer()
+    >>> events.feed("survival", "[18:03:11] [Server thread/INFO]: <Steve> hello", at=1700000000.0)
+    >>> events.chat
+    [('survival', 'Steve', 1700000000.0, 'hello')]
+    """
+
+    def __init__(self):
+        self.open_sessions: dict[tuple[str, str], float] = {}  # (server, player): joined_at
+        self.sessions: list[tuple] = []
+        self.chat: list[tuple] = []
+        self.advancements: list[tuple] = []
+        self.oldest: (float, None) = None  # monotonic time of the oldest row
+
+    def __len__(self) -> int:
+        return len(self.sessions) + len(self.chat) + len(self.advancements)
+
+    def online(self, server: (str, None) = None) -> set[str]:
+        """Players with an open session, on a server or on any."""
+        return {player for (name, player) in self.open_sessions if server is None or name == server}
+
+    def feed(self, server: str, line: str, at: float) -> None:
+        """
+        Buffers the session, chat or advancement event of a console line, if it has one.
+        :param server: Name of the server which printed the line
+        :param line: A single console line
+        :param at: Epoch time of the line
+        """
+        presence: (tuple[str, str], None) = parse_presence(line)
+        if presence is not None:
+            kind, player = presence
+            if kind == JOIN:
+                self.open_sessions.setdefault((server, player), at)
+            elif kind == LEAVE and (server, player) in self.open_sessions:
+                self.sessions.append((server, player, self.open_sessions.pop((server, player)), at))
+        else:
+            chat: (re.Match, None) = _CHAT_PATTERN.search(line)
+            advancement: (re.Match, None) = None if chat else _ADVANCEMENT_PATTERN.search(line)
+            if chat is not None:
+                self.chat.append((server, chat.group("name"), at, chat.group("message")))
+            elif advancement is not None:
+                self.advancements.append((server, advancement.group("name"), at, advancement.group("advancement")))
+        if self.oldest is None and len(self):
+            self.oldest = monotonic()
+
+    def close_sessions(self, server: str, at: float) -> None:
+        """Ends every open session of a server, ie when it stops or crashes."""
+        for key in [key for key in self.open_sessions if key[0] == server]:
+            self.sessions.append((*key, self.open_sessions.pop(key), at))
+        if self.oldest is None and len(self):
+            self.oldest = monotonic()
+
+    def take(self) -> tuple[list, list, list]:
+        """Returns the buffered sessions, chat and advancements and empties the buffer. Open sessions stay."""
+        rows: tuple[list, list, list] = (self.sessions, self.chat, self.advancements)
+        self.sessions, self.chat, self.advancements = [], [], []
+        self.oldest = None
+        return rows
+
+
+class HistoryIndex:
+    """
+    SQLite index of play sessions, chat and advancements, fed from the console.
+    Events are buffered in memory and written in batches; every database access runs off the event loop.
+    >>> history = HistoryIndex(":memory:")
+    >>> history.feed("survival", "[18:03:11] [Server thread/INFO]: Steve joined the game")
+    >>> asyncio.run(history.flush())
+    >>> asyncio.run(history.seen("steve"))
+    (None, True)
+    >>> history.feed("survival", "[18:09:11] [Server thread/INFO]: Steve left the game")
+    >>> asyncio.run(history.flush())
+    >>> seen, online = asyncio.run(history.seen("Steve"))
+    >>> seen is not None, online
+    (True, False)
+    """
+
+    def __init__(self, path: str, batch_size: int = 200, max_delay: float = 5.0):
+        """
+        :param path: Path of the database file, created if missing
+        :param batch_size: Amount of buffered rows which triggers a write
+        :param max_delay: Seconds after which buffered rows are written anyway
+        """
+        self.path: str = path
+        self.batch_size: int = batch_size
+        self.max_delay: float = max_delay
+        self._lock: Lock = Lock()
+        self._database = None  # sqlite3.Connection, opened by the first write or query
+        self._events: EventBuffer = EventBuffer()
+
+    @property
+    def _connection(self):
+        """
+        The database connection, opened and migrated on first use, which always runs off the event loop.
+        Callers hold the lock.
+        """
+        if self._database is None:
+            import sqlite3
+
+            connection: sqlite3.Connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(_SCHEMA)
+            self._database = connection
+        return self._database
+
+    @property
+    def buffered(self) -> int:
+        return len(self._events)
+
+    def feed(self, server: str, line: str) -> None:
+        """Buffers the event of a live console line, timed now. See EventBuffer.feed"""
+        self._events.feed(server, line, time())
+
+    def close_sessions(self, server: str) -> None:
+        """Ends every open session of a server now, ie when it stops or crashes."""
+        self._events.close_sessions(server, time())
+
+    def _write(self, sessions: list, chat: list, advancements: list, imported: (tuple, None) = None) -> None:
+        with self._lock, self._connection:
+            self._connection.executemany("INSERT INTO sessions VALUES (?, ?, ?, ?)", sessions)
+            self._connection.executemany("INSERT INTO chat VALUES (?, ?, ?, ?)", chat)
+            self._connection.executemany("INSERT INTO advancements VALUES (?, ?, ?, ?)", advancements)
+            if imported is not None:
+                self._connection.execute("INSERT INTO imported_logs VALUES (?, ?)", imported)
+
+    async def flush(self, force: bool = True) -> None:
+        """
+        Writes the buffered rows in a single transaction, off the event loop.
+        :param force: Write even if the batch is neither full nor old enough
+        """
+        if not self.buffered:
+            return
+        due: bool = self.buffered >= self.batch_size or monotonic() - self._events.oldest >= self.max_delay
+        if force or due:
+            await asyncio.to_thread(self._write, *self._events.take())
+
+    def _query(self, sql: str, parameters: tuple) -> list[tuple]:
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    async def seen(self, player: str, server: (str, None) = None) -> tuple[(float, None), bool]:
+        """
+        When a player was last seen.
+        :return: (epoch time of their last leave or None if never seen, whether they are online now)
+        """
+        rows: list[tuple] = await asyncio.to_thread(
+            self._query, "SELECT MAX(left_at) FROM sessions WHERE player = ? COLLATE NOCASE"
+                         " AND (? IS NULL OR server = ?)", (player, server, server))
+        online: bool = any(name.lower() == player.lower() for name in self._events.online(server))
+        return rows[0][0], online
+
+    async def playtime(self, since: (float, None) = None, server: (str, None) = None,
+                       limit: int = 10) -> list[tuple[str, float]]:
+        """
+        Play time per player, the longest first. Sessions are clipped to the period, open sessions count until now.
+        :param since: Epoch time the period starts at. None for all time.
+        :return: List of (player, seconds)
+        """
+        since = 0.0 if since is None else since
+        rows: list[tuple] = await asyncio.to_thread(
+            self._query, "SELECT player, SUM(left_at - MAX(joined_at, ?)) FROM sessions"
+                         " WHERE left_at > ? AND (? IS NULL OR server = ?) GROUP BY player",
+            (since, since, server, server))
+        totals: dict[str, float] = dict(rows)
+        now: float = time()
+        for (name, player), joined_at in self._events.open_sessions.items():
+            if server is None or name == server:
+                totals[player] = totals.get(player, 0.0) + now - max(joined_at, since)
+        return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+    async def top(self, server: (str, None) = None, limit: int = 10) -> list[tuple[str, float, int, int]]:
+        """
+        Most active players of all time.
+        :return: List of (player, play time in seconds, chat messages, advancements)
+        """
+        playtime: list[tuple[str, float]] = await self.playtime(server=server, limit=limit)
+        players: list[str] = [player for player, _ in playtime]
+        if not players:
+            return []
+        marks: str = ", ".join("?" * len(players))
+        # names are compared like the player indexes do, ignoring case
+        chat: dict[str, int] = dict(await asyncio.to_thread(
+            self._query, f"SELECT LOWER(player), COUNT(*) FROM chat WHERE player COLLATE NOCASE IN ({marks})"
+                         " AND (? IS NULL OR server = ?) GROUP BY player COLLATE NOCASE", (*players, server, server)))
+        advancements: dict[str, int] = dict(await asyncio.to_thread(
+            self._query, f"SELECT LOWER(player), COUNT(*) FROM advancements WHERE player COLLATE NOCASE IN ({marks})"
+                         " AND (? IS NULL OR server = ?) GROUP BY player COLLATE NOCASE", (*players, server, server)))
+        return [(player, seconds, chat.get(player.lower(), 0), advancements.get(player.lower(), 0))
+                for player, seconds in playtime]
+
+    def _backfill(self, server: str, logs_dir: str) -> int:
+        imported: set[str] = {name for (name,) in self._query("SELECT name FROM imported_logs WHERE server = ?",
+                                                               (server,))}
+        lines: int = 0
+        # the day of each archive is in its name, ie 2024-01-31-1.log.gz, sorting by name is chronological
+        for name in sorted(os.listdir(logs_dir)):
+            match: (re.Match, None) = _LOG_NAME_PATTERN.match(name)
+            if match is None or name in imported:
+                continue
+            day: date = date.fromisoformat(match.group("date"))
+            events: EventBuffer = EventBuffer()
+            path: str = os.path.join(logs_dir, name)
+            previous: float = 0.0
+            first: (float, None) = None
+            # gzip.open decompresses while streaming, the archive is never held in memory
+            with (gzip.open(path, 'rt', errors="replace") if name.endswith(".gz")
+                  else open(path, 'r', errors="replace")) as log:
+                for line in log:
+                    at: (float, None) = line_time(line, day)
+                    if at is None:
+                        continue
+                    # a log spanning midnight continues on the next day
+                    if at < previous - 43200:
+                        day += timedelta(days=1)
+                        at = line_time(line, day)
+                    previous = at
+                    first = at if first is None else first
+                    events.feed(server, line.rstrip("\n"), at)
+                    lines += 1
+            events.close_sessions(server, previous)
+            sessions, chat, advancements = events.take()
+            if first is not None:
+                # the console fed the index while this log was written, from then on its rows are already stored
+                covered: (float, None) = self._covered_from(server, first, previous)
+                if covered is not None:
+                    sessions = [(*row[:3], min(row[3], covered)) for row in sessions if row[2] < covered]
+                    chat = [row for row in chat if row[2] < covered]
+                    advancements = [row for row in advancements if row[2] < covered]
+            self._write(sessions, chat, advancements, imported=(server, name))
+        return lines
+
+    def _covered_from(self, server: str, start: float, end: float) -> (float, None):
+        """Time of the first row of a server already stored between start and end, None if there is none."""
+        rows: list[tuple] = self._query(
+            "SELECT MIN(at) FROM (SELECT MAX(joined_at, ?) AS at FROM sessions"
+            " WHERE server = ? AND left_at >= ? AND joined_at <= ?"
+            " UNION ALL SELECT at FROM chat WHERE server = ? AND at BETWEEN ? AND ?"
+            " UNION ALL SELECT at FROM advancements WHERE server = ? AND at BETWEEN ? AND ?)",
+            (start, server, start, end, server, start, end, server, start, end))
+        return rows[0][0]
+
+    async def backfill(self, server: str, logs_dir: str) -> int:
+        """
+        Imports the server's rotated log archives that were not imported yet, off the event loop.
+        latest.log is left out, it is still being written and its lines come through the console.
+        Rows of an archive from the time the console already fed the index on are left out, so none is counted twice.
+        :param server: Name of the server the logs belong to
+        :param logs_dir: The server's logs directory
+        :return: Amount of lines read
+        """
+        return await asyncio.to_thread(self._backfill, server, logs_dir)
@@ -0,0 +1,143 @@
+import os
+import shlex
+
+from assistant_functions import read_meminfo
+from constants import JavaArgs, JvmProfiles
+
+AUTO_MEM: str = "auto"
+
+
+def resolve_profile(name: str, custom_profiles: dict[str, list[str]]) -> list[str]:
+    """
+    Returns the JVM flags of a launch profile, looking in config before the built-in profiles.
+    Raises ValueError if the profile does not exist.
+    >>> resolve_profile("zgc", {})[:2]
+    ['-XX:+UseZGC', '-XX:+AlwaysPreTouch']
+    >>> resolve_profile("mine", {"mine": ["-XX:+UseParallelGC"]})
+    ['-XX:+UseParallelGC']
+    """
+    if name in custom_profiles:
+        return list(custom_profiles[name])
+    if name in JvmProfiles:
+        return list(JvmProfiles[name])
+    raise ValueError(f"Unknown launch profile {name}")
+
+
+def build_launch_args(jar_path: str, mem_alloc: int, profile_flags: list[str],
+                      active_processors: (int, None) = None, java: str = JavaArgs.Java.value) -> list[str]:
+    """
+    Builds the full java command line of a server.
+    -Xms equals -Xmx unless the profile gives its own -Xms.
+    :param jar_path: Path of the server jar
+    :param mem_alloc: -Xmx in MB
+    :param profile_flags: JVM flags of the launch profile, see resolve_profile
+    :param active_processors: Adds -XX:ActiveProcessorCount when given
+    :param java: Command starting the JVM, split like a shell would, ie a JDK's path or "python3 fake_server.py"
+    >>> build_launch_args("server.jar", 2048, [])
+    ['java', '-Xmx2048M', '-Xms2048M', '-server', '-jar', 'server.jar']
+    >>> build_launch_args("s.jar", 2048, ["-Xms256M", "-XX:+UseSerialGC"], active_processors=2)
+    ['java', '-Xmx2048M', '-Xms256M', '-XX:+UseSerialGC', '-XX:ActiveProcessorCount=2', '-server', '-jar', 's.jar']
+    """
+    args: list[str] = [*shlex.split(java), JavaArgs.MaxMem.value.format(mem_alloc)]
+    if not any(flag.startswith("-Xms") for flag in profile_flags):
+        args.append(JavaArgs.MinMem.value.format(mem_alloc))
+    args.extend(profile_flags)
+    if active_processors is not None:
+        args.append(JavaArgs.ActiveProcessors.value.format(active_processors))
+    args.extend([JavaArgs.Server.value, JavaArgs.Jar.value, jar_path])
+    return args
+
+
+def split_profile(args: tuple) -> tuple[(str, None), tuple]:
+    """
+    Takes --profile <name> or --profile=<name> out of a command's arguments.
+    >>> split_profile(("4096", "--profile", "aikar"))
+    ('aikar', ('4096',))
+    >>> split_profile(("--profile=zgc",))
+    ('zgc', ())
+    >>> split_profile(("4096",))
+    (None, ('4096',))
+    """
+    rest: list[str] = list(args)
+    for i, arg in enumerate(rest):
+        if arg.startswith("--profile="):
+            return arg.partition("=")[2], tuple(rest[:i] + rest[i + 1:])
+        if arg == "--profile" and i + 1 < len(rest):
+            return rest[i + 1], tuple(rest[:i] + rest[i + 2:])
+    return None, tuple(rest)
+
+
+def server_properties(server_dir: str) -> dict[str, str]:
+    """
+    Reads the server.properties of a server. Empty if the server never ran yet.
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as server_dir:
+    ...     with open(os.path.join(server_dir, "server.properties"), 'w') as properties_file:
+    ...         _ = properties_file.write("#Minecraft server properties\\nrcon.port=25575\\n")
+    ...     server_properties(server_dir)["rcon.port"]
+    '25575'
+    >>> server_properties(os.devnull)
+    {}
+    """
+    properties: dict[str, str] = {}
+    try:
+        with open(os.path.join(server_dir, "server.properties"), 'r') as properties_file:
+            for line in properties_file:
+                if line.startswith("#"):
+                    continue
+                key, _, value = line.strip().partition("=")
+                properties[key] = value
+    except OSError:
+        pass
+    return properties
+
+
+def world_dir(server_dir: str) -> str:
+    """
+    Returns the world directory of a server, from level-name in server.properties. Defaults to world.
+    """
+    return os.path.join(server_dir, server_properties(server_dir).get("level-name") or "world")
+
+
+def directory_size(path: str) -> int:
+    """
+    Returns the size in bytes of every file under path. Missing directories are 0.
+    Walks the whole tree, so for big worlds call it off the event loop.
+    """
+    total: int = 0
+    stack: list[str] = [path]
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                else:
+                    total += entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                continue
+    return total
+
+
+def auto_mem(world_size: int, available_mb: (int, None) = None) -> int:
+    """
+    Picks -Xmx for a world: 2 GB plus 512 MB per GB of world, at most three quarters of the available RAM.
+    Rounded down to 256 MB and never under 512 MB.
+    :param world_size: Size of the world directory in bytes
+    :param available_mb: Available RAM in MB. Read from /proc/meminfo when None; without it there is no cap.
+    >>> auto_mem(3 * 1024 ** 3, available_mb=16000)
+    3584
+    >>> auto_mem(30 * 1024 ** 3, available_mb=8000)
+    5888
+    """
+    if available_mb is None:
+        meminfo: dict[str, int] = read_meminfo()
+        available_mb = meminfo["MemAvailable"] // 1024 if "MemAvailable" in meminfo else None
+
+    wanted: int = 2048 + 512 * world_size // 1024 ** 3
+    if available_mb is not None:
+        wanted = min(wanted, available_mb * 3 // 4)
+    return max(512, wanted // 256 * 256)
@@ -1,31 +1,145 @@
+import asyncio
+import io
 import json
 import os
-import discord
-import subprocess
+import re
+import shlex
+import sys
 
-from dotenv import load_dotenv
-from discord.ext import commands, tasks
-from mcstatus import JavaServer
-from sys import builtin_module_names
-from time import time
+from time import time, monotonic, perf_counter
+from typing import TYPE_CHECKING
 
-from constants import Messages, ErrorMessages, JavaArgs
-from assistant_functions import is_valid_ipv4_address, get_ip, get_path, get_mem, write_to_config, proc_read
+from constants import Messages, ErrorMessages
+from assistant_functions import is_valid_ipv4_address, get_ip, get_path, get_mem, write_to_config, \
+    get_relay_latency, get_live_console, get_idle_grace, get_query_enabled, config_store, format_duration, \
+    format_bytes
+from config_store import DEFAULT_SERVER, ServerConfig, BotConfig
+from console_relay import ConsoleRelay
+from launch_profiles import AUTO_MEM, resolve_profile, build_launch_args, split_profile, world_dir, directory_size, \
+    auto_mem, server_properties
+from server_manager import ServerManager, ServerInstance
+from status_service import StatusService, StatusResult
+from telemetry import Sample
+from history import HistoryIndex, parse_period
+from scrollback import matching, tail_file
+from output_filters import OutputFilter, ROUTE
+from rcon import RconClient
+from reattach import AttachedProcess, PidRecord, find_running, LOG_FILE
+from resources import Isolation, isolate, remove_cgroup, cgroup_usage, process_scheduling, format_cpus, CPU_PERIOD
+from server_state import ServerState
+from supervisor import RestartPolicy
+from batch import BatchJob, parse_script, parse_parameters, substitute
+from pregen import PregenManager, PregenJob, METHODS
+from metrics import instrumented, start_metrics_server, REGISTRY, FEEDBACK_TICK_SECONDS, RELAY_PENDING, RELAY_LAG, \
+    RELAY_MESSAGES, RELAY_LINES, RELAY_SKIPPED, SERVER_UP, SERVER_UPTIME, SERVER_RESTARTS, PLAYERS_ONLINE, \
+    STDOUT_LINES, STDOUT_DROPPED, STDOUT_PENDING, FILTER_HITS, RCON_SECONDS, RCON_FALLBACKS, SERVER_EXITS, \
+    STARTUP_SECONDS
 
+if TYPE_CHECKING:
+    from backups import BackupStore, BackupReport
+
+# imported by the first command needing them rather than at startup, listed by the startup report
+LAZY_MODULES: tuple = ("mcstatus", "sqlite3", "backups", "concurrent.futures.process")
+# the modules above are light, discord, which is most of the import time, is imported and timed by main
+STARTED_AT: float = perf_counter()
+
+
+def main(startup_report: bool = False):
+    """
+    First, initialize intents (options) and bot through a token in .env
+    :param startup_report: Print how long each phase of the startup took once the first command was answered,
+                           then exit
+    """
+    """Seconds from the start of the bot to each phase of its startup"""
+    startup_phases: dict[str, float] = {}
+
+    def startup_phase(phase: str) -> None:
+        """Records the first time the startup reaches a phase, printed and exported as mcbot_startup_seconds."""
+        if phase in startup_phases:
+            return
+        startup_phases[phase] = perf_counter() - STARTED_AT
+        STARTUP_SECONDS.set(startup_phases[phase], phase=phase)
+        print("Startup: {} after {:.3f} s".format(phase, startup_phases[phase]))
+
+
+    # imported here rather than at the top, so that importing this module stays cheap
+    import discord
+    from discord.ext import commands, tasks
+    startup_phase("imports")
 
-def main():
-    """First, initialize intents (options) and bot through a token in .env"""
     intents: discord.Intents.default = discord.Intents.default()
     intents.message_content = True
     bot: discord.ext.commands.Bot = commands.Bot(command_prefix="mc!", intents=intents)
 
-    """Initializes config file"""
-    cfg_path: str = os.path.join(ROOT_DIR, "config.json")
-    if not os.path.exists(cfg_path) or not os.stat(cfg_path).st_size:
-        with open(cfg_path, 'w+') as cfg:
-            cfg.write("{}")
+    """Console relay, merging server output into as few messages as the rate limits allow"""
+    console_relay: ConsoleRelay = ConsoleRelay(max_latency=get_relay_latency(), live_console=get_live_console(),
+                                               max_pending=config_store.config.relay_max_pending)
+
+    """Tasks nobody awaits, referenced until they are done"""
+    background_tasks: set[asyncio.Task] = set()
+
+    """Drop, route and highlight rules applied to console lines before they are relayed"""
+    output_filter: OutputFilter = OutputFilter(config_store.config.filters, code_block=console_relay.code_block)
+
+    """Chunk pre-generation jobs, resumed from config.json and stepped by pregen_loop"""
+    pregen_manager: PregenManager = PregenManager(config_store.config.pregen,
+                                                  save=lambda jobs: config_store.set("pregen", jobs))
+
+    """Status queries, cached and shared between mc!status and the inactivity watchdog"""
+    status_service: StatusService = StatusService(use_query=get_query_enabled())
+
+    """Index of sessions, chat and advancements, fed by server_feedback. Its database opens on first use"""
+    history: HistoryIndex = HistoryIndex(os.path.join(ROOT_DIR, config_store.config.history_db))
+
+    def collect_metrics() -> None:
+        """
+        Copies the relay's and every server's current values into their metrics, before each scrape.
+        """
+        RELAY_PENDING.set(console_relay.pending)
+        RELAY_LAG.set(console_relay.lag)
+        RELAY_MESSAGES.set_total(console_relay.messages_sent)
+        RELAY_LINES.set_total(console_relay.lines_merged)
+        RELAY_SKIPPED.set_total(console_relay.lines_skipped)
+        for rule in output_filter.rules:
+            FILTER_HITS.set_total(rule.hits, rule=rule.name)
+        for name in server_manager.names():
+            instance: ServerInstance = server_manager.get(name)
+            SERVER_UP.set(int(instance.running), server=name)
+            SERVER_UPTIME.set(instance.uptime, server=name)
+            SERVER_RESTARTS.set_total(instance.restarts, server=name)
+            if instance.pump is not None:
+                STDOUT_LINES.set(instance.pump.lines_read, server=name)
+                STDOUT_DROPPED.set(instance.pump.lines_dropped, server=name)
+                STDOUT_PENDING.set(instance.pump.pending, server=name)
+            # the console tells joins and leaves as they happen, the status cache only as fresh as its last query
+            if config_store.config.presence_tracking and instance.running and instance.presence is not None:
+                PLAYERS_ONLINE.set(len(instance.presence.online), server=name)
+                continue
+            try:
+                status: (StatusResult, None) = status_service.cached(get_ip(name))
+            except KeyError:
+                continue
+            if status is not None:
+                PLAYERS_ONLINE.set(status.online, server=name)
+
+    REGISTRY.add_collector(collect_metrics)
 
     # region BOT EVENTS AND COMMANDS
+    @bot.event
+    async def setup_hook() -> None:
+        """
+        Starts the metrics endpoint once logged in, if metrics_port is set in config,
+        and takes back the servers left running by the bot's previous run while the gateway connects.
+        """
+        startup_phase("login")
+        config: BotConfig = config_store.config
+        if config.metrics_port is not None:
+            await start_metrics_server(config.metrics_host, config.metrics_port)
+            print(f"Metrics on http://{config.metrics_host}:{config.metrics_port}/metrics")
+        task: asyncio.Task = asyncio.create_task(reattach_servers())
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
     @bot.event
     async def on_ready() -> None:
         """
@@ -33,25 +147,49 @@ def main():
         :return:
         """
         print(f"{bot.user} Online")
+        startup_phase("ready")
         server_feedback.start()
+        pregen_loop.start()
         empty_server_timeout.start()
+        telemetry_loop.change_interval(seconds=config_store.config.telemetry_interval)
+        telemetry_loop.start()
+        if config_store.config.backup_interval is not None:
+            backup_loop.change_interval(minutes=config_store.config.backup_interval)
+            backup_loop.start()
+
+    @bot.event
+    async def on_command(_ctx: discord.ext.commands.context.Context) -> None:
+        startup_phase("first command")
+
+    @bot.event
+    async def on_command_completion(_ctx: discord.ext.commands.context.Context) -> None:
+        """
+        With startup_report, prints the phases of the startup and the heavy modules it did not need, then exits.
+        """
+        if not startup_report or "first answer" in startup_phases:
+            return
+        startup_phase("first answer")
+        print(json.dumps({"phases": {phase: round(seconds, 3) for phase, seconds in startup_phases.items()},
+                          "deferred_modules": [name for name in LAZY_MODULES if name not in sys.modules]}, indent=2))
+        await bot.close()
 
     @bot.command(name="setpath")
+    @instrumented("setpath")
     async def setpath(ctx: discord.ext.commands.context.Context, *args: str) -> None:
         """
-        Sets the path to the server executable.
+        Sets the path to the server executable. mc!setpath [server] <path>
         :param ctx: Channel context
-        :param args: Iterable of arguments, ideally of length 1 (single string)
+        :param args: Iterable of arguments, ideally the path, or the server name and the path
         :return: Sends message in channel. Success / Failure
         """
 
         embed: discord.Embed = discord.Embed()
 
         try:
-            path: str = args[0]
+            server, path = args if len(args) == 2 else (DEFAULT_SERVER, args[0])
             assert os.path.isfile(path)
 
-            write_to_config("jar_path", path)
+            write_to_config("jar_path", path, server)
             embed.add_field(name="Success!", value=Messages.PathSaveSuccess.value)
 
         except Exception as e:
@@ -63,21 +201,23 @@ def main():
             await ctx.channel.send(embed=embed)
 
     @bot.command(name="setip")
+    @instrumented("setip")
     async def setip(ctx: discord.ext.commands.context.Context, *args: str) -> None:
         """
-        Binds the IP of the server.
+        Binds the IP of the server. mc!setip [server] <ip>
         :param ctx: Channel context
-        :param args: Iterable of arguments, ideally of length 1 (single string)
+        :param args: Iterable of arguments, ideally the ip, or the server name and the ip
         :return: Sends message in channel. Success / Failure
         """
 
         embed: discord.Embed = discord.Embed()
 
         try:
-            ip_address: str = args[0].strip()
+            server, ip_address = args if len(args) == 2 else (DEFAULT_SERVER, args[0])
+            ip_address = ip_address.strip()
             assert is_valid_ipv4_address(ip_address)
 
-            write_to_config("ip_address", ip_address)
+            write_to_config("ip_address", ip_address, server)
             embed.add_field(name="Success!", value=Messages.IPSaveSuccess.value)
 
         except Exception as e:
@@ -90,11 +230,13 @@ def main():
             await ctx.channel.send(embed=embed)
 
     @bot.command(name="setmem")
+    @instrumented("setmem")
     async def set_mem(ctx: discord.ext.commands.context.Context, *args: str) -> None:
         embed: discord.Embed = discord.Embed()
         try:
-            assert args and args[0].isdigit()
-            write_to_config("mem_alloc", args[0])
+            server, mem_alloc = args if len(args) == 2 else (DEFAULT_SERVER, args[0] if args else "")
+            assert mem_alloc.isdigit()
+            write_to_config("mem_alloc", mem_alloc, server)
 
             embed.add_field(name="Success", value=Messages.SetMemSuccess.value)
 
@@ -108,27 +250,49 @@ def main():
             await ctx.channel.send(embed=embed)
 
     @bot.command(name="showconfig")
+    @instrumented("showconfig")
     async def show_config(ctx: discord.ext.commands.context.Context):
         embed: discord.Embed = discord.Embed()
-        with open(cfg_path, 'r') as cfg:
-            cfg_json: dict = json.load(cfg)
-        config_dump: str = json.dumps(cfg_json, indent=4)
+        config_dump: str = json.dumps(config_store.as_dict(), indent=4)
         embed.add_field(name="Config", value=config_dump)
+        invalid: dict = config_store.config.errors
+        if invalid:
+            embed.add_field(name="Invalid values (using defaults)",
+                            value="\n".join(f"{key}: {reason}" for key, reason in invalid.items()))
+        await ctx.channel.send(embed=embed)
+
+    @bot.command(name="servers")
+    @instrumented("servers")
+    async def list_servers(ctx: discord.ext.commands.context.Context):
+        """
+        Sends every configured server, whether it is running and the memory reserved by running servers.
+        """
+        embed: discord.Embed = discord.Embed()
+        for name in server_manager.names():
+            instance: ServerInstance = server_manager.get(name)
+            state: str = instance.tracker.state.value if instance.tracker else "stopped"
+            embed.add_field(name=name, value=Messages.ServerListEntry.value
+                            .format(state, instance.mem_alloc) if instance.running else state)
+        embed.set_footer(text=Messages.ReservedMemory.value.format(server_manager.reserved_memory()))
         await ctx.channel.send(embed=embed)
 
     @bot.command(name="status")
-    async def get_status(ctx: discord.ext.commands.context.Context) -> None:
+    @instrumented("status")
+    async def get_status(ctx: discord.ext.commands.context.Context, *args: str) -> None:
         """
-        Sends the status of the server. Online / Offline, Players and Latency.
+        Sends the status of the server. Online / Offline, Players and Latency. mc!status [server]
         """
         embed: discord.Embed = discord.Embed()
 
         try:
-            server_ip: str = get_ip()
-            server: JavaServer = JavaServer.lookup(server_ip)
-            status: JavaServer.status = server.status()
+            server, _ = server_manager.split_name(args)
+            server_ip: str = get_ip(server)
+            status: StatusResult = await status_service.get(server_ip)
             embed.add_field(name="Success!", value=Messages.ServerStatus.value
-                            .format(status.players.online, status.latency))
+                            .format(status.online, round(status.latency)))
+            if status.player_names:
+                embed.add_field(name="Players", value=", ".join(status.player_names))
+            embed.set_footer(text=Messages.StatusAge.value.format(status.age))
 
         except Exception as e:
             try:
@@ -140,49 +304,57 @@ def main():
             await ctx.channel.send(embed=embed)
 
     @bot.command(name="launch")
+    @instrumented("launch")
     async def launch(ctx: discord.ext.commands.context.Context, *args: str) -> None:
         """
         Opens the specified server jar file with launch arguments if it is not running.
-        Otherwise, sends error message and does nothing.
+        Otherwise, sends error message and does nothing. mc!launch [server] [memory|auto] [--profile name]
         """
-        global server_proc, server_proc_running, feedback_channel_id, latest_server_launch
-        ON_POSIX: bool = 'posix' in builtin_module_names
         embed: discord.Embed = discord.Embed()
 
         try:
+            server, args = server_manager.split_name(args)
+            profile, args = split_profile(args)
+            instance: ServerInstance = server_manager.get(server)
+            server_config: ServerConfig = config_store.config.server(server)
             # To ensure user has set the ip, we attempt to retrieve it
-            _ = get_ip()
+            _ = get_ip(server)
 
-            # memory allocation for the server. allows user to give custom memory, though the default is 1024mb.
-            default_mem: int = get_mem()
-            mem_alloc = args[0] if args and args[0].isdigit() else default_mem
-            # poll() returns None or exit code. None if still running, an exit code if finished.
+            # held until the process started, so a second mc!launch awaiting meanwhile sees it running
+            async with instance.launch_lock:
+                # by this assertion, we check that the process is not running before attempting to run it.
+                # a stopping server counts as running until its process exited, so the JVM is done saving.
+                assert not instance.running
+                # a manual launch replaces a pending automatic restart and resets the crash-loop breaker
+                cancel_restart(instance)
+                instance.restart_state.reset()
+                jar_path: str = get_path(server)
+                server_dir: str = os.path.abspath(os.path.dirname(jar_path))
 
-            # by this assertion, we check that the process is not running before attempting to run it.
-            assert not server_proc_running
-            jar_path: str = get_path()
-            server_dir: str = os.path.abspath(os.path.dirname(jar_path))
-            # declare default arguments for launch, like ignoring fml query for modded
-            args: list[str] = [JavaArgs.Java.value,
-                               JavaArgs.MaxMem.value.format(mem_alloc),
-                               JavaArgs.MinMem.value.format(mem_alloc),
-                               JavaArgs.Jar.value,
-                               JavaArgs.Server.value,
-                               jar_path]
-            print("Launch args: ", args)
-            # start a popen subprocess, meaning we are able to manipulate it later on
-            server_proc = subprocess.Popen(args,
-                                           cwd=server_dir,
-                                           stdin=subprocess.PIPE,
-                                           stdout=subprocess.PIPE,
-                                           close_fds=ON_POSIX)
-
-            # The channel from which the server was launched will be the channel to receive the feedback
-            feedback_channel_id = ctx.channel.id
-            server_proc_running = True  # Declare that the server is running
-            latest_server_launch = time()  # update latest launch time
+                # memory allocation for the server. allows user to give custom memory,
+                # though the default is 1024mb. auto sizes it from the world and the available memory.
+                default_mem: int = get_mem(server)
+                if args and args[0] == AUTO_MEM:
+                    world_size: int = await asyncio.to_thread(directory_size, world_dir(server_dir))
+                    mem_alloc: int = auto_mem(world_size)
+                else:
+                    mem_alloc: int = int(args[0]) if args and args[0].isdigit() else default_mem
+
+                profile_flags: list[str] = resolve_profile(profile or server_config.profile,
+                                                           config_store.config.profiles)
+                args: list[str] = build_launch_args(jar_path, mem_alloc, profile_flags,
+                                                     server_config.active_processors, server_config.java_path)
+                print("Launch args: ", args)
+                # The channel from which the server was launched will be the channel to receive the feedback
+                await start_isolated(instance, args, server_dir, mem_alloc, ctx.channel.id)
+                supervise(instance)
 
             embed.add_field(name="Success", value=Messages.LaunchSuccess.value)
+            embed.add_field(name="Command line", value=Messages.LaunchCommandLine.value
+                            .format(shlex.join(args))[:1024], inline=False)
+            if instance.isolation.fallback is not None:
+                embed.add_field(name="Resources", value=Messages.IsolationFallback.value
+                                .format(instance.isolation.fallback), inline=False)
 
         except Exception as e:
             try:
@@ -193,23 +365,53 @@ def main():
         finally:
             await ctx.channel.send(embed=embed)
 
+    def isolate_server(server: str) -> Isolation:
+        """Prepares the cgroup, affinity and priorities of a server's next process from its config."""
+        config: BotConfig = config_store.config
+        server_config: ServerConfig = config.server(server)
+        return isolate(server, config.cgroup_parent, server_config.memory_limit, server_config.cpu_limit,
+                       server_config.cpu_affinity, server_config.nice, server_config.ionice)
+
+    async def start_isolated(instance: ServerInstance, argv: list[str], cwd: str, mem_alloc: int,
+                             feedback_channel_id: int) -> None:
+        """
+        Starts a server process confined by its config, see ServerInstance.start.
+        Raises MemoryError if its memory does not fit the host next to the running servers.
+        The cgroup prepared for a process which failed to start is removed.
+        """
+        # refuse to reserve more memory than the host has over all running servers.
+        # other launches wait until this one's memory counts as reserved
+        async with server_manager.memory_lock:
+            server_manager.check_memory(mem_alloc)
+            isolation: Isolation = await asyncio.to_thread(isolate_server, instance.name)
+            try:
+                instance.start(argv, cwd, mem_alloc, feedback_channel_id, isolation)
+            except Exception:
+                if isolation.cgroup is not None:
+                    remove_cgroup(isolation.cgroup)
+                raise
+        await instance.confirm_isolation()
+
     @bot.command(name="close")
-    async def shut_server_down(ctx: discord.ext.commands.context.Context):
+    @instrumented("close")
+    async def shut_server_down(ctx: discord.ext.commands.context.Context, *args: str):
         """
         Closes the server process from the jar if it is running.
-        Otherwise, sends error message and does nothing.
+        Otherwise, sends error message and does nothing. mc!close [server]
         """
-        global server_proc, server_proc_running
         embed: discord.Embed = discord.Embed()
 
 
         try:
+            server, _ = server_manager.split_name(args)
+            instance: ServerInstance = server_manager.get(server)
+            if not instance.running and cancel_restart(instance):
+                embed.add_field(name="Success", value=Messages.RestartCancelled.value)
+                return
             # by this assertion, we check that the process is running before attempting to close it.
-            assert server_proc_running
-            server_proc.stdin.write(b'stop\n')
-            server_proc = None
+            assert instance.running and not instance.stop_requested
+            stop_server(instance)
 
-            server_proc_running = False
             embed.add_field(name="Success", value=Messages.CloseSuccess.value)
 
         except Exception as e:
@@ -222,25 +424,62 @@ def main():
             await ctx.channel.send(embed=embed)
 
 
+    def rcon_client(instance: ServerInstance) -> (RconClient, None):
+        """
+        Returns the RCON client of a running server, created on first use from its server.properties.
+        None when RCON is disabled in config or in server.properties, so commands go through stdin.
+        """
+        config: BotConfig = config_store.config
+        if not config.rcon_enabled or not instance.running:
+            return None
+        if instance.rcon is None:
+            properties: dict[str, str] = server_properties(os.path.abspath(os.path.dirname(get_path(instance.name))))
+            if properties.get("enable-rcon") != "true" or not properties.get("rcon.password"):
+                return None
+            instance.rcon = RconClient(config.rcon_host, int(properties.get("rcon.port") or 25575),
+                                       properties["rcon.password"], timeout=config.rcon_timeout)
+        return instance.rcon
+
     @bot.command(name="command")
+    @instrumented("command")
     async def command(ctx: discord.ext.commands.context.Context, *args):
         """
-        Sends user args to server process' stdin, resulting in an execution of a minecraft command
+        Runs a minecraft command. Through RCON, its output is sent back with the round trip time.
+        Without RCON, or if RCON fails, the command is written to the server process' stdin instead
+        and its output only shows up in the relayed console.
         :param ctx: Channel in which the command was sent
-        :param args: arguments for the minecraft command. does not verify if valid, minecraft does so by itself
+        :param args: optional server name, then the arguments for the minecraft command.
+                     does not verify if valid, minecraft does so by itself
         """
-        global server_proc, server_proc_running
         embed: discord.Embed = discord.Embed()
 
         try:
+            server, args = server_manager.split_name(args)
+            instance: ServerInstance = server_manager.get(server)
             # by this assertion, we check that the process is running before attempting to close it.
-            assert server_proc_running
+            assert instance.running
             if not args:
                 raise SyntaxError
             mc_command: str = " ".join(args)
-            mc_command: bytes = mc_command.encode() + b'\n'
-            server_proc.stdin.write(mc_command)
-            server_proc.stdin.flush()
+
+            # RCON only listens once the server is ready
+            rcon: (RconClient, None) = rcon_client(instance) if instance.tracker.ready else None
+            if rcon is not None:
+                try:
+                    with RCON_SECONDS.time():
+                        output: str = await rcon.command(mc_command)
+                    embed.add_field(name=mc_command[:256], value=Messages.CommandOutput.value.format(output[:1000])
+                                    if output.strip() else Messages.CommandNoOutput.value)
+                    embed.set_footer(text=Messages.CommandLatency.value.format(rcon.last_latency * 1000))
+                    await ctx.channel.send(embed=embed)
+                    return
+                except TimeoutError:
+                    raise  # the command may have run, writing it again to stdin could run it twice
+                except OSError as e:
+                    # refused, reset or a wrong password (PermissionError)
+                    print(f"{instance.label}RCON failed, writing to stdin: {e!r}")
+                    RCON_FALLBACKS.inc(server=server)
+            instance.send_command(mc_command)
 
         except Exception as e:
             try:
@@ -251,78 +490,931 @@ def main():
             finally:
                 await ctx.channel.send(embed=embed)
 
+    def batch_embed(job: BatchJob, error: (BaseException, None) = None) -> discord.Embed:
+        """Progress of a script while it runs, its throughput once it is done."""
+        embed: discord.Embed = discord.Embed()
+        if error is not None:
+            text: str = Messages.BatchFailed.value.format(job.sent, job.total, repr(error))
+        elif job.cancelled:
+            text = Messages.BatchCancelled.value.format(job.sent, job.total)
+        elif job.done:
+            text = Messages.BatchDone.value.format(job.sent, job.elapsed, job.rate)
+        else:
+            text = Messages.BatchProgress.value.format(job.sent, job.total, job.rate, job.eta)
+        embed.add_field(name="Script", value=text)
+        return embed
+
+    @bot.command(name="run")
+    @instrumented("run")
+    async def run_script(ctx: discord.ext.commands.context.Context, *args: str):
+        """
+        Streams a script into a server, batch_per_tick commands every tick, and edits its progress as it goes.
+        The script is an attached file or a macro, {name} and {1}, {2}... being replaced by the arguments.
+        mc!run [server] <macro> [value ...] [name=value ...]
+        mc!run [server] [value ...] [name=value ...] with an attached script
+        mc!run [server] cancel
+        """
+        embed: discord.Embed = discord.Embed()
+        job: (BatchJob, None) = None
+        progress_message: (discord.Message, None) = None
+
+        try:
+            server, args = server_manager.split_name(args)
+            instance: ServerInstance = server_manager.get(server)
+            if args and args[0] == "cancel":
+                if instance.batch is None or instance.batch.done:
+                    embed.add_field(name="Script", value=Messages.NoBatch.value)
+                else:
+                    # the script's own progress message reports where it stopped
+                    instance.batch.cancel()
+                    embed = batch_embed(instance.batch)
+                return
+
+            assert instance.running
+            if instance.batch is not None and not instance.batch.done:
+                raise RuntimeError("a script is already running")
+            config: BotConfig = config_store.config
+            if ctx.message.attachments:
+                text: str = (await ctx.message.attachments[0].read()).decode()
+            else:
+                if args[0] not in config.macros:
+                    raise LookupError(args[0])
+                text, args = config.macros[args[0]], args[1:]
+            commands: list[str] = substitute(parse_script(text), parse_parameters(args))
+            if len(commands) > config.batch_max_commands:
+                raise OverflowError(f"{len(commands)} commands")
+
+            job = BatchJob(commands, config.batch_per_tick)
+            instance.batch = job
+            embed = batch_embed(job)
+
+        except Exception as e:
+            try:
+                embed.add_field(name="Error!", value=ErrorMessages[(type(e), "run")])
+            except KeyError:
+                embed.add_field(name="Error!", value=Messages.UnhandledException.value + repr(e))
+
+        finally:
+            progress_message = await ctx.channel.send(embed=embed)
+
+        if job is None:
+            return
+        task: asyncio.Task = asyncio.create_task(job.run(instance.send_commands))
+        while not task.done():
+            await asyncio.wait({task}, timeout=2)
+            if not task.done():
+                await progress_message.edit(embed=batch_embed(job))
+        # ie the server stopped while the script was running
+        error: (BaseException, None) = task.exception()
+        await progress_message.edit(embed=batch_embed(job, error))
+
+    @bot.command(name="macro")
+    @instrumented("macro")
+    async def macro(ctx: discord.ext.commands.context.Context, *args: str):
+        """
+        Saves the attached script as a macro for mc!run, shows a macro, or lists every macro.
+        mc!macro [name]
+        """
+        embed: discord.Embed = discord.Embed()
+
+        try:
+            macros: dict[str, str] = config_store.config.macros
+            if args and ctx.message.attachments:
+                text: str = (await ctx.message.attachments[0].read()).decode()
+                config_store.set("macros", {**macros, args[0]: text})
+                embed.add_field(name="Success!", value=Messages.MacroSaved.value
+                                .format(args[0], len(parse_script(text))))
+            elif args:
+                if args[0] not in macros:
+                    raise LookupError(args[0])
+                embed.add_field(name=args[0], value=Messages.CommandOutput.value.format(macros[args[0]][:1000]))
+            else:
+                embed.add_field(name="Macros", value="\n".join(
+                    Messages.MacroList.value.format(name, len(parse_script(script)))
+                    for name, script in macros.items()) or Messages.NoMacros.value)
+
+        except Exception as e:
+            try:
+                embed.add_field(name="Error!", value=ErrorMessages[(type(e), "macro")])
+            except KeyError:
+                embed.add_field(name="Error!", value=Messages.UnhandledException.value + repr(e))
+
+        finally:
+            await ctx.channel.send(embed=embed)
+
+    @bot.command(name="relay")
+    @instrumented("relay")
+    async def relay_stats(ctx: discord.ext.commands.context.Context):
+        """
+        Sends the console relay's counters: merged lines, sent messages, pending lines and lag.
+        """
+        embed: discord.Embed = discord.Embed()
+        embed.add_field(name="Console relay", value=Messages.RelayStats.value
+                        .format(console_relay.lines_merged, console_relay.messages_sent,
+                                console_relay.messages_edited, console_relay.pending, console_relay.lag,
+                                console_relay.lines_skipped))
+        await ctx.channel.send(embed=embed)
+
+    async def relay_output(instance: ServerInstance) -> None:
+        """
+        Relays one server's new stdout lines and follows its state.
+        """
+        # Everything the pump has read since the last tick
+        proc_lines: list[str] = instance.pump.drain()
+        if proc_lines:
+            print("\n".join(instance.label + line for line in proc_lines))
+            instance.scrollback.extend(proc_lines)
+
+        relayed_lines: list[str] = []
+        routed: dict[int, list[str]] = {}  # lines the output filter sends to other channels
+        for line in proc_lines:
+            instance.feed_waiters(line)
+            # replies to the telemetry_loop's own commands are not relayed
+            if instance.telemetry.feed(line) or pregen_manager.feed(instance.name, line):
+                continue
+            history.feed(instance.name, line)
+            presence_event: (tuple[str, str], None) = instance.presence.feed(line)
+            if presence_event is not None and config_store.config.presence_tracking:
+                # the idle timer runs exactly while nobody is online
+                if instance.presence.empty:
+                    arm_idle_timer(instance)
+                else:
+                    disarm_idle_timer(instance)
+
+            was_starting: bool = instance.tracker.starting
+            state_message: (str, None) = instance.tracker.feed(line)
+            if state_message:
+                relayed_lines.append(instance.label + state_message)
+                if instance.tracker.ready:
+                    print("{}Time to ready: {:.1f} s".format(instance.label, instance.tracker.startup_time))
+                    instance.presence.reset()
+                    if config_store.config.presence_tracking:
+                        arm_idle_timer(instance)
+            # While launching, only progress is posted to not overload the chat. Crashes are posted in full.
+            elif not was_starting or not instance.tracker.starting:
+                destination: (tuple[int, str], None) = output_filter.apply(line, instance.feedback_channel_id,
+                                                                           instance.label)
+                if destination is None:
+                    continue
+                channel_id, relayed_line = destination
+                if channel_id == instance.feedback_channel_id:
+                    relayed_lines.append(relayed_line)
+                else:
+                    routed.setdefault(channel_id, []).append(relayed_line)
+        console_relay.push(instance.feedback_channel_id, relayed_lines)
+        for channel_id, lines in routed.items():
+            console_relay.push(channel_id, lines)
+        # the exit of the process is reported by its supervisor
+
     @tasks.loop(seconds=.5)
     async def server_feedback():
         """
         Prints server process' stdout in chat. This may include command results, players chatting, achievements, etc.
         """
-        global server_proc, server_proc_running, feedback_channel_id, latest_server_launch
-        if not server_proc_running:
-            return
-        # If server is running, server_proc is of type subprocess.Popen
+        # rules are compiled again only when config.json changed them
+        if config_store.config.filters is not output_filter.source:
+            output_filter.load(config_store.config.filters)
 
-        TEN_MINUTES: float = 60 * 10
-        delta_time: float = time() - latest_server_launch
-        if delta_time < TEN_MINUTES:
-            return
-        # We don't want to send anything for the first ten minute as the server is launching to not overload the chat.
+        with FEEDBACK_TICK_SECONDS.time():
+            # Every running server's output is handled concurrently
+            await asyncio.gather(*(relay_output(instance) for instance in server_manager.running()))
+
+            # Sends whatever is due, lines that are not sent keep merging until the next tick
+            await console_relay.flush(bot.get_channel)
+
+        # history rows are written in batches, off the event loop
+        await history.flush(force=False)
+
+    @tasks.loop(seconds=1)
+    async def pregen_loop():
+        """
+        Steps every ready server's pre-generation job, which pauses while players are online or MSPT is too high.
+        """
+        config: BotConfig = config_store.config
+        pregen_manager.interval, pregen_manager.max_mspt = config.pregen_interval, config.pregen_max_mspt
+        for instance in server_manager.running():
+            if not instance.tracker.ready or instance.stop_requested:
+                continue
+            latest: (Sample, None) = instance.telemetry.latest
+            try:
+                message: (str, None) = pregen_manager.step(instance.name, instance.send_commands,
+                                                           not instance.presence.empty,
+                                                           latest.mspt if latest is not None else None,
+                                                           instance.launches)
+            except OSError:
+                continue  # the process is exiting, its supervisor reports it
+            if message is not None:
+                console_relay.push(instance.feedback_channel_id, [instance.label + message])
+
+    @bot.command(name="pregen")
+    @instrumented("pregen")
+    async def pregen(ctx: discord.ext.commands.context.Context, *args: str):
+        """
+        Pre-generates the chunks within a radius in the background. The job pauses while players are online
+        or the server lags, and resumes after restarts of the server or the bot.
+        mc!pregen [server] start <radius in chunks> [x z] [chunky|vanilla], mc!pregen [server] status|cancel
+        """
+        embed: discord.Embed = discord.Embed()
+
+        try:
+            server, args = server_manager.split_name(args)
+            instance: ServerInstance = server_manager.get(server)
+            action: str = args[0]
+            if action == "start":
+                radius: int = int(args[1])
+                method: str = next((arg for arg in args[2:] if arg in METHODS), config_store.config.pregen_method)
+                coordinates: list[int] = [int(arg) for arg in args[2:] if arg not in METHODS]
+                if len(coordinates) not in (0, 2):
+                    raise ValueError(f"The center needs both x and z: {coordinates}")
+                center_x, center_z = coordinates or (0, 0)
+                if radius <= 0:
+                    raise ValueError(f"Radius must be positive: {radius}")
+                if radius > config_store.config.pregen_max_radius:
+                    raise OverflowError(f"Radius {radius} is above {config_store.config.pregen_max_radius}")
+                job: PregenJob = PregenJob(center_x, center_z, radius, method)
+                pregen_manager.start(server, job)
+                embed.add_field(name="Success", value=Messages.PregenStarted.value
+                                .format(job.total, center_x, center_z, method))
+            elif action == "cancel":
+                job: (PregenJob, None) = pregen_manager.cancel(server,
+                                                               instance.send_commands if instance.running else None)
+                embed.add_field(name="Pre-generation", value=Messages.PregenCancelled.value.format(job.done, job.total)
+                                if job is not None else Messages.NoPregen.value)
+            elif action == "status":
+                job: (PregenJob, None) = pregen_manager.jobs.get(server)
+                if job is None:
+                    embed.add_field(name="Pre-generation", value=Messages.NoPregen.value)
+                    return
+                state: str = job.state if job.pause_reason is None else f"{job.state}, {job.pause_reason}"
+                embed.add_field(name="Progress", value=Messages.PregenProgress.value
+                                .format(job.done, job.total, 100 * job.done / job.total, state), inline=False)
+                embed.add_field(name="Speed", value=Messages.PregenSpeed.value
+                                .format(job.rate, "unknown" if job.eta is None else format_duration(job.eta)),
+                                inline=False)
+                embed.add_field(name="Area", value=Messages.PregenArea.value
+                                .format(job.radius, job.center_x, job.center_z, job.method), inline=False)
+            else:
+                raise IndexError(action)
 
-        # Checking if readline returned anything:
-        proc_stdout: str = proc_read(server_proc)
-        if not proc_stdout:
+        except Exception as e:
+            try:
+                embed.add_field(name="Error!", value=ErrorMessages[(type(e), "pregen")])
+            except KeyError:
+                embed.add_field(name="Error!", value=Messages.UnhandledException.value + repr(e))
+
+        finally:
+            await ctx.channel.send(embed=embed)
+
+    @bot.command(name="filters")
+    @instrumented("filters")
+    async def filters(ctx: discord.ext.commands.context.Context):
+        """
+        Sends the output filter rules with how many lines each one caught, most hits first.
+        """
+        embed: discord.Embed = discord.Embed()
+        if not output_filter.rules:
+            embed.add_field(name="Output filters", value=Messages.NoFilters.value)
+            await ctx.channel.send(embed=embed)
             return
 
-        print(proc_stdout)
-        ctx_channel: discord.ext.commands.context.Context.channel = bot.get_channel(feedback_channel_id)
-        await ctx_channel.send(proc_stdout)
+        entries: list[str] = []
+        for rule in sorted(output_filter.rules, key=lambda filter_rule: filter_rule.hits, reverse=True):
+            route: str = Messages.FilterRoute.value.format(rule.channel) if rule.action == ROUTE else ""
+            entries.append(Messages.FilterEntry.value.format(rule.name, rule.action, route, rule.hits))
+        # an embed field holds 1024 characters, the rules with the fewest hits are left out
+        listing: str = ""
+        for entry in entries:
+            if len(listing) + len(entry) + 1 > 1024:
+                break
+            listing += entry + "\n"
+        embed.add_field(name="Output filters", value=listing, inline=False)
+        embed.add_field(name="Total", value=Messages.FiltersSummary.value
+                        .format(output_filter.lines_classified, len(output_filter.rules), output_filter.dropped))
+        await ctx.channel.send(embed=embed)
 
-    @tasks.loop(minutes=5)
-    async def empty_server_timeout():
+    @bot.command(name="perf")
+    @instrumented("perf")
+    async def perf(ctx: discord.ext.commands.context.Context, *args: str):
         """
-        While we have mc!close, we can't always trust our friends to remember to close the server.
-        Pings the server for status (Could be extracted locally but that's a stdout headache)
-        :return:
+        Sends the current CPU, memory, threads and I/O of a server, with TPS/MSPT and their min/avg/p95 over time.
+        mc!perf [server]
+        """
+        embed: discord.Embed = discord.Embed()
+
+        try:
+            server, _ = server_manager.split_name(args)
+            instance: ServerInstance = server_manager.get(server)
+            assert instance.telemetry is not None and instance.telemetry.latest is not None
+            latest: Sample = instance.telemetry.latest
+            embed.add_field(name="Now", value=Messages.PerfCurrent.value
+                            .format(latest.cpu, latest.rss, latest.threads,
+                                    latest.read_bytes / 1024 ** 2, latest.write_bytes / 1024 ** 2), inline=False)
+            for metric in ("mspt", "tps", "cpu", "rss"):
+                for label, seconds in (("1m", 60), ("5m", 300), ("15m", 900)):
+                    summary: (tuple, None) = instance.telemetry.summary(metric, seconds)
+                    if summary is not None:
+                        embed.add_field(name=f"{metric} {label}", value=Messages.PerfWindow.value.format(*summary))
+
+        except Exception as e:
+            try:
+                embed.add_field(name="Error!", value=ErrorMessages[(type(e), "perf")])
+            except KeyError:
+                embed.add_field(name="Error!", value=Messages.UnhandledException.value + repr(e))
+
+        finally:
+            await ctx.channel.send(embed=embed)
+
+    @bot.command(name="resources")
+    @instrumented("resources")
+    async def resources(ctx: discord.ext.commands.context.Context, *args: str):
+        """
+        Sends the limits of a server's process and how much of them it uses: memory, CPU time and throttling
+        of its cgroup, the CPUs it may run on and its priorities. mc!resources [server]
+        """
+        embed: discord.Embed = discord.Embed()
+
+        try:
+            server, _ = server_manager.split_name(args)
+            instance: ServerInstance = server_manager.get(server)
+            assert instance.running
+            isolation: Isolation = instance.isolation
+            cpus, nice = process_scheduling(instance.proc.pid)
+            embed.add_field(name="Scheduling", value=Messages.ResourcesScheduling.value
+                            .format(format_cpus(cpus) if cpus else "?", "?" if nice is None else nice,
+                                    "default" if isolation.ionice is None else isolation.ionice), inline=False)
+
+            if isolation.cgroup is None:
+                embed.add_field(name="Cgroup", value=isolation.fallback or Messages.NoCgroup.value, inline=False)
+                if instance.telemetry.latest is not None:
+                    embed.add_field(name="Memory", value=Messages.ResourcesRss.value
+                                    .format(instance.telemetry.latest.rss), inline=False)
+                return
+
+            usage: dict = await asyncio.to_thread(cgroup_usage, isolation.cgroup)
+            events: dict = usage["memory_events"]
+            memory_max: str = usage["memory_max"] or "max"
+            embed.add_field(name="Memory", value=Messages.ResourcesMemory.value
+                            .format(format_bytes(usage["memory_current"] or 0),
+                                    "no limit" if memory_max == "max" else format_bytes(int(memory_max)),
+                                    "?" if usage["memory_peak"] is None else format_bytes(usage["memory_peak"]),
+                                    events.get("high", 0) + events.get("max", 0), events.get("oom_kill", 0)),
+                            inline=False)
+
+            stat: dict = usage["cpu_stat"]
+            quota, _, period = (usage["cpu_max"] or "max").partition(" ")
+            periods: int = stat.get("nr_periods", 0)
+            embed.add_field(name="CPU", value=Messages.ResourcesCpu.value
+                            .format(stat.get("usage_usec", 0) / 1e6,
+                                    "no limit" if quota == "max" else f"{int(quota) / int(period or CPU_PERIOD):g} CPU",
+                                    stat.get("nr_throttled", 0), periods,
+                                    100 * stat.get("nr_throttled", 0) / periods if periods else 0.0,
+                                    stat.get("throttled_usec", 0) / 1e6), inline=False)
+
+        except Exception as e:
+            try:
+                embed.add_field(name="Error!", value=ErrorMessages[(type(e), "resources")])
+            except KeyError:
+                embed.add_field(name="Error!", value=Messages.UnhandledException.value + repr(e))
+
+        finally:
+            await ctx.channel.send(embed=embed)
+
+    @tasks.loop(seconds=10)
+    async def telemetry_loop():
+        """
+        Samples every running server, asks ready servers for their TPS/MSPT and posts alerts.
+        Replies are parsed from stdout by server_feedback and land in the next sample.
+        """
+        config: BotConfig = config_store.config
+        thresholds: dict[str, float] = {"mspt": config.alert_mspt}
+        if config.alert_rss is not None:
+            thresholds["rss"] = config.alert_rss
+
+        for instance in server_manager.running():
+            if instance.telemetry.sample() is None:
+                continue
+            alerts: list[str] = instance.telemetry.check_alerts(thresholds, config.alert_duration)
+            console_relay.push(instance.feedback_channel_id, [instance.label + alert for alert in alerts])
+            if config.telemetry_command and instance.tracker.ready:
+                try:
+                    instance.send_command(config.telemetry_command)
+                    instance.telemetry.request()
+                except OSError:
+                    continue  # exiting, or reattached without RCON
+
+    def history_server(args: tuple) -> tuple[(str, None), tuple]:
+        """History commands look at every server unless the first argument names one."""
+        if args and args[0] in server_manager.names():
+            return args[0], args[1:]
+        return None, args
+
+    @bot.command(name="seen")
+    @instrumented("seen")
+    async def seen(ctx: discord.ext.commands.context.Context, *args: str):
+        """
+        Sends when a player was last online. mc!seen [server] <player>
+        """
+        embed: discord.Embed = discord.Embed()
+
+        try:
+            server, args = history_server(args)
+            player: str = args[0]
+            last_seen, online = await history.seen(player, server)
+            if online:
+                embed.add_field(name="Seen", value=Messages.SeenOnline.value.format(player))
+            elif last_seen is not None:
+                embed.add_field(name="Seen", value=Messages.SeenAt.value.format(player, last_seen))
+            else:
+                embed.add_field(name="Seen", value=Messages.SeenNever.value.format(player))
+
+        except Exception as e:
+            try:
+                embed.add_field(name="Error!", value=ErrorMessages[(type(e), "seen")])
+            except KeyError:
+                embed.add_field(name="Error!", value=Messages.UnhandledException.value + repr(e))
+
+        finally:
+            await ctx.channel.send(embed=embed)
+
+    @bot.command(name="playtime")
+    @instrumented("playtime")
+    async def playtime(ctx: discord.ext.commands.context.Context, *args: str):
+        """
+        Sends the players with the most play time over a period, a week by default. mc!playtime [server] [7d|12h|all]
+        """
+        embed: discord.Embed = discord.Embed()
+
+        try:
+            server, args = history_server(args)
+            period: str = args[0] if args else "7d"
+            seconds: (float, None) = parse_period(period)
+            totals: list[tuple[str, float]] = await history.playtime(None if seconds is None else time() - seconds,
+                                                                     server)
+            lines: list[str] = [Messages.PlaytimeEntry.value.format(rank, player, format_duration(total))
+                                for rank, (player, total) in enumerate(totals, 1)]
+            embed.add_field(name=f"Play time ({period})", value="\n".join(lines) or Messages.NoHistory.value)
+
+        except Exception as e:
+            try:
+                embed.add_field(name="Error!", value=ErrorMessages[(type(e), "playtime")])
+            except KeyError:
+                embed.add_field(name="Error!", value=Messages.UnhandledException.value + repr(e))
+
+        finally:
+            await ctx.channel.send(embed=embed)
+
+    @bot.command(name="top")
+    @instrumented("top")
+    async def top(ctx: discord.ext.commands.context.Context, *args: str):
+        """
+        Sends the most active players of all time. mc!top [server]
+        """
+        embed: discord.Embed = discord.Embed()
+
+        try:
+            server, _ = history_server(args)
+            players: list[tuple[str, float, int, int]] = await history.top(server)
+            lines: list[str] = [Messages.TopEntry.value.format(rank, player, format_duration(total), chat, advancements)
+                                for rank, (player, total, chat, advancements) in enumerate(players, 1)]
+            embed.add_field(name="Top players", value="\n".join(lines) or Messages.NoHistory.value)
+
+        except Exception as e:
+            try:
+                embed.add_field(name="Error!", value=ErrorMessages[(type(e), "top")])
+            except KeyError:
+                embed.add_field(name="Error!", value=Messages.UnhandledException.value + repr(e))
+
+        finally:
+            await ctx.channel.send(embed=embed)
+
+    @bot.command(name="backfill")
+    @instrumented("backfill")
+    async def backfill(ctx: discord.ext.commands.context.Context, *args: str):
+        """
+        Imports the server's old log archives into the history. Archives already imported are skipped.
+        mc!backfill [server]
+        """
+        embed: discord.Embed = discord.Embed()
+
+        try:
+            server, _ = server_manager.split_name(args)
+            logs_dir: str = os.path.join(os.path.abspath(os.path.dirname(get_path(server))), "logs")
+            lines: int = await history.backfill(server, logs_dir)
+            embed.add_field(name="Success", value=Messages.BackfillDone.value.format(lines))
+
+        except Exception as e:
+            try:
+                embed.add_field(name="Error!", value=ErrorMessages[(type(e), "backfill")])
+            except KeyError:
+                embed.add_field(name="Error!", value=Messages.UnhandledException.value + repr(e))
+
+        finally:
+            await ctx.channel.send(embed=embed)
+
+    @bot.command(name="logs")
+    @instrumented("logs")
+    async def logs(ctx: discord.ext.commands.context.Context, *args: str):
+        """
+        Sends the last console lines, optionally only those matching a regular expression.
+        Recent lines come from memory, older ones from the server's logs/latest.log.
+        mc!logs [server] [n] [regex]
+        """
+        embed: discord.Embed = discord.Embed()
+        log_file: (discord.File, None) = None
+
+        try:
+            server, args = server_manager.split_name(args)
+            instance: ServerInstance = server_manager.get(server)
+            count: int = int(args[0]) if args and args[0].isdigit() else 50
+            count = min(count, config_store.config.logs_max_lines)
+            regex: str = " ".join(args[1:] if args and args[0].isdigit() else args)
+            if len(regex) > config_store.config.logs_max_pattern:
+                raise OverflowError(f"{len(regex)} characters")
+            # an invalid one raises re.error, answered with InvalidRegex
+            pattern: (re.Pattern, None) = re.compile(regex) if regex else None
+
+            # copied here as server_feedback appends to it, searched off the event loop as a pattern may be slow
+            lines: list[str] = await asyncio.to_thread(matching, instance.scrollback.lines(), count, pattern)
+            truncated: bool = False
+            # latest.log holds everything the scrollback has and more
+            jar_path: (str, None) = config_store.config.server(server).jar_path
+            if len(lines) < count and jar_path is not None:
+                latest_log: str = os.path.join(os.path.abspath(os.path.dirname(jar_path)), "logs", "latest.log")
+                if os.path.isfile(latest_log):
+                    lines, truncated = await asyncio.to_thread(tail_file, latest_log, count, pattern,
+                                                               config_store.config.logs_scan_bytes)
+
+            text: str = "\n".join(lines)
+            if not lines:
+                embed.add_field(name="Logs", value=Messages.LogsEmpty.value)
+            elif len(Messages.LogsBlock.value.format(text)) <= 1024:
+                embed.add_field(name="Logs", value=Messages.LogsBlock.value.format(text))
+            else:
+                log_file = discord.File(io.BytesIO(text.encode()), filename=f"{server}-logs.txt")
+                embed.add_field(name="Logs", value=Messages.LogsAttached.value.format(len(lines)))
+            if truncated:
+                embed.set_footer(text=Messages.LogsTruncated.value)
+
+        except Exception as e:
+            try:
+                embed.add_field(name="Error!", value=ErrorMessages[(type(e), "logs")])
+            except KeyError:
+                embed.add_field(name="Error!", value=Messages.UnhandledException.value + repr(e))
+
+        finally:
+            if log_file is not None:
+                await ctx.channel.send(embed=embed, file=log_file)
+            else:
+                await ctx.channel.send(embed=embed)
+
+    def backup_store(server: str) -> tuple["BackupStore", str]:
+        """
+        Returns a server's backup store and the path of its world. Raises KeyError if its jar path is not bound.
+        """
+        # backups and its process pool are imported by the first backup command, not by the bot's startup
+        from backups import BackupStore
+
+        config: BotConfig = config_store.config
+        server_dir: str = os.path.abspath(os.path.dirname(get_path(server)))
+        # an absolute backup_dir is shared, so every server gets its own store inside
+        root: str = os.path.join(config.backup_dir, server) if os.path.isabs(config.backup_dir) \
+            else os.path.join(server_dir, config.backup_dir)
+        return BackupStore(root, workers=config.backup_workers), world_dir(server_dir)
+
+    async def run_backup(instance: ServerInstance) -> tuple["BackupReport", tuple[int, int]]:
+        """
+        Snapshots a server's world, then applies retention.
+        A running server is told to stop saving and flush every chunk first, and to save again once the snapshot
+        is taken, even if it failed.
+        :return: The snapshot's report, and (snapshots deleted, bytes freed) by retention
+        """
+        from backups import BackupReport, SAVED_PATTERN
+
+        store, world = backup_store(instance.name)
+        async with instance.backup_lock:
+            paused_at: (float, None) = None
+            try:
+                if instance.running:
+                    saved: asyncio.Future = instance.expect(SAVED_PATTERN)
+                    instance.send_command("save-off")
+                    paused_at = monotonic()
+                    instance.send_command("save-all flush")
+                    try:
+                        await asyncio.wait_for(saved, config_store.config.backup_save_timeout)
+                    except asyncio.TimeoutError:
+                        raise TimeoutError("save-all flush was not confirmed")
+                report: BackupReport = await asyncio.to_thread(store.snapshot, world)
+            finally:
+                if paused_at is not None and instance.running:
+                    instance.send_command("save-on")
+            if paused_at is not None:
+                report.paused = monotonic() - paused_at
+            pruned: tuple[int, int] = await asyncio.to_thread(store.prune, config_store.config.backup_keep)
+        return report, pruned
+
+    def backup_lines(report: "BackupReport", pruned: tuple[int, int]) -> list[str]:
+        lines: list[str] = [Messages.BackupDone.value.format(
+            report.snapshot, report.files, report.changed, format_bytes(report.written_bytes),
+            format_bytes(report.world_bytes), report.duration, report.paused)]
+        if pruned[0]:
+            lines.append(Messages.BackupPruned.value.format(pruned[0], format_bytes(pruned[1])))
+        return lines
+
+    @bot.command(name="backup")
+    @instrumented("backup")
+    async def backup(ctx: discord.ext.commands.context.Context, *args: str):
+        """
+        Takes an incremental snapshot of a server's world, pausing saves while a running server's files are read.
+        mc!backup [server]
+        """
+        embed: discord.Embed = discord.Embed()
+
+        try:
+            server, _ = server_manager.split_name(args)
+            report, pruned = await run_backup(server_manager.get(server))
+            embed.add_field(name="Backup", value="\n".join(backup_lines(report, pruned)))
+
+        except Exception as e:
+            try:
+                embed.add_field(name="Error!", value=ErrorMessages[(type(e), "backup")])
+            except KeyError:
+                embed.add_field(name="Error!", value=Messages.UnhandledException.value + repr(e))
+
+        finally:
+            await ctx.channel.send(embed=embed)
+
+    @bot.command(name="backups")
+    @instrumented("backups")
+    async def backups(ctx: discord.ext.commands.context.Context, *args: str):
+        """
+        Lists a server's snapshots, newest first.
+        mc!backups [server]
+        """
+        embed: discord.Embed = discord.Embed()
+
+        try:
+            server, _ = server_manager.split_name(args)
+            store, _ = backup_store(server)
+            entries: list[str] = []
+            for name in reversed(store.snapshots()[-20:]):
+                report: dict = (await asyncio.to_thread(store.manifest, name))["report"]
+                entries.append(Messages.BackupListEntry.value.format(
+                    name, report["files"], format_bytes(report["world_bytes"]), format_bytes(report["written_bytes"])))
+            embed.add_field(name="Backups", value="\n".join(entries) or Messages.NoBackups.value)
+
+        except Exception as e:
+            try:
+                embed.add_field(name="Error!", value=ErrorMessages[(type(e), "backups")])
+            except KeyError:
+                embed.add_field(name="Error!", value=Messages.UnhandledException.value + repr(e))
+
+        finally:
+            await ctx.channel.send(embed=embed)
+
+    @bot.command(name="restore")
+    @instrumented("restore")
+    async def restore(ctx: discord.ext.commands.context.Context, *args: str):
+        """
+        Replaces a closed server's world with a snapshot. The replaced world is kept next to it.
+        mc!restore [server] <snapshot>
+        """
+        embed: discord.Embed = discord.Embed()
+
+        try:
+            server, args = server_manager.split_name(args)
+            snapshot: str = args[0]
+            instance: ServerInstance = server_manager.get(server)
+            assert not instance.running
+            store, world = backup_store(server)
+            async with instance.backup_lock:
+                assert not instance.running
+                replaced: (str, None) = await asyncio.to_thread(store.restore, snapshot, world)
+            embed.add_field(name="Success!", value=Messages.RestoreDone.value.format(snapshot))
+            if replaced is not None:
+                embed.add_field(name="Previous world", value=Messages.RestoreKeptWorld.value.format(replaced))
+
+        except Exception as e:
+            try:
+                embed.add_field(name="Error!", value=ErrorMessages[(type(e), "restore")])
+            except KeyError:
+                embed.add_field(name="Error!", value=Messages.UnhandledException.value + repr(e))
+
+        finally:
+            await ctx.channel.send(embed=embed)
+
+    @tasks.loop(minutes=60)
+    async def backup_loop():
+        """
+        Backs up every running server every backup_interval minutes, reporting to its feedback channel.
+        """
+        for instance in server_manager.running():
+            try:
+                report, pruned = await run_backup(instance)
+                lines: list[str] = backup_lines(report, pruned)
+            except Exception as e:
+                lines = [ErrorMessages.get((type(e), "backup"), Messages.UnhandledException.value + repr(e))]
+            console_relay.push(instance.feedback_channel_id, [instance.label + line for line in lines])
+
+    async def reattach_servers() -> None:
+        """
+        Takes back the servers the bot's previous run left running, found through the PID file in their directory.
+        Their console is followed through their log file and their commands go through RCON. From then on,
+        they are supervised and restarted like the servers this run launches.
         """
-        global feedback_channel_id, server_proc_running, latest_server_launch
-        TWENTY_MINUTES: float = 60 * 20
-        if not server_proc_running:
+        for name in server_manager.names():
+            instance: ServerInstance = server_manager.get(name)
+            jar_path: (str, None) = config_store.config.server(name).jar_path
+            if instance.running or jar_path is None:
+                continue
+            server_dir: str = os.path.abspath(os.path.dirname(jar_path))
+            record: (PidRecord, None) = await asyncio.to_thread(find_running, server_dir)
+            if record is None:
+                continue
+            proc: AttachedProcess = AttachedProcess(record.pid, record.started, os.path.join(server_dir, LOG_FILE),
+                                                    lambda attached=instance: rcon_client(attached))
+            log_lines: list[str] = await asyncio.to_thread(proc.stdout.history)
+            instance.attach(proc, record, server_dir, log_lines)
+            supervise(instance)
+            print(f"{instance.label}Reattached to PID {record.pid}")
+
+            lines: list[str] = [Messages.Reattached.value.format(instance.tracker.state.value,
+                                                                 format_duration(instance.uptime))]
+            if rcon_client(instance) is None:
+                lines.append(Messages.ReattachedWithoutRcon.value)
+            console_relay.push(instance.feedback_channel_id, [instance.label + line for line in lines])
+            # the idle timer is otherwise armed when the server gets ready, which happened before this run
+            if instance.tracker.ready and instance.presence.empty and config_store.config.presence_tracking:
+                arm_idle_timer(instance)
+
+    def supervise(instance: ServerInstance) -> None:
+        """Starts the supervisor of a freshly started process."""
+        instance.supervisor_task = asyncio.create_task(supervise_process(instance))
+
+    async def supervise_process(instance: ServerInstance) -> None:
+        """
+        Awaits the exit of a server process, whether it was asked to stop or died on its own,
+        reports its exit code and uptime, and restarts it if the restart policy says so.
+        """
+        proc = instance.proc
+        exit_code: int = await asyncio.to_thread(proc.wait)
+
+        # the pump reads until stdout closes, let server_feedback relay the last lines (ie a crash) first
+        deadline: float = monotonic() + 5
+        while (instance.pump.alive or instance.pump.pending) and monotonic() < deadline:
+            await asyncio.sleep(.5)
+
+        uptime: float = instance.uptime
+        requested: bool = instance.stop_requested
+        lines: list[str] = [instance.tracker.process_exited(exit_code),
+                            Messages.ExitReport.value.format(exit_code, format_duration(uptime))]
+        if instance.stop_signal in ("SIGTERM", "SIGKILL"):
+            lines.append(Messages.StopEscalated.value.format(instance.stop_signal))
+        crashed: bool = instance.tracker.state is ServerState.Crashed
+        if instance.isolation.cgroup is not None:
+            oom_kills: int = cgroup_usage(instance.isolation.cgroup)["memory_events"].get("oom_kill", 0)
+            if oom_kills:
+                lines.append(Messages.OomKilled.value.format(oom_kills))
+            remove_cgroup(instance.isolation.cgroup)
+        SERVER_EXITS.inc(server=instance.name, outcome=instance.stop_signal or instance.tracker.state.value)
+        print(instance.label + " ".join(lines))
+
+        disarm_idle_timer(instance)
+        history.close_sessions(instance.name)
+        instance.detach()
+        instance.supervisor_task = None
+
+        config: BotConfig = config_store.config
+        policy: RestartPolicy = RestartPolicy(config.server(instance.name).restart_policy, config.restart_backoff,
+                                              config.restart_backoff_max, config.restart_max_crashes,
+                                              config.restart_window)
+        delay: (float, None) = instance.restart_state.next_restart(policy, crashed, requested, uptime)
+        if delay is not None:
+            lines.append(Messages.RestartScheduled.value.format(delay, policy.mode))
+            instance.restart_task = asyncio.create_task(restart_later(instance, delay))
+        elif instance.restart_state.tripped and crashed:
+            lines.append(Messages.CrashLoop.value.format(len(instance.restart_state.crashes), policy.window / 60))
+        console_relay.push(instance.feedback_channel_id, [instance.label + line for line in lines])
+
+    async def restart_later(instance: ServerInstance, delay: float) -> None:
+        """Launches a server again with its last launch's arguments, once the backoff passed."""
+        await asyncio.sleep(delay)
+        instance.restart_task = None
+        argv, cwd, mem_alloc = instance.launch_spec
+        async with instance.launch_lock:
+            if instance.running:
+                return
+            try:
+                await start_isolated(instance, argv, cwd, mem_alloc, instance.feedback_channel_id)
+            except Exception as e:
+                console_relay.push(instance.feedback_channel_id,
+                                   [instance.label + Messages.RestartFailed.value.format(repr(e))])
+                return
+        supervise(instance)
+        notices: list[str] = [Messages.Restarted.value]
+        if instance.isolation.fallback is not None:
+            notices.append(Messages.IsolationFallback.value.format(instance.isolation.fallback))
+        console_relay.push(instance.feedback_channel_id, [instance.label + notice for notice in notices])
+
+    def cancel_restart(instance: ServerInstance) -> bool:
+        """Cancels a pending automatic restart. Returns whether there was one."""
+        if instance.restart_task is None:
+            return False
+        instance.restart_task.cancel()
+        instance.restart_task = None
+        return True
+
+    def stop_server(instance: ServerInstance) -> None:
+        """
+        Stops a server in the background, escalating to SIGTERM and SIGKILL if it does not exit in time.
+        The supervisor reports the exit once the process is gone.
+        """
+        disarm_idle_timer(instance)
+        config: BotConfig = config_store.config
+        task: asyncio.Task = asyncio.create_task(instance.shutdown(config.stop_timeout, config.term_timeout))
+        # the loop only keeps weak references to tasks
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+    async def close_idle(instance: ServerInstance) -> None:
+        """
+        Closes an empty server and tells its feedback channel.
+        """
+        embed: discord.Embed = discord.Embed()
+        embed.add_field(name="Timeout", value=instance.label + Messages.InactivityTimeout.value)
+        ctx_channel: discord.ext.commands.context.Context.channel = bot.get_channel(instance.feedback_channel_id)
+        stop_server(instance)
+        embed.add_field(name="Success", value=Messages.CloseSuccess.value)
+        await ctx_channel.send(embed=embed)
+
+    async def idle_shutdown(instance: ServerInstance) -> None:
+        """
+        Waits the grace period and closes the server if it stayed empty. Cancelled when a player joins.
+        """
+        await asyncio.sleep(get_idle_grace())
+        if instance.running and instance.tracker.ready and instance.presence.empty:
+            await close_idle(instance)
+
+    def arm_idle_timer(instance: ServerInstance) -> None:
+        disarm_idle_timer(instance)
+        instance.idle_task = asyncio.create_task(idle_shutdown(instance))
+
+    def disarm_idle_timer(instance: ServerInstance) -> None:
+        if instance.idle_task is not None:
+            instance.idle_task.cancel()
+            instance.idle_task = None
+
+    async def check_inactivity(instance: ServerInstance) -> None:
+        """
+        Closes a single server if it has been empty for longer than the grace period.
+        Only used when presence tracking from the console is disabled.
+        """
+        # Players get a grace period counted from the moment the server is ready, not from launch.
+        if not instance.tracker.ready:
             return
 
         try:
-            server_ip: str = get_ip()
-            server: JavaServer = JavaServer.lookup(server_ip)
-            status: JavaServer.status = server.status()
-        except (TimeoutError, ConnectionRefusedError, KeyError):
+            server_ip: str = get_ip(instance.name)
+            status: StatusResult = await status_service.get(server_ip, max_age=60)
+        except (TimeoutError, ConnectionRefusedError, OSError, KeyError):
             return
+        print("{}Watchdog status is {:.0f} s old".format(instance.label, status.age))
 
-        delta_time: float = time() - latest_server_launch
-        # If no players online and twenty minutes passed since launch, shut down.
-        if status.players.online or delta_time < TWENTY_MINUTES:
+        delta_time: float = time() - instance.tracker.ready_at
+        # If no players online and the grace period passed since the server is ready, shut down.
+        if status.online or delta_time < get_idle_grace():
             return
+        await close_idle(instance)
 
-        embed: discord.Embed = discord.Embed()
-        embed.add_field(name="Timeout", value=Messages.InactivityTimeout.value)
-        ctx_channel: discord.ext.commands.context.Context.channel = bot.get_channel(feedback_channel_id)
-        await ctx_channel.send(embed=embed)
-        await shut_server_down()
+    @tasks.loop(minutes=5)
+    async def empty_server_timeout():
+        """
+        While we have mc!close, we can't always trust our friends to remember to close the server.
+        With presence tracking, the idle timer closes servers as soon as they have been empty for the grace period.
+        Without it, pings every running server for status, accepting a cached answer of up to a minute.
+        :return:
+        """
+        if config_store.config.presence_tracking:
+            return
+        await asyncio.gather(*(check_inactivity(instance) for instance in server_manager.running()))
 
     # endregion
 
     """Now, after declaring all the bot's events and commands, we can run it"""
-
+    startup_phase("commands")
 
     bot.run(os.getenv("DISCORD_SECRET"))
 
 
 if __name__ == "__main__":
+    from dotenv import load_dotenv
+
     ROOT_DIR: str = os.path.abspath(os.path.dirname(__file__))
 
-    """Initialize server process variable for subsequent uses"""
-    server_proc: (subprocess.Popen, None) = None
-    server_proc_running: bool = False
+    """Initialize the registry of servers for subsequent uses"""
+    server_manager: ServerManager = ServerManager()
 
-    feedback_channel_id: int = 0
-    latest_server_launch: float = time()
+    """config.json lives next to the bot, it is only created once the bot starts rather than by importing it"""
+    config_store.create()
 
     load_dotenv()  # Load .env file in order to extract discord secret
-    main()
+    main(startup_report="--startup-report" in sys.argv[1:])
@@ -0,0 +1,240 @@
+import functools
+from bisect import bisect_left
+from time import perf_counter
+
+CONTENT_TYPE: str = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+DEFAULT_BUCKETS: tuple = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs: tuple = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind: str = "unknown"
+
+    def __init__(self, name: str, documentation: str, registry: ("Registry", None) = None):
+        self.name: str = name
+        self.documentation: str = documentation
+        self._values: dict[tuple, object] = {}
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(sorted(labels.items()))
+
+    def render(self) -> list[str]:
+        lines: list[str] = [f"# TYPE {self.name} {self.kind}", f"# HELP {self.name} {self.documentation}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing value.
+    >>> launches = Counter("mcbot_launches", "Server launches")
+    >>> launches.inc(server="survival")
+    """
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key: tuple = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value: float, **labels) -> None:
+        """Sets the total from a counter kept elsewhere, ie the relay's messages_sent."""
+        self._values[self._key(labels)] = value
+
+    def _samples(self) -> list[str]:
+        return [f"{self.name}_total{_format_labels(key)} {_format_value(value)}"
+                for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    """
+    Value which goes up and down.
+    >>> online = Gauge("mcbot_players_online", "Players online")
+    >>> online.set(3, server="survival")
+    """
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def remove(self, **labels) -> None:
+        self._values.pop(self._key(labels), None)
+
+    def _samples(self) -> list[str]:
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values in cumulative buckets.
+    >>> latency = Histogram("mcbot_command_seconds", "Command handler latency")
+    >>> latency.observe(0.12, command="status")
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: tuple = DEFAULT_BUCKETS,
+                 registry: ("Registry", None) = None):
+        super().__init__(name, documentation, registry)
+        self.buckets: tuple = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key: tuple = self._key(labels)
+        if key not in self._values:
+            # per bucket counts, the last one being +Inf, then the sum
+            self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        counts, _ = self._values[key]
+        counts[bisect_left(self.buckets, value)] += 1
+        self._values[key][1] += value
+
+    def time(self, **labels):
+        """
+        Context manager observing the time spent in its block.
+        >>> latency = Histogram("mcbot_query_seconds", "Status query latency", registry=Registry())
+        >>> with latency.time(command="status"):
+        ...     total = sum(range(1000))
+        >>> [line for line in latency.render() if line.startswith("mcbot_query_seconds_count")]
+        ['mcbot_query_seconds_count{command="status"} 1']
+        """
+        return _Timer(self, labels)
+
+    def _samples(self) -> list[str]:
+        lines: list[str] = []
+        for key, (counts, total) in self._values.items():
+            cumulative: int = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le: str = bound if isinstance(bound, str) else _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: dict):
+        self._histogram: Histogram = histogram
+        self._labels: dict = labels
+        self._start: float = 0.0
+
+    def __enter__(self) -> "_Timer":
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._histogram.observe(perf_counter() - self._start, **self._labels)
+
+
+class Registry:
+    """
+    Every metric of the bot. Collectors run before each scrape, to update gauges read from other objects.
+    """
+
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+        self._collectors: list = []
+
+    def register(self, metric: _Metric) -> None:
+        self._metrics.append(metric)
+
+    def add_collector(self, collector) -> None:
+        """
+        :param collector: Callable without arguments, called before every render
+        """
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Every metric in the OpenMetrics text format."""
+        for collector in self._collectors:
+            collector()
+        lines: list[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY: Registry = Registry()
+
+COMMAND_SECONDS: Histogram = Histogram("mcbot_command_seconds", "Latency of the bot's command handlers")
+COMMAND_ERRORS: Counter = Counter("mcbot_command_errors", "Command handlers which raised")
+FEEDBACK_TICK_SECONDS: Histogram = Histogram("mcbot_feedback_tick_seconds", "Duration of a server_feedback tick")
+STATUS_QUERY_SECONDS: Histogram = Histogram("mcbot_status_query_seconds", "Round trip of a status query")
+STATUS_QUERY_ERRORS: Counter = Counter("mcbot_status_query_errors", "Status queries which failed")
+RELAY_PENDING: Gauge = Gauge("mcbot_relay_pending_lines", "Console lines waiting to be relayed")
+RELAY_LAG: Gauge = Gauge("mcbot_relay_lag_seconds", "Age of the oldest console line waiting to be relayed")
+RELAY_MESSAGES: Counter = Counter("mcbot_relay_messages", "Messages sent by the console relay")
+RELAY_LINES: Counter = Counter("mcbot_relay_lines", "Console lines merged into relayed messages")
+RELAY_SKIPPED: Counter = Counter("mcbot_relay_lines_skipped", "Oldest console lines skipped by a full relay backlog")
+SERVER_UP: Gauge = Gauge("mcbot_server_up", "Whether the server process is running")
+SERVER_UPTIME: Gauge = Gauge("mcbot_server_uptime_seconds", "Seconds since the server was launched")
+SERVER_RESTARTS: Counter = Counter("mcbot_server_restarts", "Launches of the server after its first one")
+PLAYERS_ONLINE: Gauge = Gauge("mcbot_players_online", "Players online in the last status query")
+SERVER_EXITS: Counter = Counter("mcbot_server_exits", "Exits of the server process, by how they ended")
+STDOUT_LINES: Gauge = Gauge("mcbot_stdout_lines_read", "Lines read from the stdout of the current process")
+STDOUT_PENDING: Gauge = Gauge("mcbot_stdout_lines_pending", "Lines read from stdout but not yet handled")
+FILTER_HITS: Counter = Counter("mcbot_filter_hits", "Console lines classified by each output filter rule")
+RCON_SECONDS: Histogram = Histogram("mcbot_rcon_seconds", "Round trip of an RCON command")
+RCON_FALLBACKS: Counter = Counter("mcbot_rcon_fallbacks", "Commands written to stdin because RCON failed")
+STDOUT_DROPPED: Gauge = Gauge("mcbot_stdout_lines_dropped", "Lines of the current process dropped by a full buffer")
+STARTUP_SECONDS: Gauge = Gauge("mcbot_startup_seconds", "Seconds from the bot's start to each phase of its startup")
+
+
+def instrumented(command_name: str):
+    """
+    Decorator timing a command handler into mcbot_command_seconds.
+    The signature is kept, so discord.py still parses the command's arguments. It goes below @bot.command.
+    >>> import asyncio, inspect
+    >>> @instrumented("status")
+    ... async def get_status(ctx, *args):
+    ...     return args
+    >>> asyncio.run(get_status(None, "survival")), str(inspect.signature(get_status))
+    (('survival',), '(ctx, *args)')
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start: float = perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                COMMAND_ERRORS.inc(command=command_name)
+                raise
+            finally:
+                COMMAND_SECONDS.observe(perf_counter() - start, command=command_name)
+        return wrapper
+    return decorator
+
+
+async def start_metrics_server(host: str, port: int):
+    """
+    Serves REGISTRY over HTTP at /metrics. aiohttp comes with discord.py.
+    :return: The aiohttp runner, to clean it up on shutdown.
+    """
+    from aiohttp import web
+
+    async def handle(_request) -> web.Response:
+        return web.Response(body=REGISTRY.render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+    app: web.Application = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner: web.AppRunner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,303 @@
+import re
+from dataclasses import dataclass
+
+DROP: str = "drop"
+ROUTE: str = "route"
+HIGHLIGHT: str = "highlight"
+ACTIONS: tuple = (DROP, ROUTE, HIGHLIGHT)
+
+# Log header of vanilla/Forge ("[18:03:11] [Server thread/INFO]: ") and Paper ("[18:03:11 INFO]: ", without thread)
+_HEADER_PATTERN: re.Pattern = re.compile(r"\[[^\]]*\] \[(?P<thread>[^\]]*)/(?P<level>[A-Z]+)\]"
+                                         r"|\[[^\] ]* (?P<paper_level>[A-Z]+)\]")
+_HEADER_CACHE_SIZE: int = 1024
+# "(?i)error" would be a global flag in the middle of the combined pattern, it becomes "(?i:error)"
+_GLOBAL_FLAGS_PATTERN: re.Pattern = re.compile(r"^\(\?(?P<flags>[aiLmsux]+)\)")
+# "\1" or "(?(1)...)" refer to group numbers, which change once the pattern is an alternative of the combined pattern
+_BACKREFERENCE_PATTERN: re.Pattern = re.compile(r"(?<!\\)(\\\\)*\\[1-9]|\(\?\(")
+
+
+def _alternative(pattern: str) -> str:
+    """
+    A pattern as an alternative of the combined pattern, ending with the empty group marking it.
+    The pattern is only wrapped in a group when it needs one, so re can skip alternatives by their first literal.
+    >>> _alternative("Can't keep up"), _alternative("Debug|Trace"), _alternative("(?i)error")
+    ("Can't keep up()", '(?:Debug|Trace)()', '(?i:error)()')
+    >>> _alternative("(?x)error  # any case")
+    '(?x:error  # any case\\n)()'
+    """
+    flags: (re.Match, None) = _GLOBAL_FLAGS_PATTERN.match(pattern)
+    if flags:
+        # in verbose mode a trailing comment would swallow the closing parenthesis, a newline ends it
+        end: str = "\n" if "x" in flags.group("flags") else ""
+        return f"(?{flags.group('flags')}:{pattern[flags.end():]}{end})()"
+    return f"(?:{pattern})()" if "|" in pattern else f"{pattern}()"
+
+
+def parse_header(line: str) -> tuple[str, str]:
+    """
+    Level and thread of a console line, empty when the line has no log header.
+    >>> parse_header("[18:03:11] [Server thread/WARN]: Can't keep up!")
+    ('WARN', 'Server thread')
+    >>> parse_header("[18:03:11 INFO]: Steve joined the game")
+    ('INFO', '')
+    """
+    header: (re.Match, None) = _HEADER_PATTERN.match(line)
+    if header is None:
+        return "", ""
+    return header.group("level") or header.group("paper_level"), header.group("thread") or ""
+
+
+def validate_rule(rule: dict) -> dict:
+    """
+    Checks a rule of the "filters" config key. Raises ValueError if it can not be used.
+    :return: The rule, with only the known keys
+    >>> validate_rule({"pattern": "Can't keep up", "action": "drop"})
+    {'pattern': "Can't keep up", 'action': 'drop'}
+    >>> validate_rule({"pattern": r"(ab) \\1", "action": "drop"})
+    Traceback (most recent call last):
+    ...
+    ValueError: Backreferences are not allowed in rules: {'pattern': '(ab) \\\\1', 'action': 'drop'}
+    """
+    if not isinstance(rule, dict) or rule.get("action") not in ACTIONS:
+        raise ValueError(f"A rule needs an action out of {', '.join(ACTIONS)}: {rule!r}")
+    if rule["action"] == ROUTE and not str(rule.get("channel", "")).isdigit():
+        raise ValueError(f"A route rule needs a channel id: {rule!r}")
+    if not any(rule.get(key) for key in ("pattern", "level", "thread")):
+        raise ValueError(f"A rule needs a pattern, level or thread: {rule!r}")
+    for key in ("pattern", "level", "thread"):
+        try:
+            # a pattern is compiled as the alternative it becomes in the combined pattern
+            compiled: re.Pattern = re.compile(_alternative(str(rule.get(key) or "")) if key == "pattern"
+                                              else str(rule.get(key) or ""))
+        except re.error as e:
+            raise ValueError(f"Invalid regular expression in {rule!r}: {e}")
+        if compiled.groupindex:
+            raise ValueError(f"Named groups are not allowed in rules: {rule!r}")
+        if _BACKREFERENCE_PATTERN.search(str(rule.get(key) or "")):
+            raise ValueError(f"Backreferences are not allowed in rules: {rule!r}")
+    return {key: rule[key] for key in ("name", "pattern", "level", "thread", "action", "channel") if key in rule}
+
+
+@dataclass
+class FilterRule:
+    """A validated rule of the "filters" config key, with its hit counter."""
+    name: str
+    action: str
+    pattern: (str, None) = None
+    level: (re.Pattern, None) = None  # matches the whole level, ie WARN|ERROR
+    thread: (re.Pattern, None) = None  # matches the whole thread name, ie Server thread
+    channel: (int, None) = None
+    hits: int = 0
+
+    def accepts(self, level: str, thread: str) -> bool:
+        """Whether the rule's level and thread conditions hold for a line's header."""
+        return (self.level is None or self.level.fullmatch(level) is not None) \
+            and (self.thread is None or self.thread.fullmatch(thread) is not None)
+
+
+class OutputFilter:
+    """
+    Classifies console lines against the rules of the "filters" config key.
+    The patterns of every rule are compiled into a single regular expression, so a line is searched once
+    instead of once per rule. Each alternative ends with an empty group which tells the rule that matched.
+    When several patterns match, the one matching earliest in the line wins, ties going to the rule listed first.
+    Rules with only a level or thread apply to lines no pattern matched, the first one listed winning.
+    Lines matching no rule go to the server's feedback channel unchanged.
+    Patterns must not use named groups or numbered backreferences, as their groups are renumbered.
+    >>> output_filter = OutputFilter([
+    ...     {"name": "spam", "pattern": "Can't keep up", "action": "drop"},
+    ...     {"name": "chat", "pattern": "]: <", "action": "route", "channel": 42},
+    ...     {"name": "errors", "level": "ERROR", "action": "highlight"},
+    ... ])
+    >>> output_filter.route([
+    ...     "[18:03:11] [Server thread/WARN]: Can't keep up! Is the server overloaded?",
+    ...     "[18:03:12] [Server thread/INFO]: <Steve> hi",
+    ...     "[18:03:13] [Server thread/ERROR]: Failed to save chunk",
+    ...     "[18:03:14] [Server thread/INFO]: Saved the game",
+    ... ], 7)
+    {42: ['[18:03:12] [Server thread/INFO]: <Steve> hi'], \
+7: ['- [18:03:13] [Server thread/ERROR]: Failed to save chunk', '[18:03:14] [Server thread/INFO]: Saved the game']}
+    >>> [(rule.name, rule.hits) for rule in output_filter.rules]
+    [('spam', 1), ('chat', 1), ('errors', 1)]
+    """
+
+    def __init__(self, rules: list[dict], code_block: bool = True):
+        """
+        :param rules: Validated rules, see validate_rule
+        :param code_block: Whether the relay wraps messages in a code block, which changes how lines are highlighted
+        """
+        self.code_block: bool = code_block
+        self.rules: list[FilterRule] = []
+        self.source: list[dict] = []
+        self.lines_classified: int = 0
+        self._matcher: (re.Pattern, None) = None
+        self._markers: dict[int, FilterRule] = {}  # group number of an alternative's empty group: its rule
+        self._searchers: list[tuple[re.Pattern, FilterRule]] = []  # each pattern rule on its own, in order
+        self._header_rules: list[FilterRule] = []
+        self._header_cache: dict[tuple[str, str], (FilterRule, None)] = {}
+        self.load(rules)
+
+    def load(self, rules: list[dict]) -> None:
+        """
+        Compiles a new set of rules. Rules keep their hit counter if a rule of the same name existed.
+        If the rules do not compile, the previous ones stay in place.
+        :param rules: Validated rules, see validate_rule
+        """
+        hits: dict[str, int] = {rule.name: rule.hits for rule in self.rules}
+        # the source is taken either way, so a broken set of rules is not compiled again on every call
+        self.source = rules
+        loaded: list[FilterRule] = []
+        markers: dict[int, FilterRule] = {}
+        searchers: list[tuple[re.Pattern, FilterRule]] = []
+        header_rules: list[FilterRule] = []
+        alternatives: list[str] = []
+        groups: int = 0
+        try:
+            for index, raw in enumerate(rules):
+                name: str = str(raw.get("name") or f"rule {index + 1}")
+                rule: FilterRule = FilterRule(name=name, action=raw["action"], pattern=raw.get("pattern"),
+                                              level=re.compile(raw["level"]) if raw.get("level") else None,
+                                              thread=re.compile(raw["thread"]) if raw.get("thread") else None,
+                                              channel=int(raw["channel"]) if raw.get("channel") else None,
+                                              hits=hits.get(name, 0))
+                loaded.append(rule)
+                if not rule.pattern:
+                    header_rules.append(rule)
+                    continue
+                compiled: re.Pattern = re.compile(rule.pattern)
+                searchers.append((compiled, rule))
+                # the pattern's own groups come first, then the empty group marking the alternative
+                groups += compiled.groups + 1
+                markers[groups] = rule
+                alternatives.append(_alternative(rule.pattern))
+            matcher: (re.Pattern, None) = re.compile("|".join(alternatives)) if alternatives else None
+        except (re.error, KeyError, ValueError) as e:
+            print(f"Output filters not loaded, keeping the previous ones: {e!r}")
+            return
+        self.rules, self._markers, self._searchers, self._header_rules = loaded, markers, searchers, header_rules
+        self._matcher = matcher
+        self._header_cache = {}
+
+    def _match_header(self, level: str, thread: str) -> (FilterRule, None):
+        key: tuple[str, str] = (level, thread)
+        if key not in self._header_cache:
+            if len(self._header_cache) >= _HEADER_CACHE_SIZE:
+                self._header_cache.clear()
+            self._header_cache[key] = next((rule for rule in self._header_rules if rule.accepts(level, thread)), None)
+        return self._header_cache[key]
+
+    def _search_accepted(self, line: str, level: str, thread: str) -> (FilterRule, None):
+        """The rule whose pattern matches earliest in the line, among those accepting its header."""
+        best: (tuple[int, FilterRule], None) = None
+        for pattern, rule in self._searchers:
+            if not rule.accepts(level, thread):
+                continue
+            # the whole line is searched: an end position would cut matches which start earlier but end later
+            match: (re.Match, None) = pattern.search(line)
+            # ties go to the rule listed first, which was searched first
+            if match is not None and (best is None or match.start() < best[0]):
+                best = match.start(), rule
+        return best[1] if best else None
+
+    def classify(self, line: str) -> (FilterRule, None):
+        """
+        :param line: A single console line
+        :return: The rule which applies to the line, None if no rule matches.
+        """
+        self.lines_classified += 1
+        level, thread = parse_header(line)
+        rule: (FilterRule, None) = None
+        if self._matcher is not None:
+            match: (re.Match, None) = self._matcher.search(line)
+            if match is not None:
+                rule = self._markers[match.lastindex]
+                if not rule.accepts(level, thread):
+                    # the pattern matched but not its level or thread: another rule may match at the same
+                    # position, which the combined pattern does not tell, so only the accepted rules are searched
+                    rule = self._search_accepted(line, level, thread)
+        if rule is None and self._header_rules:
+            rule = self._match_header(level, thread)
+        if rule is not None:
+            rule.hits += 1
+        return rule
+
+    def highlight(self, line: str) -> str:
+        # inside a code block, Discord colors the lines of a diff starting with "-" red
+        return "- " + line if self.code_block else f"**{line}**"
+
+    def route(self, lines: list[str], default_channel: int, prefix: str = "") -> dict[int, list[str]]:
+        """
+        Applies the rules to console lines.
+        :param lines: Console lines, in order
+        :param default_channel: Channel of lines which are not routed elsewhere
+        :param prefix: Prepended to every relayed line, ie the server's label
+        :return: Channel id to the lines it gets, in order. Dropped lines are left out.
+        """
+        routed: dict[int, list[str]] = {}
+        for line in lines:
+            destination: (tuple[int, str], None) = self.apply(line, default_channel, prefix)
+            if destination is not None:
+                routed.setdefault(destination[0], []).append(destination[1])
+        return routed
+
+    def apply(self, line: str, default_channel: int, prefix: str = "") -> (tuple[int, str], None):
+        """
+        Applies the rules to a single console line.
+        :return: (channel id, line as it is relayed), None if the line is dropped.
+        """
+        rule: (FilterRule, None) = self.classify(line)
+        if rule is None:
+            return default_channel, prefix + line
+        if rule.action == ROUTE:
+            return rule.channel, prefix + line
+        if rule.action == HIGHLIGHT:
+            return default_channel, self.highlight(prefix + line)
+        return None
+
+    @property
+    def dropped(self) -> int:
+        return sum(rule.hits for rule in self.rules if rule.action == DROP)
+
+
+if __name__ == "__main__":
+    # Micro-benchmark: lines per second classified by the combined matcher, against one search per rule.
+    # python output_filters.py [rules]
+    import random
+    import sys
+    from time import perf_counter
+
+    rule_count: int = int(sys.argv[1]) if len(sys.argv) > 1 else 150
+    random.seed(0)
+    plugins: list[str] = [f"Plugin{index}" for index in range(rule_count)]
+    bench_rules: list[dict] = [validate_rule({"name": plugin, "pattern": rf"\[{plugin}\] (Debug|Saving) \w+",
+                                              "action": DROP}) for plugin in plugins[:-2]]
+    bench_rules.append(validate_rule({"name": "chat", "pattern": "]: <", "action": ROUTE, "channel": 1}))
+    bench_rules.append(validate_rule({"name": "errors", "level": "ERROR|FATAL", "action": HIGHLIGHT}))
+
+    samples: list[str] = [
+        "[18:03:11] [Server thread/INFO]: <Steve> anyone up for the nether?",
+        "[18:03:11] [Server thread/ERROR]: Encountered an unexpected exception",
+        "[18:03:11 INFO]: Steve joined the game",
+        "[18:03:11] [Worker-Main-3/WARN]: Can't keep up! Is the server overloaded? Running 2041ms behind",
+    ]
+    bench_lines: list[str] = [random.choice(samples) if random.random() < .5 else
+                              f"[18:03:11 INFO]: [{random.choice(plugins)}] Debug tick {index}"
+                              for index in range(200_000)]
+
+    combined: OutputFilter = OutputFilter(bench_rules)
+    start: float = perf_counter()
+    combined.route(bench_lines, 0)
+    combined_rate: float = len(bench_lines) / (perf_counter() - start)
+
+    # the naive way: every rule on its own, in order
+    separate: list[tuple[re.Pattern, FilterRule]] = [(re.compile(rule.pattern or ""), rule) for rule in combined.rules]
+    start = perf_counter()
+    for bench_line in bench_lines:
+        bench_level, bench_thread = parse_header(bench_line)
+        next((rule for pattern, rule in separate
+              if pattern.search(bench_line) and rule.accepts(bench_level, bench_thread)), None)
+    separate_rate: float = len(bench_lines) / (perf_counter() - start)
+
+    print(f"{len(bench_rules)} rules, {len(bench_lines)} lines")
+    print(f"combined matcher: {combined_rate:,.0f} lines/s")
+    print(f"one search per rule: {separate_rate:,.0f} lines/s")
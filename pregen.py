@@ -0,0 +1,302 @@
+import re
+from collections import deque
+from dataclasses import dataclass, field
+from itertools import islice
+from math import atan2
+from time import monotonic
+from typing import Iterator
+
+CHUNKY: str = "chunky"
+VANILLA: str = "vanilla"
+METHODS: tuple = (CHUNKY, VANILLA)
+RUNNING: str = "running"
+PAUSED: str = "paused"
+DONE: str = "done"
+TILE: int = 8  # chunks per side of a vanilla step, 64 chunks where forceload takes at most 256
+SAVE_INTERVAL: float = 30.0  # seconds between saves of the progress alone
+_SAVED_FIELDS: tuple = ("center_x", "center_z", "radius", "method", "state", "done", "step")
+
+# "[Chunky] Task running for world. Processed: 1234 chunks (5.67%), ETA: 0:10:00, Rate: 45.6 cps, Current: 12, 34"
+_CHUNKY_PROGRESS_PATTERN: re.Pattern = re.compile(r"\[Chunky\] Task (?P<state>running|finished) for \S+\. "
+                                                  r"Processed: \d+ chunks \((?P<percent>[\d.]+)%\)")
+_CHUNKY_REPLY_PATTERN: re.Pattern = re.compile(r"\]: \[Chunky\] ")
+_FORCELOAD_REPLY_PATTERN: re.Pattern = re.compile(r"\]: ((Un)?[Mm]arked (\d+ chunks|chunk) .* force load"
+                                                  r"|No chunks were (marked|removed) for force loading)")
+
+
+def _ring(ring: int) -> list[tuple]:
+    """
+    Indices of the tiles ring steps away from the center one, in the order of their angle around it.
+    >>> _ring(1)
+    [(-1, -1), (0, -1), (1, -1), (1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0)]
+    """
+    if ring == 0:
+        return [(0, 0)]
+    cells: list[tuple] = [(i, j) for i in range(-ring, ring + 1) for j in (-ring, ring)]
+    cells += [(i, j) for i in (-ring, ring) for j in range(-ring + 1, ring)]
+    return sorted(cells, key=lambda cell: atan2(cell[1], cell[0]))
+
+
+def tiles(radius: int, tile: int = TILE) -> Iterator[tuple]:
+    """
+    Squares of at most tile x tile chunks covering every chunk within radius of the center,
+    ring by ring from the center, so a pre-generation cut short still covers the area players see first.
+    They are generated one ring at a time, a large radius costs no memory upfront.
+    :return: (x1, z1, x2, z2) of every square, in chunks relative to the center, inclusive
+    >>> list(tiles(4))
+    [(-4, -4, 3, 3), (4, -4, 4, 3), (4, 4, 4, 4), (-4, 4, 3, 4)]
+    >>> sum((x2 - x1 + 1) * (z2 - z1 + 1) for x1, z1, x2, z2 in tiles(20)) == (2 * 20 + 1) ** 2
+    True
+    """
+    # one tile is centered on the center chunk, the outer ones are cut at the radius
+    half: int = tile // 2
+    low: int = -(-(radius - half) // tile)  # tiles below the center one
+    high: int = (radius + half) // tile  # tiles above it
+    for ring in range(max(low, high) + 1):
+        for i, j in _ring(ring):
+            if -low <= i <= high and -low <= j <= high:
+                x, z = i * tile - half, j * tile - half
+                yield max(x, -radius), max(z, -radius), min(x + tile - 1, radius), min(z + tile - 1, radius)
+
+
+@dataclass
+class PregenJob:
+    """
+    Pre-generation of every chunk within radius of a center, saved in config.json under pregen
+    so it resumes after the bot or the server restarts.
+    """
+    center_x: int  # blocks
+    center_z: int
+    radius: int  # chunks
+    method: str = VANILLA  # chunky uses the Chunky plugin's commands, vanilla a forceload sweep over stdin
+    state: str = RUNNING
+    done: int = 0  # chunks generated
+    step: int = 0  # vanilla: tiles generated, chunky: 1 once its task was created
+    # not saved
+    pause_reason: (str, None) = field(default=None, compare=False)
+    launch: int = field(default=0, compare=False)  # launches of the server when the job last ran on it
+    active: bool = field(default=False, compare=False)  # the server currently works on the job
+    loaded_at: (float, None) = field(default=None, compare=False)  # when the current vanilla tile was forceloaded
+    progress: deque = field(default_factory=lambda: deque(maxlen=120), compare=False)  # (monotonic, done)
+    square: (tuple, None) = field(default=None, compare=False)  # vanilla: the tile of step, see tile
+    squares: (Iterator, None) = field(default=None, compare=False)  # vanilla: the tiles after it
+
+    @classmethod
+    def from_dict(cls, raw: dict) -> "PregenJob":
+        """Raises ValueError for invalid jobs, ie from a hand edited config.json."""
+        try:
+            job: PregenJob = cls(**{key: raw[key] for key in _SAVED_FIELDS if key in raw})
+        except TypeError as e:
+            raise ValueError(f"Invalid pre-generation job: {raw!r}") from e
+        if job.method not in METHODS or job.state not in (RUNNING, PAUSED, DONE) or job.radius <= 0:
+            raise ValueError(f"Invalid pre-generation job: {raw!r}")
+        return job
+
+    def to_dict(self) -> dict:
+        return {key: getattr(self, key) for key in _SAVED_FIELDS}
+
+    @property
+    def total(self) -> int:
+        return (2 * self.radius + 1) ** 2
+
+    @property
+    def rate(self) -> float:
+        """Chunks per second over the last samples of progress, 0 until there are two."""
+        if len(self.progress) < 2:
+            return 0.0
+        (first_at, first_done), (last_at, last_done) = self.progress[0], self.progress[-1]
+        return (last_done - first_done) / (last_at - first_at) if last_at > first_at else 0.0
+
+    @property
+    def eta(self) -> (float, None):
+        """Seconds until every chunk is generated at the current rate, None while it is unknown."""
+        return (self.total - self.done) / self.rate if self.rate > 0 else None
+
+    def tile(self) -> (tuple, None):
+        """
+        The vanilla tile of the current step, None once every tile was generated.
+        Tiles are produced as the job advances, a resumed job skips to its step.
+        >>> job = PregenJob(0, 0, radius=4, step=1)
+        >>> job.tile()
+        (4, -4, 4, 3)
+        >>> job.advance()
+        >>> job.tile(), job.step
+        ((4, 4, 4, 4), 2)
+        """
+        if self.squares is None:
+            self.squares = islice(tiles(self.radius), self.step, None)
+            self.square = next(self.squares, None)
+        return self.square
+
+    def advance(self) -> None:
+        """Moves on to the next vanilla tile."""
+        self.tile()
+        self.square = next(self.squares, None)
+        self.step += 1
+
+    def block_area(self, square: tuple) -> str:
+        """Block coordinates of a tile, as forceload takes them."""
+        x1, z1, x2, z2 = square
+        chunk_x, chunk_z = self.center_x // 16, self.center_z // 16
+        return f"{(chunk_x + x1) * 16} {(chunk_z + z1) * 16} {(chunk_x + x2) * 16 + 15} {(chunk_z + z2) * 16 + 15}"
+
+
+class PregenManager:
+    """
+    Runs one pre-generation job per server, a step every time step is called.
+    A job pauses while players are online or while the server's MSPT is above max_mspt, and resumes on its own.
+    >>> manager = PregenManager({}, save=lambda jobs: None)
+    >>> manager.start("default", PregenJob(0, 0, radius=32))
+    >>> sent = []
+    >>> manager.step("default", sent.extend, players_online=False, mspt=12.0, launch=1)
+    >>> sent
+    ['forceload add -64 -64 63 63']
+    >>> manager.step("default", sent.extend, players_online=True, mspt=12.0, launch=1)
+    'Pre-generation paused, players are online.'
+    >>> sent[-1]
+    'forceload remove -64 -64 63 63'
+    """
+
+    def __init__(self, jobs: dict, save, interval: float = 5.0, max_mspt: float = 40.0):
+        """
+        :param jobs: Saved jobs, server name: PregenJob.to_dict
+        :param save: Callable receiving every job as a dict to persist, ie into config.json
+        :param interval: Seconds every vanilla tile stays forceloaded, which is the time the server gets to generate it
+        :param max_mspt: MSPT above which jobs pause
+        """
+        self.jobs: dict[str, PregenJob] = {name: PregenJob.from_dict(raw) for name, raw in jobs.items()}
+        self._save = save
+        self.interval: float = interval
+        self.max_mspt: float = max_mspt
+        self._saved_at: float = monotonic()
+
+    def save(self) -> None:
+        self._saved_at = monotonic()
+        self._save({name: job.to_dict() for name, job in self.jobs.items()})
+
+    def start(self, server: str, job: PregenJob) -> None:
+        """Starts a job, replacing a finished one. Raises RuntimeError if the server already has one going."""
+        current: (PregenJob, None) = self.jobs.get(server)
+        if current is not None and current.state != DONE:
+            raise RuntimeError(f"{server} is already pre-generating")
+        self.jobs[server] = job
+        self.save()
+
+    def cancel(self, server: str, send) -> (PregenJob, None):
+        """
+        Drops a server's job, unloading what it forceloaded. Chunks generated so far stay generated.
+        :param send: Callable writing a list of commands to the server, None if it is not running
+        :return: The cancelled job, None if there was none
+        """
+        job: (PregenJob, None) = self.jobs.pop(server, None)
+        if job is not None and send is not None and job.active:
+            self._halt(job, send)
+        self.save()
+        return job
+
+    def feed(self, server: str, line: str) -> bool:
+        """
+        Follows the replies of the commands a job sent.
+        :return: True if the line is such a reply, so it does not need to be relayed
+        """
+        job: (PregenJob, None) = self.jobs.get(server)
+        if job is None:
+            return False
+        if job.method == VANILLA:
+            return job.active and bool(_FORCELOAD_REPLY_PATTERN.search(line))
+        progress: (re.Match, None) = _CHUNKY_PROGRESS_PATTERN.search(line)
+        if progress:
+            job.done = min(job.total, round(float(progress.group("percent")) / 100 * job.total))
+            job.progress.append((monotonic(), job.done))
+            if progress.group("state") == "finished":
+                job.state, job.active = DONE, False
+                self.save()
+            return True
+        return job.active and bool(_CHUNKY_REPLY_PATTERN.search(line))
+
+    def _halt(self, job: PregenJob, send) -> None:
+        """Stops the server's work on a job, keeping its progress."""
+        if job.method == CHUNKY:
+            send(["chunky pause"])
+        elif job.loaded_at is not None:
+            # the tile is generated again from the start on resume
+            send([f"forceload remove {job.block_area(job.tile())}"])
+            job.loaded_at = None
+        job.active = False
+        job.progress.clear()
+
+    def step(self, server: str, send, players_online: bool, mspt: (float, None), launch: int) -> (str, None):
+        """
+        Advances a server's job: pauses or resumes it, and sends its next commands.
+        :param send: Callable writing a list of commands to the ready server, ie ServerInstance.send_commands
+        :param players_online: Whether anybody is on the server
+        :param mspt: Latest MSPT of the server, None if unknown
+        :param launch: ServerInstance.launches, telling when the server process was replaced
+        :return: A message about the job to post, None otherwise
+        """
+        job: (PregenJob, None) = self.jobs.get(server)
+        if job is None or job.state == DONE:
+            return None
+        if launch != job.launch:
+            # a new process lost the old one's state: Chunky needs to continue and forceloads were saved with the world
+            job.launch, job.active, job.loaded_at = launch, False, None
+            job.progress.clear()
+
+        reason: (str, None) = "players are online" if players_online \
+            else f"MSPT {mspt:.1f} is above {self.max_mspt:.0f}" if mspt is not None and mspt > self.max_mspt else None
+        if reason is not None:
+            if job.active:
+                self._halt(job, send)
+            changed: bool = job.state == RUNNING
+            job.state, job.pause_reason = PAUSED, reason
+            if changed:
+                self.save()
+                return f"Pre-generation paused, {reason}."
+            return None
+
+        message: (str, None) = None
+        if job.state == PAUSED:
+            job.state, job.pause_reason = RUNNING, None
+            message = "Pre-generation resumed."
+        if job.method == CHUNKY:
+            self._step_chunky(job, send)
+        else:
+            message = self._step_vanilla(job, send) or message
+        if message is not None or monotonic() - self._saved_at >= SAVE_INTERVAL:
+            self.save()
+        return message
+
+    @staticmethod
+    def _step_chunky(job: PregenJob, send) -> None:
+        if job.active:
+            return  # Chunky paces itself, its progress comes through feed
+        if job.step == 0:
+            # Chunky's radius is in blocks, and its task survives restarts of the server
+            send([f"chunky center {job.center_x} {job.center_z}", f"chunky radius {job.radius * 16 + 8}",
+                  "chunky start"])
+            job.step = 1
+        else:
+            send(["chunky continue"])
+        job.active = True
+        job.progress.append((monotonic(), job.done))
+
+    def _step_vanilla(self, job: PregenJob, send) -> (str, None):
+        now: float = monotonic()
+        if job.loaded_at is not None:
+            if now - job.loaded_at < self.interval:
+                return None
+            x1, z1, x2, z2 = square = job.tile()
+            send([f"forceload remove {job.block_area(square)}"])
+            job.done += (x2 - x1 + 1) * (z2 - z1 + 1)
+            job.advance()
+            job.loaded_at = None
+            job.progress.append((now, job.done))
+        if job.tile() is None:
+            job.state, job.active = DONE, False
+            return f"Pre-generation finished, {job.total} chunks around {job.center_x} {job.center_z}."
+        if not job.progress:
+            job.progress.append((now, job.done))
+        # loading the chunks generates them over the next ticks, unloading them once the tile had its time
+        send([f"forceload add {job.block_area(job.tile())}"])
+        job.loaded_at, job.active = now, True
+        return None
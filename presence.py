@@ -0,0 +1,93 @@
+import re
+from time import time
+
+JOIN: str = "join"
+LEAVE: str = "leave"
+
+# The name follows the logger's "]: " directly, so chat lines ("]: <Steve> ...") never match.
+_NAME: str = r"(?P<name>[^\s<\[][^\s]{0,31})"
+_JOIN_PATTERN: re.Pattern = re.compile(r"\]: " + _NAME + r"( \(formerly known as \S+\))? joined the game\s*$")
+_LEAVE_PATTERN: re.Pattern = re.compile(r"\]: " + _NAME + r" left the game\s*$")
+_LOST_CONNECTION_PATTERN: re.Pattern = re.compile(r"\]: " + _NAME + r" lost connection: ")
+
+
+def parse_presence(line: str) -> (tuple[str, str], None):
+    """
+    Turns a join, leave or disconnect console line into a presence event.
+    :param line: A single console line
+    :return: (JOIN or LEAVE, player name), None for any other line
+    >>> parse_presence("[18:03:11] [Server thread/INFO]: Steve joined the game")
+    ('join', 'Steve')
+    >>> parse_presence("[18:03:11 INFO]: Alex left the game")
+    ('leave', 'Alex')
+    >>> parse_presence("[18:03:11] [Server thread/INFO] [minecraft/MinecraftServer]: Steve joined the game")
+    ('join', 'Steve')
+    >>> parse_presence("[18:03:11] [Server thread/INFO] [minecraft/DedicatedServer]: Steve left the game")
+    ('leave', 'Steve')
+    >>> parse_presence("[18:03:11] [Server thread/INFO]: Steve (formerly known as Bob) joined the game")
+    ('join', 'Steve')
+    >>> parse_presence("[18:03:11] [Server thread/INFO]: Steve lost connection: Timed out")
+    ('leave', 'Steve')
+    >>> parse_presence("[18:03:11 INFO]: .BedrockSteve joined the game")
+    ('join', '.BedrockSteve')
+    >>> parse_presence("[18:03:11] [Server thread/INFO]: <Steve> Alex joined the game")
+    >>> parse_presence("[18:03:11 INFO]: [Not Secure] <Steve> Alex left the game")
+    """
+    match: (re.Match, None) = _JOIN_PATTERN.search(line)
+    if match:
+        return JOIN, match.group("name")
+    match = _LEAVE_PATTERN.search(line) or _LOST_CONNECTION_PATTERN.search(line)
+    if match:
+        return LEAVE, match.group("name")
+    return None
+
+
+class PresenceTracker:
+    """
+    Set of online players, kept from the join and leave lines of the console.
+    >>> presence = PresenceTracker()
+    >>> presence.feed("[18:03:11] [Server thread/INFO]: Steve joined the game")
+    ('join', 'Steve')
+    >>> presence.online
+    {'Steve'}
+    >>> presence.feed("[18:09:40] [Server thread/INFO]: Steve lost connection: Disconnected")
+    ('leave', 'Steve')
+    >>> presence.feed("[18:09:40] [Server thread/INFO]: Steve left the game")
+    >>> presence.empty
+    True
+    """
+
+    def __init__(self):
+        self.online: set[str] = set()
+        self.empty_since: float = time()
+        self.events: int = 0
+
+    @property
+    def empty(self) -> bool:
+        return not self.online
+
+    def feed(self, line: str) -> (tuple[str, str], None):
+        """
+        Updates the set of online players with a console line.
+        :return: The presence event if it changed the set, None otherwise.
+        Vanilla logs "lost connection" and "left the game" for the same leave; only the first one counts.
+        """
+        event: (tuple[str, str], None) = parse_presence(line)
+        if event is None:
+            return None
+        kind, name = event
+        if kind == JOIN and name not in self.online:
+            self.online.add(name)
+        elif kind == LEAVE and name in self.online:
+            self.online.discard(name)
+            if not self.online:
+                self.empty_since = time()
+        else:
+            return None
+        self.events += 1
+        return event
+
+    def reset(self) -> None:
+        """Forgets every player, ie when the server becomes ready."""
+        self.online.clear()
+        self.empty_since = time()
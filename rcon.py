@@ -0,0 +1,216 @@
+import asyncio
+import struct
+from itertools import count
+from time import perf_counter
+
+# Packet types of the Source RCON protocol, which Minecraft implements
+LOGIN: int = 3
+COMMAND: int = 2
+RESPONSE: int = 0
+AUTH_FAILED_ID: int = -1
+# Minecraft splits longer responses into several packets of this payload size
+MAX_FRAGMENT: int = 4096
+# Minecraft answers a packet of unknown type with "Unknown request", after every fragment of the previous replies
+SENTINEL: int = 200
+
+_HEADER: struct.Struct = struct.Struct("<iii")  # length, request id, type
+
+
+def encode_packet(request_id: int, packet_type: int, payload: str) -> bytes:
+    """
+    >>> encode_packet(1, COMMAND, "list")
+    b'\\x0e\\x00\\x00\\x00\\x01\\x00\\x00\\x00\\x02\\x00\\x00\\x00list\\x00\\x00'
+    """
+    body: bytes = payload.encode() + b"\x00\x00"
+    return _HEADER.pack(len(body) + 8, request_id, packet_type) + body
+
+
+async def read_packet(reader: asyncio.StreamReader) -> tuple[int, int, str]:
+    """
+    Reads one packet. Raises asyncio.IncompleteReadError when the connection closes.
+    :return: (request id, type, payload)
+    """
+    length, request_id, packet_type = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    body: bytes = await reader.readexactly(length - 8)
+    return request_id, packet_type, body[:-2].decode(errors="replace")
+
+
+class RconClient:
+    """
+    Keeps one authenticated RCON connection to a server, opened on the first command and again after it drops.
+    Commands are pipelined: several may be in flight at once, each reply is matched to its command by request id.
+    >>> async def example():
+    ...     server = await serve_stand_in("127.0.0.1", 0, "secret", lambda command: f"ran {command}")
+    ...     rcon = RconClient("127.0.0.1", server.sockets[0].getsockname()[1], "secret")
+    ...     replies = await asyncio.gather(rcon.command("list"), rcon.command("time query daytime"))
+    ...     rcon.close()
+    ...     await asyncio.sleep(.1)  # lets the stand-in see the connection close
+    ...     server.close()
+    ...     return replies
+    >>> asyncio.run(example())
+    ['ran list', 'ran time query daytime']
+    """
+
+    def __init__(self, host: str, port: int, password: str, timeout: float = 5.0):
+        """
+        :param host: Address of the server, usually 127.0.0.1 as the bot runs next to it
+        :param port: rcon.port of server.properties
+        :param password: rcon.password of server.properties
+        :param timeout: Seconds to wait for connecting, logging in and every reply
+        """
+        self.host: str = host
+        self.port: int = port
+        self.password: str = password
+        self.timeout: float = timeout
+        self._reader: (asyncio.StreamReader, None) = None
+        self._writer: (asyncio.StreamWriter, None) = None
+        self._read_task: (asyncio.Task, None) = None
+        self._connect_lock: asyncio.Lock = asyncio.Lock()
+        self._ids = count(1)
+        self._pending: dict[int, asyncio.Future] = {}
+        self._fragments: dict[int, list[str]] = {}
+        self._sentinels: dict[int, int] = {}  # sentinel request id: request whose reply it ends
+
+        self.commands: int = 0
+        self.reconnects: int = 0
+        self.last_latency: (float, None) = None  # seconds, of the last command
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    def _next_id(self) -> int:
+        request_id: int = next(self._ids)
+        if request_id >= 2 ** 31 - 1:
+            self._ids = count(1)
+        return request_id
+
+    async def _connect(self) -> None:
+        async with self._connect_lock:
+            if self.connected:
+                return
+            if self._writer is not None:
+                self.reconnects += 1
+            # a timeout here is a plain OSError, not TimeoutError: no command was sent yet, so callers may fall back
+            try:
+                self._reader, self._writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port), self.timeout)
+            except asyncio.TimeoutError:
+                raise OSError(f"Could not connect to RCON at {self.host}:{self.port} within {self.timeout} s")
+            try:
+                self._writer.write(encode_packet(self._next_id(), LOGIN, self.password))
+                await self._writer.drain()
+                request_id, _, _ = await asyncio.wait_for(read_packet(self._reader), self.timeout)
+            except asyncio.TimeoutError:
+                self.close()
+                raise OSError(f"No RCON login reply within {self.timeout} s")
+            except BaseException:
+                self.close()
+                raise
+            if request_id == AUTH_FAILED_ID:
+                self.close()
+                raise PermissionError("RCON password rejected, check rcon.password in server.properties")
+            self._read_task = asyncio.create_task(self._read_replies(self._reader))
+
+    async def _read_replies(self, reader: asyncio.StreamReader) -> None:
+        receiving: (int, None) = None  # request whose last packet was full, so more fragments may follow
+        error: ConnectionError = ConnectionResetError("RCON connection closed")
+        try:
+            while True:
+                request_id, _, payload = await read_packet(reader)
+                if request_id in self._sentinels:
+                    self._resolve(self._sentinels.pop(request_id))
+                    continue
+                # replies come in order, so a packet of another request ends the previous one
+                if receiving is not None and receiving != request_id:
+                    self._resolve(receiving)
+                receiving = None
+                self._fragments.setdefault(request_id, []).append(payload)
+                if len(payload) < MAX_FRAGMENT:
+                    self._resolve(request_id)
+                    continue
+                receiving = request_id
+                if request_id not in self._sentinels.values():
+                    # a reply of exactly MAX_FRAGMENT bytes would otherwise wait for the next command
+                    sentinel_id: int = self._next_id()
+                    self._sentinels[sentinel_id] = request_id
+                    self._writer.write(encode_packet(sentinel_id, SENTINEL, ""))
+        except (asyncio.IncompleteReadError, OSError) as e:
+            error = ConnectionResetError(f"RCON connection lost: {e!r}")
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            self._pending.clear()
+            self._fragments.clear()
+            self._sentinels.clear()
+            self.close()
+
+    def _resolve(self, request_id: int) -> None:
+        future: (asyncio.Future, None) = self._pending.pop(request_id, None)
+        payload: str = "".join(self._fragments.pop(request_id, []))
+        if future is not None and not future.done():
+            future.set_result(payload)
+
+    async def command(self, text: str) -> str:
+        """
+        Runs a command and returns its output.
+        Raises OSError if the server can not be reached or does not answer the login in time,
+        PermissionError if the password is wrong and TimeoutError if the reply takes longer than the timeout.
+        :param text: Command without the leading slash
+        """
+        if not self.connected:
+            await self._connect()
+        start: float = perf_counter()
+        request_id: int = self._next_id()
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            self._writer.write(encode_packet(request_id, COMMAND, text))
+            await self._writer.drain()
+            reply: str = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"No RCON reply to {text!r} within {self.timeout} s")
+        finally:
+            self._pending.pop(request_id, None)
+        self.commands += 1
+        self.last_latency = perf_counter() - start
+        return reply
+
+    def close(self) -> None:
+        """Closes the connection. The next command opens a new one."""
+        if self._read_task is not None and self._read_task is not asyncio.current_task():
+            self._read_task.cancel()
+        self._read_task = None
+        if self._writer is not None:
+            self._writer.close()
+
+
+async def serve_stand_in(host: str, port: int, password: str, handler) -> asyncio.Server:
+    """
+    Local stand-in for a Minecraft RCON server, to try the client without a running server.
+    Replies in order like Minecraft does, splitting long replies into MAX_FRAGMENT sized packets.
+    :param port: 0 picks a free port, read it from server.sockets[0].getsockname()
+    :param handler: Callable turning a command into its reply
+    """
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        logged_in: bool = False
+        try:
+            while True:
+                request_id, packet_type, payload = await read_packet(reader)
+                if packet_type == LOGIN:
+                    logged_in = payload == password
+                    writer.write(encode_packet(request_id if logged_in else AUTH_FAILED_ID, COMMAND, ""))
+                elif logged_in and packet_type == COMMAND:
+                    reply: str = handler(payload)
+                    for start in range(0, max(len(reply), 1), MAX_FRAGMENT):
+                        writer.write(encode_packet(request_id, RESPONSE, reply[start:start + MAX_FRAGMENT]))
+                elif logged_in:
+                    writer.write(encode_packet(request_id, RESPONSE, f"Unknown request {packet_type:x}"))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
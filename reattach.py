@@ -0,0 +1,268 @@
+import asyncio
+import json
+import os
+import signal
+import subprocess
+from collections import deque
+from dataclasses import dataclass, asdict
+from time import monotonic, sleep, strftime
+
+from resources import Isolation
+
+PID_FILE: str = "mcbot.pid"  # written in the server's directory while the bot's process of it runs
+LOG_FILE: str = os.path.join("logs", "latest.log")
+POLL_INTERVAL: float = 0.25  # seconds between looks at a process or log the bot is not the parent of
+
+
+def process_start_time(pid: int) -> (int, None):
+    """
+    Start time of a process in clock ticks since boot, which tells it apart from a later process reusing its PID.
+    None without /proc, or once the process is gone or a zombie.
+    >>> process_start_time(os.getpid()) > 0
+    True
+    """
+    try:
+        with open(f"/proc/{pid}/stat", 'r') as stat_file:
+            # the command name may contain spaces, the fields we need come after its closing parenthesis
+            fields: list[str] = stat_file.read().rpartition(")")[2].split()
+        # state is [0], starttime [19]
+        return None if fields[0] in ("Z", "X") else int(fields[19])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def process_alive(pid: int, started: (int, None)) -> bool:
+    """
+    Whether a process still runs, and is the one which started at started, see process_start_time.
+    Without /proc, only whether some process has that PID.
+    """
+    if os.path.isdir("/proc"):
+        start_time: (int, None) = process_start_time(pid)
+        return start_time is not None and (started is None or start_time == started)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # it exists, but belongs to another user
+    return True
+
+
+@dataclass
+class PidRecord:
+    """What the bot needs to take a running server back after it restarted, saved in PID_FILE as JSON."""
+    pid: int
+    started: (int, None)  # process_start_time of pid
+    argv: list  # unwrapped command line, to restart the server
+    mem_alloc: int  # MB
+    feedback_channel_id: int
+    launched: float  # epoch time
+    isolation: dict  # resources.Isolation, cpus as a list
+
+    @classmethod
+    def of(cls, pid: int, argv: list[str], mem_alloc: int, feedback_channel_id: int, launched: float,
+           isolation: Isolation) -> "PidRecord":
+        confinement: dict = asdict(isolation)
+        confinement["cpus"] = None if isolation.cpus is None else sorted(isolation.cpus)
+        return cls(pid, process_start_time(pid), list(argv), mem_alloc, feedback_channel_id, launched, confinement)
+
+    def confinement(self) -> Isolation:
+        cpus: (list, None) = self.isolation.get("cpus")
+        return Isolation(**{**self.isolation, "cpus": None if cpus is None else set(cpus)})
+
+
+def write_pid_file(directory: str, record: PidRecord) -> None:
+    """Writes the PID file atomically, so a bot killed meanwhile never leaves half of one."""
+    path: str = os.path.join(directory, PID_FILE)
+    with open(path + ".tmp", 'w') as pid_file:
+        json.dump(asdict(record), pid_file)
+    os.replace(path + ".tmp", path)
+
+
+def remove_pid_file(directory: str) -> None:
+    try:
+        os.remove(os.path.join(directory, PID_FILE))
+    except FileNotFoundError:
+        pass
+
+
+def find_running(directory: str) -> (PidRecord, None):
+    """
+    The PID file of a server whose process still runs, None if there is none.
+    A PID file left by a process which is gone, or which can not be read, is removed.
+    """
+    try:
+        with open(os.path.join(directory, PID_FILE), 'r') as pid_file:
+            record: PidRecord = PidRecord(**json.load(pid_file))
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, TypeError):
+        remove_pid_file(directory)
+        return None
+    if not process_alive(record.pid, record.started):
+        remove_pid_file(directory)
+        return None
+    return record
+
+
+class LogTail:
+    """
+    Follows a log file from the end it had when the tail was created, like tail -F.
+    readline blocks until a whole line is written, and returns b"" once alive says the writer is gone and the file
+    was read to its end: StdoutPump reads it like the stdout of a process.
+    """
+
+    def __init__(self, path: str, alive):
+        """
+        :param path: The log file, ie logs/latest.log of a server. It may not exist yet.
+        :param alive: Callable telling whether the process writing the log still runs
+        """
+        self.path: str = path
+        self._alive = alive
+        self._file = None
+        self._partial: bytes = b""
+        self._injected: deque[bytes] = deque()  # lines which did not come from the file, see inject
+        self._closed: bool = False
+        self.start: int = 0
+        self._open(at_end=True)
+
+    def _open(self, at_end: bool) -> None:
+        try:
+            self._file = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        if at_end:
+            self.start = self._file.seek(0, os.SEEK_END)
+
+    def history(self) -> list[str]:
+        """The lines written before the tail started, to catch up with the state of the server."""
+        try:
+            with open(self.path, 'rb') as log:
+                data: bytes = log.read(self.start)
+        except FileNotFoundError:
+            return []
+        return [line.decode(errors="replace").rstrip() for line in data.splitlines()]
+
+    def inject(self, lines: list[str]) -> None:
+        """Makes readline return lines before the next ones of the file. Safe from any thread."""
+        self._injected.extend(line.encode() + b"\n" for line in lines)
+
+    def readline(self) -> bytes:
+        while not self._closed:
+            if self._injected:
+                return self._injected.popleft()
+            # looked at before reading, so the lines written right before the end are still read
+            alive: bool = self._alive()
+            if self._file is None:
+                self._open(at_end=False)
+            line: bytes = self._file.readline() if self._file is not None else b""
+            self._partial += line
+            if self._partial.endswith(b"\n"):
+                line, self._partial = self._partial, b""
+                return line
+            if not alive:
+                line, self._partial = self._partial, b""
+                if not line:
+                    self.close()
+                return line
+            sleep(POLL_INTERVAL)
+        return b""
+
+    def close(self) -> None:
+        self._closed = True
+        if self._file is not None:
+            self._file.close()
+
+
+class RconStdin:
+    """
+    Stands in for the stdin of a process started by a previous run of the bot, whose pipe is gone.
+    Every line written runs as an RCON command, and its reply is injected into the log tail as if the server had
+    printed it, so the replies telemetry and pre-generation wait for still come through the console.
+    Written to from the event loop, like the stdin of ServerInstance.
+    """
+
+    def __init__(self, rcon, tail: LogTail):
+        """
+        :param rcon: Callable returning the RconClient of the server, None when RCON is not enabled
+        :param tail: The tail replies are injected into
+        """
+        self._rcon = rcon
+        self._tail: LogTail = tail
+        self._tasks: set[asyncio.Task] = set()
+
+    def write(self, data: bytes) -> int:
+        """Raises BrokenPipeError when RCON is not enabled, like a closed stdin."""
+        rcon = self._rcon()
+        if rcon is None:
+            raise BrokenPipeError("the stdin of a reattached server is gone, commands need RCON")
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        for mc_command in data.decode().splitlines():
+            if mc_command.strip():
+                task: asyncio.Task = loop.create_task(self._run(rcon, mc_command))
+                # the loop only keeps weak references to tasks
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    async def _run(self, rcon, mc_command: str) -> None:
+        try:
+            reply: str = await rcon.command(mc_command)
+        except (OSError, asyncio.TimeoutError) as e:
+            reply = f"RCON failed to run {mc_command}: {e!r}"
+        prefix: str = f"[{strftime('%H:%M:%S')}] [RCON/INFO]: "
+        self._tail.inject([prefix + line for line in reply.splitlines() if line.strip()])
+
+
+class AttachedProcess:
+    """
+    A server process started by a previous run of the bot, with the parts of subprocess.Popen the bot uses:
+    stdout follows the server's log file and stdin runs commands over RCON.
+    It is no child of this bot, so its exit code can not be read: it is 0 once the process is gone,
+    and the StartupTracker fed from the log tells a stop from a crash.
+    """
+
+    def __init__(self, pid: int, started: (int, None), log_path: str, rcon):
+        """
+        :param pid: PID of the server process
+        :param started: Its process_start_time, None if unknown
+        :param log_path: The log the server writes its console to, see LOG_FILE
+        :param rcon: Callable returning the RconClient of the server, see RconStdin
+        """
+        self.pid: int = pid
+        self.started: (int, None) = started
+        self.returncode: (int, None) = None
+        self.stdout: LogTail = LogTail(log_path, self.alive)
+        self.stdin: RconStdin = RconStdin(rcon, self.stdout)
+
+    def alive(self) -> bool:
+        return process_alive(self.pid, self.started)
+
+    def poll(self) -> (int, None):
+        if self.returncode is None and not self.alive():
+            self.returncode = 0
+        return self.returncode
+
+    def wait(self, timeout: (float, None) = None) -> int:
+        deadline: (float, None) = None if timeout is None else monotonic() + timeout
+        while self.poll() is None:
+            if deadline is not None and monotonic() >= deadline:
+                raise subprocess.TimeoutExpired(str(self.pid), timeout)
+            sleep(POLL_INTERVAL)
+        return self.returncode
+
+    def send_signal(self, signal_number: int) -> None:
+        if self.poll() is None:
+            try:
+                os.kill(self.pid, signal_number)
+            except ProcessLookupError:
+                pass
+
+    def terminate(self) -> None:
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self) -> None:
+        self.send_signal(getattr(signal, "SIGKILL", signal.SIGTERM))
@@ -0,0 +1,287 @@
+import ctypes
+import os
+import platform
+import select
+import sys
+from dataclasses import dataclass
+
+CGROUP_ROOT: str = "/sys/fs/cgroup"
+CPU_PERIOD: int = 100_000  # microseconds, the kernel's default cpu.max period
+# ioprio_set has no wrapper in os, its syscall number depends on the architecture
+_IOPRIO_SET: dict[str, int] = {"x86_64": 251, "aarch64": 30, "i686": 289, "armv7l": 314}
+_IOPRIO_CLASS_BE: int = 2
+_IOPRIO_CLASS_SHIFT: int = 13
+_IOPRIO_WHO_PROCESS: int = 1
+
+
+def parse_cpus(spec: str, available: (set[int], None) = None) -> set[int]:
+    """
+    Parses a CPU list like taskset's. "auto" is every available CPU but the first, which is left to the bot,
+    or the only one of a single CPU host.
+    Raises ValueError for an invalid or empty list.
+    >>> sorted(parse_cpus("1-3,6"))
+    [1, 2, 3, 6]
+    >>> sorted(parse_cpus("auto", {0, 1, 2, 3}))
+    [1, 2, 3]
+    """
+    available = available if available is not None else os.sched_getaffinity(0)
+    if spec == "auto":
+        cpus: set[int] = set(sorted(available)[1:]) or set(available)
+    else:
+        cpus = set()
+        for part in spec.split(","):
+            first, _, last = part.strip().partition("-")
+            cpus.update(range(int(first), int(last or first) + 1))
+    if not cpus:
+        raise ValueError(f"No CPU left in {spec!r}")
+    return cpus
+
+
+def format_cpus(cpus: set[int]) -> str:
+    """
+    The shortest CPU list naming cpus, the inverse of parse_cpus.
+    >>> format_cpus({1, 2, 3, 6})
+    '1-3,6'
+    """
+    ranges: list[str] = []
+    for cpu in sorted(cpus):
+        if ranges and int(ranges[-1].rpartition("-")[2]) == cpu - 1:
+            ranges[-1] = f"{ranges[-1].partition('-')[0]}-{cpu}"
+        else:
+            ranges.append(str(cpu))
+    return ",".join(ranges)
+
+
+def process_scheduling(pid: int) -> tuple[(set[int], None), (int, None)]:
+    """
+    CPUs a process may run on and its nice value, None for what the platform does not tell.
+    Both are read from the process' main thread.
+    """
+    try:
+        cpus: (set[int], None) = os.sched_getaffinity(pid) if hasattr(os, "sched_getaffinity") else None
+        nice: (int, None) = os.getpriority(os.PRIO_PROCESS, pid) if hasattr(os, "getpriority") else None
+    except OSError:
+        return None, None
+    return cpus, nice
+
+
+def cgroup_v2_available() -> bool:
+    """True when the unified cgroup v2 hierarchy is mounted."""
+    return os.path.exists(os.path.join(CGROUP_ROOT, "cgroup.controllers"))
+
+
+def prepare_cgroup(parent: str, name: str, memory_max: (int, None), cpu_limit: (float, None)) -> str:
+    """
+    Creates or updates the cgroup of a server, under a parent the bot may write to
+    (ie a slice delegated to the bot's user by systemd).
+    Raises OSError if cgroups v2 is missing or the bot lacks the rights.
+    :param parent: Parent cgroup, relative to the cgroup root
+    :param name: Name of the server's cgroup
+    :param memory_max: memory.max in MB, None for no limit
+    :param cpu_limit: cpu.max in CPUs, ie 2.5, None for no limit
+    :return: Path of the cgroup directory
+    """
+    if not cgroup_v2_available():
+        raise FileNotFoundError("cgroup v2 is not mounted")
+    parent_path: str = os.path.join(CGROUP_ROOT, parent.strip("/"))
+    os.makedirs(parent_path, exist_ok=True)
+    # controllers must be enabled in the parent before the child gets their files
+    with open(os.path.join(parent_path, "cgroup.subtree_control"), 'w') as subtree_control:
+        subtree_control.write("+memory +cpu")
+
+    path: str = os.path.join(parent_path, name)
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "memory.max"), 'w') as memory_file:
+        memory_file.write(str(memory_max * 1024 * 1024) if memory_max else "max")
+    with open(os.path.join(path, "cpu.max"), 'w') as cpu_file:
+        cpu_file.write(f"{int(cpu_limit * CPU_PERIOD)} {CPU_PERIOD}" if cpu_limit else f"max {CPU_PERIOD}")
+    return path
+
+
+def remove_cgroup(path: str) -> None:
+    """Removes a server's cgroup once its process exited. A cgroup still holding processes is kept."""
+    try:
+        os.rmdir(path)
+    except OSError:
+        pass
+
+
+def _read_keyed(path: str) -> dict[str, int]:
+    values: dict[str, int] = {}
+    try:
+        with open(path, 'r') as keyed:
+            for line in keyed:
+                key, _, value = line.partition(" ")
+                if value.strip().isdigit():
+                    values[key] = int(value)
+    except OSError:
+        pass
+    return values
+
+
+def _read_value(path: str) -> (str, None):
+    try:
+        with open(path, 'r') as single:
+            return single.read().strip()
+    except OSError:
+        return None
+
+
+def cgroup_usage(path: str) -> dict:
+    """
+    Current usage and limits of a cgroup.
+    :return: memory_current and memory_peak in bytes, memory_max and cpu_max as written,
+             memory_events (oom, oom_kill, high, max...) and cpu_stat (usage_usec, nr_throttled, throttled_usec...)
+    """
+    current: (str, None) = _read_value(os.path.join(path, "memory.current"))
+    peak: (str, None) = _read_value(os.path.join(path, "memory.peak"))  # since Linux 5.19
+    return {
+        "memory_current": int(current) if current and current.isdigit() else None,
+        "memory_peak": int(peak) if peak and peak.isdigit() else None,
+        "memory_max": _read_value(os.path.join(path, "memory.max")),
+        "cpu_max": _read_value(os.path.join(path, "cpu.max")),
+        "memory_events": _read_keyed(os.path.join(path, "memory.events")),
+        "cpu_stat": _read_keyed(os.path.join(path, "cpu.stat")),
+    }
+
+
+def set_ionice(level: int) -> bool:
+    """
+    Sets the best-effort I/O priority of the calling process, 0 (highest) to 7 (lowest).
+    :return: False where ioprio_set is unknown or refused
+    """
+    number: (int, None) = _IOPRIO_SET.get(platform.machine())
+    if number is None:
+        return False
+    libc = ctypes.CDLL(None, use_errno=True)
+    priority: int = (_IOPRIO_CLASS_BE << _IOPRIO_CLASS_SHIFT) | level
+    return libc.syscall(number, _IOPRIO_WHO_PROCESS, 0, priority) == 0
+
+
+def wrap_command(argv: list[str], cgroup: (str, None) = None, cpus: (set[int], None) = None,
+                 nice: (int, None) = None, ionice: (int, None) = None, status: (int, None) = None) -> list[str]:
+    """
+    Wraps a command line so the process joins its cgroup and gets its affinity and priorities before it execs.
+    Done before the JVM starts, as affinity and nice are per thread and the JVM starts dozens of them right away.
+    :param status: Write end of a pipe inherited by the process, receiving what it could not apply, see read_status
+    >>> wrap_command(["java", "-jar", "server.jar"], cpus={1, 2}, nice=5)[2:]
+    ['--cpus', '1,2', '--nice', '5', '--', 'java', '-jar', 'server.jar']
+    """
+    options: list[str] = []
+    if cgroup is not None:
+        options += ["--cgroup", cgroup]
+    if cpus:
+        options += ["--cpus", ",".join(map(str, sorted(cpus)))]
+    if nice is not None:
+        options += ["--nice", str(nice)]
+    if ionice is not None:
+        options += ["--ionice", str(ionice)]
+    if not options:
+        return argv
+    if status is not None:
+        options += ["--status", str(status)]
+    # by path, the process starts in the server's directory where -m would not find this module
+    return [sys.executable, os.path.abspath(__file__), *options, "--", *argv]
+
+
+@dataclass
+class Isolation:
+    """How a server process is confined, decided at every launch."""
+    cgroup: (str, None) = None  # cgroup directory, None when limits are off or cgroups v2 is unavailable
+    cpus: (set, None) = None  # CPUs the process may run on, None for every CPU
+    nice: (int, None) = None
+    ionice: (int, None) = None
+    fallback: (str, None) = None  # why configured limits are not enforced
+
+    def wrap(self, argv: list[str], status: (int, None) = None) -> list[str]:
+        """The command line to start instead of argv, see wrap_command."""
+        return wrap_command(argv, self.cgroup, self.cpus, self.nice, self.ionice, status)
+
+
+def isolate(name: str, parent: str, memory_limit: (int, None), cpu_limit: (float, None),
+            cpu_affinity: (str, None), nice: (int, None), ionice: (int, None)) -> Isolation:
+    """
+    Prepares the confinement of a server before its launch.
+    Without cgroups v2, or without the rights to its parent, only the affinity and priorities are applied.
+    :param name: Name of the server, and of its cgroup
+    :param parent: Parent cgroup, see prepare_cgroup
+    :param memory_limit: memory.max in MB
+    :param cpu_limit: cpu.max in CPUs
+    :param cpu_affinity: CPU list, see parse_cpus
+    """
+    if not hasattr(os, "sched_setaffinity"):
+        configured: bool = any(value is not None for value in (memory_limit, cpu_limit, cpu_affinity, nice, ionice))
+        return Isolation(fallback="resource limits need Linux" if configured else None)
+    isolation: Isolation = Isolation(cpus=parse_cpus(cpu_affinity) if cpu_affinity else None,
+                                     nice=nice, ionice=ionice)
+    if memory_limit is not None or cpu_limit is not None:
+        try:
+            isolation.cgroup = prepare_cgroup(parent, name, memory_limit, cpu_limit)
+        except OSError as e:
+            isolation.fallback = f"no cgroup ({e.strerror or e}), affinity and nice only"
+    return isolation
+
+
+def read_status(fd: int, timeout: float = 10.0) -> list[str]:
+    """
+    Reads what the wrapper of wrap_command could not apply from its status pipe, and closes it.
+    The wrapper closes the pipe before it execs, so this blocks until then: call it off the event loop.
+    :param fd: Read end of the pipe
+    :param timeout: Seconds the wrapper gets, the limits are assumed applied after
+    >>> reading, writing = os.pipe()
+    >>> _ = os.write(writing, b"no nice value (Permission denied)\\n"); os.close(writing)
+    >>> read_status(reading)
+    ['no nice value (Permission denied)']
+    """
+    data: bytes = b""
+    try:
+        while select.select([fd], [], [], timeout)[0]:
+            chunk: bytes = os.read(fd, 4096)
+            if not chunk:
+                break
+            data += chunk
+    except OSError:
+        pass  # what was read so far is reported
+    finally:
+        os.close(fd)
+    return data.decode(errors="replace").splitlines()
+
+
+def _exec_wrapped(args: list[str]) -> None:
+    """
+    Applies the options of wrap_command to this process, then replaces it with the command.
+    A limit which can not be applied is reported through the status pipe, or stderr without one,
+    and the server still starts.
+    """
+    separator: int = args.index("--")
+    options: dict[str, str] = dict(zip(args[:separator:2], args[1:separator:2]))
+    command: list[str] = args[separator + 1:]
+    failures: list[str] = []
+    if "--cgroup" in options:
+        try:
+            with open(os.path.join(options["--cgroup"], "cgroup.procs"), 'w') as procs:
+                procs.write(str(os.getpid()))
+        except OSError as e:
+            failures.append(f"cgroup not joined ({e.strerror or e})")
+    if "--cpus" in options:
+        try:
+            os.sched_setaffinity(0, parse_cpus(options["--cpus"]))
+        except OSError as e:
+            failures.append(f"no CPU affinity ({e.strerror or e})")
+    if "--nice" in options:
+        try:
+            os.setpriority(os.PRIO_PROCESS, 0, int(options["--nice"]))
+        except OSError as e:
+            failures.append(f"no nice value ({e.strerror or e})")
+    if "--ionice" in options and not set_ionice(int(options["--ionice"])):
+        failures.append("no I/O priority")
+    if "--status" in options:
+        with os.fdopen(int(options["--status"]), 'w') as status:
+            status.writelines(failure + "\n" for failure in failures)
+    elif failures:
+        print(f"Limits not enforced: {', '.join(failures)}", file=sys.stderr)
+    os.execvp(command[0], command)
+
+
+if __name__ == "__main__":
+    _exec_wrapped(sys.argv[1:])
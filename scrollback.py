@@ -0,0 +1,123 @@
+import mmap
+import os
+import re
+
+NEWLINE: int = ord("\n")
+
+
+class ByteRing:
+    """
+    Fixed-memory scrollback of console lines, stored as UTF-8 in a single bytearray.
+    When full, the oldest whole lines are dropped to make room.
+    >>> ring = ByteRing(16)
+    >>> for line in ("first", "second", "third"):
+    ...     ring.append(line)
+    >>> ring.lines()
+    ['second', 'third']
+    """
+
+    def __init__(self, capacity: int = 1024 * 1024):
+        """
+        :param capacity: Size of the buffer in bytes
+        """
+        self.capacity: int = capacity
+        self._buffer: bytearray = bytearray(capacity)
+        self._head: int = 0  # offset of the oldest byte
+        self._size: int = 0
+        self.count: int = 0  # lines currently held
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _drop_oldest(self) -> None:
+        # the oldest line ends at the first newline after head, which may wrap around the end of the buffer
+        end: int = self._buffer.find(NEWLINE, self._head, min(self.capacity, self._head + self._size))
+        if end == -1:
+            end = self._buffer.find(NEWLINE, 0, self._head + self._size - self.capacity) + self.capacity
+        dropped: int = end - self._head + 1
+        self._head = (self._head + dropped) % self.capacity
+        self._size -= dropped
+        self.count -= 1
+
+    def append(self, line: str) -> None:
+        """Stores a line, truncated to the capacity if it is longer than the whole buffer."""
+        data: bytes = line.encode(errors="replace")[:self.capacity - 1] + b"\n"
+        while self._size + len(data) > self.capacity:
+            self._drop_oldest()
+
+        tail: int = (self._head + self._size) % self.capacity
+        first: int = min(len(data), self.capacity - tail)
+        self._buffer[tail:tail + first] = data[:first]
+        self._buffer[:len(data) - first] = data[first:]
+        self._size += len(data)
+        self.count += 1
+
+    def extend(self, lines: list[str]) -> None:
+        for line in lines:
+            self.append(line)
+
+    def _contents(self) -> bytes:
+        end: int = self._head + self._size
+        if end <= self.capacity:
+            return bytes(self._buffer[self._head:end])
+        return bytes(self._buffer[self._head:]) + bytes(self._buffer[:end - self.capacity])
+
+    def lines(self, count: (int, None) = None, pattern: (re.Pattern, None) = None) -> list[str]:
+        """
+        The newest lines, oldest first.
+        :param count: Maximum amount of lines. None returns every line.
+        :param pattern: Only lines matching this regular expression
+        """
+        return matching(self._contents().decode(errors="replace").split("\n")[:-1], count, pattern)
+
+
+def matching(lines: list[str], count: (int, None) = None, pattern: (re.Pattern, None) = None) -> list[str]:
+    """
+    The last count lines matching pattern, oldest first.
+    >>> matching(["Steve joined the game", "Alex joined the game", "<Steve> hi"], 1, re.compile("joined"))
+    ['Alex joined the game']
+    """
+    if pattern is not None:
+        lines = [line for line in lines if pattern.search(line)]
+    return lines if count is None else lines[-count:] if count else []
+
+
+def tail_file(path: str, count: int, pattern: (re.Pattern, None) = None,
+              max_scan: int = 64 * 1024 * 1024) -> tuple[list[str], bool]:
+    """
+    Reads a file backwards through mmap, returning its last lines without reading the whole file.
+    Blocks, so call it off the event loop.
+    :param path: Path of the log file, ie logs/latest.log
+    :param count: Maximum amount of lines
+    :param pattern: Only lines matching this regular expression
+    :param max_scan: Bytes scanned from the end at most, so a huge log can not stall the bot
+    :return: (lines oldest first, whether the scan stopped at max_scan before reaching the start of the file)
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile('w', suffix=".log", delete=False) as log:
+    ...     _ = log.write("[18:03:10] [Server thread/INFO]: Done (12.3s)!\\n"
+    ...                   "[18:03:11] [Server thread/INFO]: Steve joined the game\\n"
+    ...                   "[18:03:40] [Server thread/INFO]: Alex joined the game\\n"
+    ...                   "[18:04:02] [Server thread/INFO]: <Steve> hi\\n")
+    >>> tail_file(log.name, 2, re.compile("Steve"))
+    (['[18:03:11] [Server thread/INFO]: Steve joined the game', '[18:04:02] [Server thread/INFO]: <Steve> hi'], False)
+    >>> os.remove(log.name)
+    """
+    if os.path.getsize(path) == 0 or count <= 0:
+        return [], False
+    lines: list[str] = []
+    with open(path, 'rb') as log, mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        end: int = len(mapped)
+        if mapped[end - 1] == NEWLINE:
+            end -= 1
+        limit: int = max(0, len(mapped) - max_scan)
+        while end > limit and len(lines) < count:
+            start: int = mapped.rfind(b"\n", limit, end) + 1
+            if start == 0 and limit > 0:
+                break  # the line starts before the scan limit
+            line: str = mapped[start:end].decode(errors="replace").rstrip("\r")
+            if pattern is None or pattern.search(line):
+                lines.append(line)
+            end = start - 1
+        truncated: bool = len(lines) < count and limit > 0
+    lines.reverse()
+    return lines, truncated
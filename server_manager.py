@@ -0,0 +1,308 @@
+import asyncio
+import os
+import re
+import subprocess
+from dataclasses import dataclass, field
+from sys import builtin_module_names
+from time import time
+
+from batch import BatchJob
+from assistant_functions import StdoutPump, config_store, host_memory_mb
+from config_store import DEFAULT_SERVER
+from presence import PresenceTracker
+from rcon import RconClient
+from reattach import AttachedProcess, PidRecord, write_pid_file, remove_pid_file
+from resources import Isolation, read_status
+from scrollback import ByteRing
+from server_state import StartupTracker
+from supervisor import RestartState
+from telemetry import TelemetrySampler
+
+ON_POSIX: bool = 'posix' in builtin_module_names
+
+
+async def wait_exit(proc: subprocess.Popen, timeout: (float, None)) -> (int, None):
+    """
+    Waits for a process to exit off the event loop, reaping it.
+    :return: The exit code, None if the process still runs after timeout seconds.
+    """
+    try:
+        return await asyncio.to_thread(proc.wait, timeout)
+    except subprocess.TimeoutExpired:
+        return None
+
+
+@dataclass
+class ServerInstance:
+    """Everything the bot keeps about one Minecraft server: its process, stdout pump, feedback channel and state."""
+    name: str
+    proc: (subprocess.Popen, AttachedProcess, None) = None
+    pump: (StdoutPump, None) = None
+    tracker: (StartupTracker, None) = None
+    telemetry: (TelemetrySampler, None) = None
+    presence: (PresenceTracker, None) = None
+    idle_task: (asyncio.Task, None) = None  # closes the server once it stayed empty for the grace period
+    scrollback: ByteRing = field(default_factory=ByteRing)  # kept across launches, to look at a crash
+    waiters: list = field(default_factory=list)  # (pattern, future) resolved by the next matching console line
+    backup_lock: asyncio.Lock = field(default_factory=asyncio.Lock)  # one backup or restore at a time
+    launch_lock: asyncio.Lock = field(default_factory=asyncio.Lock)  # held from the running check to the start
+    rcon: (RconClient, None) = None  # persistent RCON connection of the running process, if it enables RCON
+    supervisor_task: (asyncio.Task, None) = None  # awaits the exit of the running process
+    restart_task: (asyncio.Task, None) = None  # waits out the backoff before an automatic restart
+    restart_state: RestartState = field(default_factory=RestartState)
+    stop_requested: bool = False  # the bot asked the running process to stop
+    stop_signal: (str, None) = None  # how the last requested stop ended: stop, SIGTERM or SIGKILL
+    launch_spec: (tuple, None) = None  # (argv, cwd, mem_alloc) of the last launch, to restart it
+    batch: (BatchJob, None) = None  # the mc!run script being streamed into the server
+    isolation: Isolation = field(default_factory=Isolation)  # cgroup, affinity and priorities of the running process
+    isolation_status: (int, None) = None  # read end of the exec wrapper's status pipe, see confirm_isolation
+    feedback_channel_id: int = 0
+    latest_launch: float = 0.0
+    mem_alloc: int = 0  # -Xmx of the running process, in MB
+    launches: int = 0
+
+    @property
+    def running(self) -> bool:
+        return self.proc is not None
+
+    @property
+    def restarts(self) -> int:
+        """Launches after the first one since the bot started."""
+        return max(0, self.launches - 1)
+
+    @property
+    def uptime(self) -> float:
+        """Seconds since the running process was launched, 0 if it is not running."""
+        return time() - self.latest_launch if self.running else 0.0
+
+    @property
+    def label(self) -> str:
+        """Prefix of relayed lines, so servers sharing a channel can be told apart."""
+        return "" if self.name == DEFAULT_SERVER else f"[{self.name}] "
+
+    def start(self, argv: list[str], cwd: str, mem_alloc: int, feedback_channel_id: int,
+              isolation: (Isolation, None) = None) -> None:
+        """
+        Starts the server process and its stdout pump.
+        :param argv: Full command line, ie java -Xmx... -jar server.jar
+        :param cwd: Directory of the server
+        :param mem_alloc: -Xmx given in argv, in MB
+        :param feedback_channel_id: The channel receiving the server's output
+        :param isolation: Cgroup, affinity and priorities applied before the JVM starts, see resources.isolate
+        """
+        self.isolation = isolation or Isolation()
+        # a wrapped command tells through this pipe which limits it could not apply
+        status_read, status_write = os.pipe() if self.isolation.wrap(argv) != argv else (None, None)
+        try:
+            # start a popen subprocess, meaning we are able to manipulate it later on.
+            # in its own session, a Ctrl+C or a restart of the bot does not take the server down with it
+            self.proc = subprocess.Popen(self.isolation.wrap(argv, status_write),
+                                         cwd=cwd,
+                                         stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE,
+                                         close_fds=ON_POSIX,
+                                         pass_fds=() if status_write is None else (status_write,),
+                                         start_new_session=ON_POSIX)
+        except BaseException:
+            if status_read is not None:
+                os.close(status_read)
+            raise
+        finally:
+            if status_write is not None:
+                os.close(status_write)
+        self.isolation_status = status_read
+        self._follow(argv, cwd, mem_alloc, feedback_channel_id, time())
+        # follows the startup through stdout, its startup_time is the measured time to ready
+        self.tracker = StartupTracker(self.latest_launch)
+        try:
+            # the next run of the bot takes the server back from it, see attach
+            write_pid_file(cwd, PidRecord.of(self.proc.pid, argv, mem_alloc, feedback_channel_id,
+                                             self.latest_launch, self.isolation))
+        except OSError as e:
+            print(f"{self.label}PID file not written, the server can not be reattached: {e!r}")
+
+    async def confirm_isolation(self) -> None:
+        """
+        Waits until the exec wrapper applied the isolation of the process just started,
+        adding the limits it could not apply to isolation.fallback.
+        """
+        status, self.isolation_status = self.isolation_status, None
+        if status is None:
+            return
+        failures: list[str] = await asyncio.to_thread(read_status, status)
+        if failures:
+            self.isolation.fallback = ", ".join(filter(None, (self.isolation.fallback, *failures)))
+
+    def attach(self, proc: AttachedProcess, record: PidRecord, cwd: str, history: list[str]) -> None:
+        """
+        Takes back a server process started by a previous run of the bot, found through its PID file.
+        Its log up to now is replayed into the tracker and presence, so they know whether it is ready and who is on.
+        :param proc: The process, following the server's log
+        :param record: Its PID file
+        :param cwd: Directory of the server
+        :param history: The lines of its log before proc follows it, see LogTail.history
+        """
+        self.isolation = record.confinement()
+        self.proc = proc
+        self._follow(record.argv, cwd, record.mem_alloc, record.feedback_channel_id, record.launched)
+        self.tracker = StartupTracker(self.latest_launch)
+        for line in history:
+            self.tracker.feed(line)
+            self.presence.feed(line)
+
+    def _follow(self, argv: list[str], cwd: str, mem_alloc: int, feedback_channel_id: int, launched: float) -> None:
+        """Starts the stdout pump and the state kept about a process which was just started or attached."""
+        # a single reader for the whole lifetime of the process, drained by server_feedback
+        self.pump = StdoutPump(self.proc)
+        self.pump.start()
+
+        self.feedback_channel_id = feedback_channel_id
+        self.mem_alloc = mem_alloc
+        self.launch_spec = (argv, cwd, mem_alloc)
+        self.stop_requested, self.stop_signal = False, None
+        self.latest_launch = launched
+        self.launches += 1
+        self.telemetry = TelemetrySampler(self.proc.pid)
+        self.presence = PresenceTracker()
+
+    def send_command(self, mc_command: str) -> None:
+        """
+        Writes a minecraft command to the server's stdin.
+        :param mc_command: Command without the leading slash or trailing newline
+        """
+        self.proc.stdin.write(mc_command.encode() + b'\n')
+        self.proc.stdin.flush()
+
+    def send_commands(self, mc_commands: list[str]) -> None:
+        """Writes several minecraft commands to the server's stdin with a single write and flush."""
+        self.proc.stdin.write("".join(mc_command + "\n" for mc_command in mc_commands).encode())
+        self.proc.stdin.flush()
+
+    def expect(self, pattern: re.Pattern) -> asyncio.Future:
+        """
+        Returns a future resolved with the next console line matching pattern, as server_feedback reads it.
+        Create it before sending the command whose reply is awaited, so a fast reply is not missed.
+        >>> async def save(instance):
+        ...     saved = instance.expect(re.compile(r"\\]: Saved the game"))
+        ...     # instance.send_command("save-all flush"), then server_feedback feeds the reply:
+        ...     instance.feed_waiters("[18:03:11] [Server thread/INFO]: Saved the game")
+        ...     return await asyncio.wait_for(saved, 60)
+        >>> asyncio.run(save(ServerInstance("survival")))
+        '[18:03:11] [Server thread/INFO]: Saved the game'
+        """
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.waiters.append((pattern, future))
+        return future
+
+    def feed_waiters(self, line: str) -> None:
+        """Resolves the futures waiting for this line, and forgets the ones which were cancelled."""
+        if not self.waiters:
+            return
+        pending: list = []
+        for pattern, future in self.waiters:
+            if future.done():
+                continue
+            if pattern.search(line):
+                future.set_result(line)
+            else:
+                pending.append((pattern, future))
+        self.waiters = pending
+
+    def request_stop(self) -> None:
+        """Sends stop to the server. The process is only forgotten once it exited, see detach."""
+        self.tracker.stopping()
+        self.stop_requested = True
+        try:
+            self.send_command("stop")
+        except OSError:
+            pass  # the process already died and closed its stdin, its supervisor reports the exit
+
+    async def shutdown(self, stop_timeout: float, term_timeout: float) -> str:
+        """
+        Stops the server, escalating from the stop command to SIGTERM and then SIGKILL
+        when the process does not exit in time. The exit itself is reported by the supervisor.
+        :param stop_timeout: Seconds the server gets to save and exit after stop
+        :param term_timeout: Seconds the JVM gets to exit after SIGTERM
+        :return: What ended the process: stop, SIGTERM or SIGKILL
+        """
+        proc: subprocess.Popen = self.proc
+        self.request_stop()
+        self.stop_signal = "stop"
+        if await wait_exit(proc, stop_timeout) is None:
+            self.stop_signal = "SIGTERM"
+            proc.terminate()
+            if await wait_exit(proc, term_timeout) is None:
+                self.stop_signal = "SIGKILL"
+                proc.kill()
+                await wait_exit(proc, None)
+        return self.stop_signal
+
+    def detach(self) -> None:
+        """Forgets the process and stops the pump. The tracker is kept so its final state can still be read."""
+        if self.pump is not None:
+            self.pump.stop()
+        if self.rcon is not None:
+            self.rcon.close()
+            self.rcon = None
+        if self.launch_spec is not None:
+            remove_pid_file(self.launch_spec[1])
+        self.proc, self.pump = None, None
+        self.mem_alloc = 0
+
+
+class ServerManager:
+    """
+    Registry of server instances keyed by name. Instances are created on first use for every configured server.
+    >>> manager = ServerManager()
+    >>> manager.get().running
+    False
+    """
+
+    def __init__(self):
+        self._instances: dict[str, ServerInstance] = {}
+        # held from check_memory until the process started, so two launches can not both pass the check
+        self.memory_lock: asyncio.Lock = asyncio.Lock()
+
+    def names(self) -> list[str]:
+        """Names of every configured server, the default one first."""
+        return [DEFAULT_SERVER, *config_store.config.servers]
+
+    def get(self, name: str = DEFAULT_SERVER) -> ServerInstance:
+        """
+        Returns the instance of a server. Raises KeyError if no such server is configured.
+        """
+        if name not in self._instances:
+            config_store.config.server(name)  # raises KeyError for unknown servers
+            self._instances[name] = ServerInstance(name, scrollback=ByteRing(config_store.config.scrollback_bytes))
+        return self._instances[name]
+
+    def split_name(self, args: tuple) -> tuple[str, tuple]:
+        """
+        Splits a command's arguments into the server name and the rest.
+        Without a known name, the default server is used.
+        >>> manager = ServerManager()
+        >>> manager.split_name((DEFAULT_SERVER, "4096"))
+        ('default', ('4096',))
+        >>> manager.split_name(("unknown", "4096"))
+        ('default', ('unknown', '4096'))
+        """
+        if args and args[0] in self.names():
+            return args[0], args[1:]
+        return DEFAULT_SERVER, args
+
+    def running(self) -> list[ServerInstance]:
+        return [instance for instance in self._instances.values() if instance.running]
+
+    def reserved_memory(self) -> int:
+        """Sum of -Xmx over every running server, in MB."""
+        return sum(instance.mem_alloc for instance in self.running())
+
+    def check_memory(self, mem_alloc: int) -> None:
+        """
+        Raises MemoryError if launching a server with mem_alloc MB would reserve more than the host's RAM.
+        Does nothing when the host's RAM is unknown.
+        """
+        host_memory: (int, None) = host_memory_mb()
+        if host_memory is not None and self.reserved_memory() + mem_alloc > host_memory:
+            raise MemoryError(f"{self.reserved_memory()} MB reserved, {mem_alloc} MB requested, "
+                              f"{host_memory} MB on host")
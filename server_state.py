@@ -0,0 +1,133 @@
+import re
+from enum import Enum
+from time import time
+
+
+class ServerState(Enum):
+    Launching =                  "launching"
+    LoadingWorld =               "loading world"
+    Ready =                      "ready"
+    Stopping =                   "stopping"
+    Stopped =                    "stopped"
+    Crashed =                    "crashed"
+
+
+# "[12:00:00] [Server thread/INFO]: ", "[12:00:00 INFO]: " or Forge's "[...] [Server thread/INFO] [minecraft/...]: ".
+# Messages are matched right after it, so chat ("]: <Steve> Stopping the server") never changes the state.
+_HEADER: str = r"^\[[^\]]*\](?: \[[^\]]*\])*: "
+_DONE_PATTERN: re.Pattern = re.compile(_HEADER + r"Done \((?P<seconds>[\d.,]+)s\)!")
+_LOADING_PATTERN: re.Pattern = re.compile(_HEADER + r"Preparing (level|start region)")
+_PROGRESS_PATTERN: re.Pattern = re.compile(_HEADER + r"(Preparing spawn area|Loading terrain)"
+                                                     r"[^\d]*(?P<percent>\d{1,3})%")
+_STOPPING_PATTERN: re.Pattern = re.compile(_HEADER + r"Stopping (the )?server")
+_FATAL_PATTERN: re.Pattern = re.compile(_HEADER + r"(Exception in server tick loop"
+                                        r"|Encountered an unexpected exception"
+                                        r"|Failed to start the minecraft server"
+                                        r"|This crash report has been saved to"
+                                        r"|\*\*\*\* FAILED TO BIND TO PORT)"
+                                        # the JVM's own lines have no header
+                                        r"|^(" + _HEADER[1:] + r")?(Exception in thread \"[^\"]*\" )?"
+                                        r"java\.lang\.OutOfMemoryError"
+                                        r"|^(Error: )?(Error occurred during initialization of VM"
+                                        r"|Unable to access jarfile)")
+
+class StartupTracker:
+    """
+    State machine following a server from launch to ready, driven by its stdout lines.
+    launching -> loading world -> ready -> stopping -> stopped, or crashed from any state.
+    >>> tracker = StartupTracker(launched_at=time() - 14.2)
+    >>> tracker.feed('[12:00:00] [Server thread/INFO]: Done (14.212s)! For help, type "help"')
+    'Server is ready. Started in 14.2 s.'
+    >>> tracker.state
+    <ServerState.Ready: 'ready'>
+    >>> tracker.feed("[12:00:05] [Server thread/INFO]: <Steve> Exception in server tick loop")
+    >>> tracker.feed("[12:00:06] [Server thread/INFO]: [Not Secure] <Steve> Stopping the server now?")
+    >>> tracker.state
+    <ServerState.Ready: 'ready'>
+    >>> tracker.feed("[12:00:07] [Server thread/INFO]: Stopping the server")
+    'Server is stopping...'
+    """
+
+    def __init__(self, launched_at: (float, None) = None):
+        """
+        :param launched_at: Epoch time of the launch. Defaults to now.
+        """
+        self.state: ServerState = ServerState.Launching
+        self.launched_at: float = launched_at if launched_at is not None else time()
+        self.ready_at: (float, None) = None
+        self.progress: int = 0
+        self.reported_startup: (float, None) = None  # the seconds in the server's own "Done" line
+        self.exit_code: (int, None) = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state is ServerState.Ready
+
+    @property
+    def starting(self) -> bool:
+        return self.state in (ServerState.Launching, ServerState.LoadingWorld)
+
+    @property
+    def startup_time(self) -> (float, None):
+        """Seconds from launch until the server reported it is done. None until ready."""
+        return None if self.ready_at is None else self.ready_at - self.launched_at
+
+    def feed(self, line: str) -> (str, None):
+        """
+        Advances the state machine with a stdout line.
+        :param line: A single console line.
+        :return: A message to post about the state change or progress, None otherwise.
+        """
+        if self.state in (ServerState.Stopped, ServerState.Crashed):
+            return None
+
+        if _FATAL_PATTERN.search(line):
+            self.state = ServerState.Crashed
+            return f"Server crashed while {'starting' if self.ready_at is None else 'running'}: {line.strip()}"
+
+        if self.starting:
+            done: (re.Match, None) = _DONE_PATTERN.search(line)
+            if done:
+                self.state = ServerState.Ready
+                self.ready_at = time()
+                self.reported_startup = float(done.group("seconds").replace(",", "."))
+                return f"Server is ready. Started in {self.startup_time:.1f} s."
+
+            progress: (re.Match, None) = _PROGRESS_PATTERN.search(line)
+            if progress:
+                self.state = ServerState.LoadingWorld
+                percent: int = int(progress.group("percent"))
+                # vanilla prints the same percentage several times, only report steps forward
+                if percent <= self.progress:
+                    return None
+                self.progress = percent
+                return f"Loading world: {percent}%"
+
+            if self.state is ServerState.Launching and _LOADING_PATTERN.search(line):
+                self.state = ServerState.LoadingWorld
+                return "Loading world..."
+            return None
+
+        if _STOPPING_PATTERN.search(line):
+            self.state = ServerState.Stopping
+            return "Server is stopping..."
+        return None
+
+    def stopping(self) -> None:
+        """Marks a requested stop, so the following exit is not taken for a crash."""
+        if self.state not in (ServerState.Stopped, ServerState.Crashed):
+            self.state = ServerState.Stopping
+
+    def process_exited(self, exit_code: int) -> str:
+        """
+        Records the exit of the server process.
+        :param exit_code: Return code of the process.
+        :return: A message to post about the exit.
+        """
+        self.exit_code = exit_code
+        # a stop that had to be forced with a signal is still a stop, not a crash
+        if self.state is ServerState.Stopping:
+            self.state = ServerState.Stopped
+            return "Server stopped." if exit_code == 0 else f"Server stopped with code {exit_code}."
+        self.state = ServerState.Crashed
+        return f"Server process exited unexpectedly with code {exit_code}."
@@ -0,0 +1,105 @@
+import asyncio
+from dataclasses import dataclass, field
+from time import monotonic
+
+from metrics import STATUS_QUERY_SECONDS, STATUS_QUERY_ERRORS
+
+
+@dataclass
+class StatusResult:
+    """The last answer of a server, with the moment it was fetched."""
+    online: int
+    latency: float
+    player_names: list[str] = field(default_factory=list)
+    fetched_at: float = field(default_factory=monotonic)
+
+    @property
+    def age(self) -> float:
+        """Seconds since this result was fetched."""
+        return monotonic() - self.fetched_at
+
+
+class StatusService:
+    """
+    Non-blocking status queries with a short-lived cache.
+    Concurrent requests for the same address share a single in-flight query.
+    >>> service = StatusService(ttl=10.0)
+    >>> service._cache["127.0.0.1"] = StatusResult(online=2, latency=12.5)  # as if queried just now
+    >>> result = asyncio.run(service.get("127.0.0.1"))
+    >>> result.online, service.queries, service.cache_hits
+    (2, 0, 1)
+    """
+
+    def __init__(self, ttl: float = 10.0, timeout: float = 3.0, use_query: bool = False):
+        """
+        :param ttl: Seconds a result is served from cache before querying again.
+        :param timeout: Seconds before a lookup, status or query gives up, raising TimeoutError.
+        :param use_query: Also use the query protocol (enable-query in server.properties) for the player names.
+        """
+        self.ttl: float = ttl
+        self.timeout: float = timeout
+        self.use_query: bool = use_query
+        self._cache: dict[str, StatusResult] = {}
+        self._in_flight: dict[str, asyncio.Future] = {}
+
+        self.queries: int = 0
+        self.cache_hits: int = 0
+        self.coalesced: int = 0
+
+    def cached(self, address: str) -> (StatusResult, None):
+        """Returns the last result for the address no matter its age, None if it was never fetched."""
+        return self._cache.get(address)
+
+    async def get(self, address: str, max_age: (float, None) = None) -> StatusResult:
+        """
+        Returns the status of the server, from cache when it is fresh enough.
+        :param address: Address of the server, as given to JavaServer.lookup
+        :param max_age: Oldest acceptable cached result in seconds. Defaults to the service's ttl.
+        :return: StatusResult. Raises TimeoutError, ConnectionRefusedError or OSError if the server does not answer.
+        """
+        max_age = self.ttl if max_age is None else max_age
+        cached: (StatusResult, None) = self._cache.get(address)
+        if cached is not None and cached.age <= max_age:
+            self.cache_hits += 1
+            return cached
+
+        in_flight: (asyncio.Future, None) = self._in_flight.get(address)
+        if in_flight is not None:
+            self.coalesced += 1
+            # shield, so a cancelled caller does not cancel the query of everyone else
+            return await asyncio.shield(in_flight)
+
+        task: asyncio.Task = asyncio.ensure_future(self._fetch(address))
+        self._in_flight[address] = task
+        task.add_done_callback(lambda _: self._in_flight.pop(address, None))
+        return await asyncio.shield(task)
+
+    async def _fetch(self, address: str) -> StatusResult:
+        self.queries += 1
+        try:
+            with STATUS_QUERY_SECONDS.time():
+                return await self._query(address)
+        except Exception:
+            STATUS_QUERY_ERRORS.inc()
+            raise
+
+    async def _query(self, address: str) -> StatusResult:
+        # mcstatus is only imported by the first query, it weighs on the bot's startup otherwise
+        from mcstatus import JavaServer
+
+        server: JavaServer = await asyncio.wait_for(JavaServer.async_lookup(address, timeout=self.timeout),
+                                                    self.timeout)
+        status = await asyncio.wait_for(server.async_status(), self.timeout)
+        names: list[str] = [player.name for player in (status.players.sample or [])]
+
+        if self.use_query and status.players.online:
+            try:
+                query = await asyncio.wait_for(server.async_query(), self.timeout)
+                names = list(query.players.names)
+            except (TimeoutError, ConnectionError, OSError):
+                pass  # query is optional, keep the sample of the status
+
+        result: StatusResult = StatusResult(online=status.players.online, latency=status.latency,
+                                            player_names=names)
+        self._cache[address] = result
+        return result
@@ -0,0 +1,65 @@
+from collections import deque
+from dataclasses import dataclass, field
+from time import monotonic
+
+NEVER: str = "never"
+ON_CRASH: str = "on-crash"
+ALWAYS: str = "always"
+RESTART_MODES: tuple = (NEVER, ON_CRASH, ALWAYS)
+
+
+@dataclass
+class RestartPolicy:
+    """When a server that exited on its own is launched again, read from config."""
+    mode: str = NEVER  # never, on-crash, or always (also after a stop from inside the game)
+    backoff: float = 10.0  # seconds before the first restart, doubled after every restart
+    backoff_max: float = 300.0
+    max_crashes: int = 5  # crashes within window which stop restarting
+    window: float = 600.0  # seconds; a run at least this long resets the backoff
+
+
+@dataclass
+class RestartState:
+    """
+    Restart history of one server, deciding how long to wait before the next restart.
+    >>> state = RestartState()
+    >>> policy = RestartPolicy(mode=ON_CRASH, max_crashes=3)
+    >>> [state.next_restart(policy, crashed=True, requested=False, uptime=5) for _ in range(3)]
+    [10.0, 20.0, None]
+    >>> state.tripped
+    True
+    """
+    crashes: deque = field(default_factory=deque)  # monotonic times of recent crashes
+    delay: (float, None) = None  # backoff of the next restart, None before the first one
+    tripped: bool = False  # the crash-loop breaker stopped restarting until the next manual launch
+
+    def reset(self) -> None:
+        """Forgets the history, ie on a manual launch."""
+        self.crashes.clear()
+        self.delay = None
+        self.tripped = False
+
+    def next_restart(self, policy: RestartPolicy, crashed: bool, requested: bool, uptime: float) -> (float, None):
+        """
+        Records an exit and returns the seconds to wait before restarting, None to leave the server stopped.
+        :param policy: The server's restart policy
+        :param crashed: Whether the exit was a crash
+        :param requested: Whether the bot asked the server to stop, which never restarts it
+        :param uptime: Seconds the process ran
+        """
+        if requested or policy.mode == NEVER or (policy.mode == ON_CRASH and not crashed):
+            return None
+        now: float = monotonic()
+        # a long enough run means the last crashes are over
+        if uptime >= policy.window:
+            self.crashes.clear()
+            self.delay = None
+        if crashed:
+            self.crashes.append(now)
+            while self.crashes and self.crashes[0] < now - policy.window:
+                self.crashes.popleft()
+            if len(self.crashes) >= policy.max_crashes:
+                self.tripped = True
+                return None
+        self.delay = policy.backoff if self.delay is None else min(self.delay * 2, policy.backoff_max)
+        return self.delay
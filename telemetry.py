@@ -0,0 +1,220 @@
+import os
+import re
+from collections import deque
+from dataclasses import dataclass
+from time import monotonic
+
+CLOCK_TICKS: int = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+PAGE_SIZE: int = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+REPLY_TIMEOUT: float = 10.0  # seconds a reply to the sampler's own command is waited for
+
+# Replies of the performance commands of common servers, right after the header of the line, see server_state,
+# so chat quoting them is not taken for one. The MSPT values follow on the line after their header.
+_HEADER: str = r"^\[[^\]]*\](?: \[[^\]]*\])*: "
+_PAPER_TPS_PATTERN: re.Pattern = re.compile(_HEADER + r"TPS from last 1m, 5m, 15m: \*?(?P<tps>[\d.]+)")
+_PAPER_MSPT_HEADER_PATTERN: re.Pattern = re.compile(_HEADER + r"Server tick times \(avg/min/max\)")
+_PAPER_MSPT_PATTERN: re.Pattern = re.compile(r"(?P<avg>[\d.]+)/(?P<min>[\d.]+)/(?P<max>[\d.]+)")
+_FORGE_TPS_PATTERN: re.Pattern = re.compile(_HEADER + r"Overall\s*: Mean tick time: (?P<mspt>[\d.]+) ms\. "
+                                             r"Mean TPS: (?P<tps>[\d.]+)")
+_VANILLA_DEBUG_PATTERN: re.Pattern = re.compile(_HEADER + r"Stopped (tick )?(profiling|debug profiling).*"
+                                                r"\((?P<tps>[\d.]+) ticks per second\)")
+
+
+@dataclass
+class Sample:
+    """A single measurement of a server process."""
+    at: float  # monotonic time
+    cpu: float  # percent of one core, may exceed 100
+    rss: float  # MB
+    threads: int
+    read_bytes: int
+    write_bytes: int
+    tps: (float, None) = None
+    mspt: (float, None) = None
+
+
+def read_proc_stats(pid: int) -> (dict, None):
+    """
+    Reads a process' CPU time, RSS, thread count and I/O counters from /proc.
+    :return: Dictionary of cpu_ticks, rss, threads, read_bytes and write_bytes. None without /proc or process.
+    >>> read_proc_stats(os.getpid())["threads"] >= 1
+    True
+    """
+    try:
+        with open(f"/proc/{pid}/stat", 'r') as stat_file:
+            # the command name may contain spaces, the fields we need come after its closing parenthesis
+            fields: list[str] = stat_file.read().rpartition(")")[2].split()
+        with open(f"/proc/{pid}/statm", 'r') as statm_file:
+            rss_pages: int = int(statm_file.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+
+    io: dict[str, int] = {}
+    try:
+        with open(f"/proc/{pid}/io", 'r') as io_file:
+            for line in io_file:
+                key, _, value = line.partition(":")
+                io[key] = int(value)
+    except (OSError, ValueError):
+        pass  # /proc/<pid>/io needs the same user or ptrace rights
+
+    return {
+        # fields after the command: state is [0], utime [11], stime [12], num_threads [17]
+        "cpu_ticks": int(fields[11]) + int(fields[12]),
+        "threads": int(fields[17]),
+        "rss": rss_pages * PAGE_SIZE,
+        "read_bytes": io.get("read_bytes", 0),
+        "write_bytes": io.get("write_bytes", 0),
+    }
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """
+    Nearest-rank percentile.
+    >>> percentile([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], 95)
+    10
+    """
+    ordered: list[float] = sorted(values)
+    rank: int = max(0, min(len(ordered) - 1, -(-len(ordered) * percent // 100) - 1))
+    return ordered[int(rank)]
+
+
+class TelemetrySampler:
+    """
+    Samples a server process into a fixed size ring buffer, and parses TPS/MSPT replies from its stdout.
+    Only the replies to its own requests are kept from the relay, a user's tps command is answered as usual.
+    >>> sampler = TelemetrySampler(os.getpid())
+    >>> sample = sampler.sample()
+    >>> sample.rss > 0, sample.threads >= 1, sample.tps
+    (True, True, None)
+    >>> sampler.feed("[18:03:11] [Server thread/INFO]: TPS from last 1m, 5m, 15m: 19.98, 20.0, 20.0")
+    False
+    >>> sampler.request()
+    >>> sampler.feed("[18:03:21] [Server thread/INFO]: <Steve> TPS from last 1m, 5m, 15m: 1.0, 1.0, 1.0")
+    False
+    >>> sampler.feed("[18:03:21] [Server thread/INFO]: TPS from last 1m, 5m, 15m: 19.98, 20.0, 20.0")
+    True
+    >>> sampler.sample().tps
+    19.98
+    """
+
+    def __init__(self, pid: int, size: int = 720):
+        """
+        :param pid: Process id of the server
+        :param size: Amount of samples kept, the oldest being dropped first
+        """
+        self.pid: int = pid
+        self.samples: deque[Sample] = deque(maxlen=size)
+        self._last_ticks: (int, None) = None
+        self._last_at: (float, None) = None
+        self._tps: (float, None) = None
+        self._mspt: (float, None) = None
+        self._expect_mspt: bool = False
+        self._requested_at: (float, None) = None  # monotonic time of the sampler's unanswered command
+        self._alerting: set[str] = set()
+
+    @property
+    def latest(self) -> (Sample, None):
+        return self.samples[-1] if self.samples else None
+
+    def request(self) -> None:
+        """Tells that the performance command was just sent, so its reply is not relayed."""
+        self._requested_at = monotonic()
+
+    @property
+    def _requesting(self) -> bool:
+        """The sampler's command was sent and not answered yet."""
+        return self._requested_at is not None and monotonic() - self._requested_at < REPLY_TIMEOUT
+
+    def _answered(self) -> bool:
+        """Ends the outstanding request. Returns True if there was one, so the reply is not relayed."""
+        requested: bool = self._requesting
+        self._requested_at = None
+        return requested
+
+    def feed(self, line: str) -> bool:
+        """
+        Parses performance command replies, whoever asked for them.
+        :param line: A single console line
+        :return: True if the line answers the sampler's own request, so it does not need to be relayed
+        """
+        if self._expect_mspt:
+            self._expect_mspt = False
+            mspt: (re.Match, None) = _PAPER_MSPT_PATTERN.search(line)
+            if mspt:
+                self._mspt = float(mspt.group("avg"))
+                return self._answered()
+        if _PAPER_MSPT_HEADER_PATTERN.search(line):
+            self._expect_mspt = True
+            return self._requesting  # the values line ends the request
+
+        match: (re.Match, None) = _PAPER_TPS_PATTERN.search(line) or _VANILLA_DEBUG_PATTERN.search(line)
+        if match:
+            self._tps = float(match.group("tps"))
+            return self._answered()
+        match = _FORGE_TPS_PATTERN.search(line)
+        if match:
+            self._tps, self._mspt = float(match.group("tps")), float(match.group("mspt"))
+            return self._answered()
+        return False
+
+    def sample(self) -> (Sample, None):
+        """
+        Takes a sample of the process, with the last parsed TPS and MSPT.
+        :return: The new sample. None if the process can not be read.
+        """
+        stats: (dict, None) = read_proc_stats(self.pid)
+        if stats is None:
+            return None
+        now: float = monotonic()
+        cpu: float = 0.0
+        if self._last_ticks is not None and now > self._last_at:
+            cpu = (stats["cpu_ticks"] - self._last_ticks) / CLOCK_TICKS / (now - self._last_at) * 100
+        self._last_ticks, self._last_at = stats["cpu_ticks"], now
+
+        sample: Sample = Sample(at=now, cpu=cpu, rss=stats["rss"] / 1024 ** 2, threads=stats["threads"],
+                                read_bytes=stats["read_bytes"], write_bytes=stats["write_bytes"],
+                                tps=self._tps, mspt=self._mspt)
+        self._tps, self._mspt = None, None  # every reply is used once
+        self.samples.append(sample)
+        return sample
+
+    def window(self, seconds: float) -> list[Sample]:
+        """Samples of the last seconds, oldest first."""
+        since: float = monotonic() - seconds
+        return [sample for sample in self.samples if sample.at >= since]
+
+    def summary(self, metric: str, seconds: float) -> (tuple[float, float, float], None):
+        """
+        Min, average and 95th percentile of a metric over the last seconds.
+        :param metric: Name of a Sample field, ie cpu, rss, tps or mspt
+        :return: (min, avg, p95), None if there is no value in the window
+        """
+        values: list[float] = [getattr(sample, metric) for sample in self.window(seconds)
+                               if getattr(sample, metric) is not None]
+        if not values:
+            return None
+        return min(values), sum(values) / len(values), percentile(values, 95)
+
+    def check_alerts(self, thresholds: dict[str, float], duration: float) -> list[str]:
+        """
+        Returns a message for every metric which stayed above its threshold for the whole duration,
+        and for every alerting metric which recovered. A metric alerts once until it recovers.
+        :param thresholds: Metric name to threshold, ie {"mspt": 50, "rss": 6144}
+        :param duration: Seconds a metric must stay above its threshold
+        """
+        messages: list[str] = []
+        window: list[Sample] = self.window(duration)
+        covered: bool = bool(window) and self.samples[0].at <= monotonic() - duration
+        for metric, threshold in thresholds.items():
+            values: list[float] = [getattr(sample, metric) for sample in window if getattr(sample, metric) is not None]
+            above: bool = covered and bool(values) and min(values) > threshold
+            if above and metric not in self._alerting:
+                self._alerting.add(metric)
+                messages.append(f"Alert: {metric} above {threshold:g} for {duration:.0f} s "
+                                f"(now {values[-1]:.1f}).")
+            elif metric in self._alerting and values and values[-1] <= threshold:
+                self._alerting.discard(metric)
+                messages.append(f"Recovered: {metric} back under {threshold:g} (now {values[-1]:.1f}).")
+        return messages